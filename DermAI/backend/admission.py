@@ -0,0 +1,209 @@
+"""
+Admission control for the DermAI inference service.
+
+Requests no longer run the model on the Flask thread that received them.
+They are admitted into a bounded queue served by a small pool of inference
+workers. A request is rejected up front (503 + Retry-After) when the queue
+is full or when the estimated queueing + service time cannot meet its
+deadline. Queued work is dropped unscored when its deadline has already
+passed, or when its caller has stopped waiting for it.
+
+Jobs run in a copy of the submitting thread's context, so a sampled
+request trace (tracing.py) follows the request onto the worker and
+records its queue wait. Inside a job, current_job is the job itself, so
+load checks made from it (shadow.py) can leave out its own cost.
+"""
+
+import contextvars
+import logging
+import math
+import queue
+import threading
+import time
+from tracing import record_span
+
+logger = logging.getLogger(__name__)
+
+# The job a worker is running, as seen from code running inside it
+current_job = contextvars.ContextVar('current_job', default=None)
+
+
+class AdmissionRejected(Exception):
+    """The request was shed before running; retry_after is in whole seconds"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    """The request was admitted but did not finish before its deadline"""
+
+
+class _Job:
+    __slots__ = ('fn', 'cost', 'deadline', 'done', 'result', 'error', 'abandoned', 'context', 'enqueued')
+
+    def __init__(self, fn, cost, deadline):
+        self.fn = fn
+        self.cost = cost
+        self.deadline = deadline
+        self.context = contextvars.copy_context()
+        self.enqueued = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.abandoned = False
+
+
+class InferenceQueue:
+    def __init__(self, max_depth=16, workers=1, name='inference', initializer=None):
+        self.max_depth = max_depth
+        self.workers = workers
+        self.jobs = queue.Queue(maxsize=max_depth)
+        self.lock = threading.Lock()
+        self.queued_cost = 0
+        self.active_cost = 0
+        # Called once on each worker thread before it takes jobs (e.g. CPU pinning)
+        self.initializer = initializer
+        # Exponentially-weighted service time per unit of cost (one image)
+        self.service_ms = None
+        self.counters = {
+            'admitted': 0,
+            'completed': 0,
+            'failed': 0,
+            'rejected_queue_full': 0,
+            'rejected_deadline': 0,
+            'dropped_expired': 0,
+            'dropped_abandoned': 0,
+            'timed_out': 0
+        }
+
+        for i in range(workers):
+            threading.Thread(target=self._worker, name=f'{name}-worker-{i}', daemon=True).start()
+
+    def _count(self, key):
+        with self.lock:
+            self.counters[key] += 1
+
+    def estimated_wait_ms(self, cost=1):
+        """Expected time until a new job of this cost would finish.
+
+        Running jobs count in full: a worker busy with a 16-image batch
+        delays the new job as much as 16 queued images would.
+        """
+        if self.service_ms is None:
+            return 0.0
+        pending = self.load()
+        return (pending / self.workers + cost) * self.service_ms
+
+    def load(self):
+        """Cost queued or currently running, used for least-loaded routing"""
+        with self.lock:
+            return self.queued_cost + self.active_cost
+
+    def _retry_after(self):
+        return max(1, math.ceil(self.estimated_wait_ms() / 1000))
+
+    def check_admission(self, deadline, cost=1):
+        """Raise AdmissionRejected if a job could not be queued or finished in time.
+
+        Cheap enough to call before reading the request body, so shed
+        requests never pay for an upload decode.
+        """
+        if not math.isfinite(deadline):
+            raise ValueError(f"Deadline must be a finite time.monotonic() value, got {deadline}")
+        if self.jobs.full():
+            self._count('rejected_queue_full')
+            raise AdmissionRejected('queue_full', self._retry_after())
+
+        remaining_ms = (deadline - time.monotonic()) * 1000
+        if self.estimated_wait_ms(cost) > remaining_ms:
+            self._count('rejected_deadline')
+            raise AdmissionRejected('deadline', self._retry_after())
+
+    def run(self, fn, deadline, cost=1):
+        """Queue fn() for a worker and block until it finishes or the deadline passes"""
+        self.check_admission(deadline, cost)
+
+        job = _Job(fn, cost, deadline)
+        try:
+            with self.lock:
+                self.queued_cost += cost
+            self.jobs.put_nowait(job)
+        except queue.Full:
+            with self.lock:
+                self.queued_cost -= cost
+            self._count('rejected_queue_full')
+            raise AdmissionRejected('queue_full', self._retry_after())
+        self._count('admitted')
+
+        if not job.done.wait(timeout=max(0.0, deadline - time.monotonic())):
+            # The caller is giving up; make sure a worker doesn't spend time on it
+            job.abandoned = True
+            self._count('timed_out')
+            raise DeadlineExceeded()
+
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def _worker(self):
+        if self.initializer is not None:
+            self.initializer()
+        while True:
+            job = self.jobs.get()
+            with self.lock:
+                self.queued_cost -= job.cost
+
+            if job.abandoned:
+                self._count('dropped_abandoned')
+                continue
+            if time.monotonic() > job.deadline:
+                self._count('dropped_expired')
+                job.error = DeadlineExceeded()
+                job.done.set()
+                continue
+
+            with self.lock:
+                self.active_cost += job.cost
+            start = time.perf_counter()
+            try:
+                job.result = job.context.run(self._execute, job, start)
+                self._count('completed')
+            except Exception as e:
+                job.error = e
+                self._count('failed')
+            with self.lock:
+                self.active_cost -= job.cost
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self._record_service_time(elapsed_ms / job.cost)
+            job.done.set()
+
+    @staticmethod
+    def _execute(job, start):
+        current_job.set(job)
+        record_span('queue_wait', job.enqueued, start)
+        return job.fn()
+
+    def _record_service_time(self, per_unit_ms):
+        with self.lock:
+            if self.service_ms is None:
+                self.service_ms = per_unit_ms
+            else:
+                self.service_ms = 0.8 * self.service_ms + 0.2 * per_unit_ms
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats['queue_depth'] = self.jobs.qsize()
+            stats['queued_cost'] = self.queued_cost
+            stats['active_cost'] = self.active_cost
+            stats['max_depth'] = self.max_depth
+            stats['workers'] = self.workers
+            stats['service_ms_per_image'] = self.service_ms
+        stats['shed_total'] = (
+            stats['rejected_queue_full'] + stats['rejected_deadline'] +
+            stats['dropped_expired'] + stats['dropped_abandoned']
+        )
+        return stats
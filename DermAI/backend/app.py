@@ -1,207 +1,213 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, jsonify
 from flask_cors import CORS
-import tensorflow as tf
-import numpy as np
-from PIL import Image
-import io
+from werkzeug.exceptions import RequestEntityTooLarge
 import os
-import json
 import logging
+import math
+import time
 from datetime import datetime
-import cv2
+from admission import AdmissionRejected, DeadlineExceeded
+from replicas import (INTER_OP_THREADS, INTRA_OP_THREADS, MODEL_REPLICAS, REPLICA_CPUS, REPLICA_ROUTING,
+                      ReplicaPool, configure_tf_threads, parse_cpu_sets)
+from ingestion import BatchBudget, ImageIngestor, ImageRejected, configure_app, upload_sha256
+from profiling import configure_profiling
+from tracing import current_trace, span
+from cascade import CASCADE_MODEL, CascadeGate
+from tiling import TILE_MODES
+from prediction_log import PREDICTION_LOG, PredictionLog, configure_prediction_log
+from upload_store import UploadStore
+from near_duplicate import NEAR_DUP_CAPACITY, NearDuplicateIndex
+from shadow import (SHADOW_MAX_PRIMARY_LOAD, SHADOW_MODEL, SHADOW_MODEL_INFO, SHADOW_QUEUE_DEPTH,
+                    SHADOW_SAMPLE_RATE, ShadowScorer)
+from dataset_metadata import CUBE_DIMENSIONS, DX_CODES, METADATA_FILE, load_metadata
+from similarity import DX_NAMES, SIMILAR_DEFAULT_K, SIMILAR_MAX_K, SimilarityIndex
+from responses import configure_json, validate_response_format
+from predictor import TTA_MODES, DermAIPredictor
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class DermAIPredictor:
-    def __init__(self, model_path='models/dermai_model.h5', model_info_path='models/model_info.json'):
-        self.model_path = model_path
-        self.model_info_path = model_info_path
-        self.model = None
-        self.model_info = None
-        self.img_size = (224, 224)
-        
-        # Load model and info
-        self.load_model()
-        self.load_model_info()
-    
-    def load_model(self):
-        """Load the trained model"""
-        try:
-            if os.path.exists(self.model_path):
-                self.model = tf.keras.models.load_model(self.model_path)
-                logger.info("Model loaded successfully")
-            else:
-                logger.error(f"Model file not found: {self.model_path}")
-                raise FileNotFoundError(f"Model file not found: {self.model_path}")
-        except Exception as e:
-            logger.error(f"Error loading model: {str(e)}")
-            raise
-    
-    def load_model_info(self):
-        """Load model information"""
-        try:
-            if os.path.exists(self.model_info_path):
-                with open(self.model_info_path, 'r') as f:
-                    self.model_info = json.load(f)
-                logger.info("Model info loaded successfully")
-            else:
-                logger.warning("Model info file not found, using defaults")
-                self.model_info = {
-                    'class_names': [
-                        'melanoma', 'nevus', 'basal_cell_carcinoma', 
-                        'actinic_keratosis', 'benign_keratosis', 
-                        'dermatofibroma', 'vascular_lesion'
-                    ]
-                }
-        except Exception as e:
-            logger.error(f"Error loading model info: {str(e)}")
-            self.model_info = {
-                'class_names': [
-                    'melanoma', 'nevus', 'basal_cell_carcinoma', 
-                    'actinic_keratosis', 'benign_keratosis', 
-                    'dermatofibroma', 'vascular_lesion'
-                ]
-            }
-    
-    def preprocess_image(self, image):
-        """Preprocess image for prediction"""
-        try:
-            # Convert to RGB if necessary
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            
-            # Resize image
-            image = image.resize(self.img_size)
-            
-            # Convert to array and normalize
-            image_array = np.array(image) / 255.0
-            
-            # Add batch dimension
-            image_array = np.expand_dims(image_array, axis=0)
-            
-            return image_array
-        except Exception as e:
-            logger.error(f"Error preprocessing image: {str(e)}")
-            raise
-    
-    def predict(self, image):
-        """Make prediction on image"""
-        try:
-            # Preprocess image
-            processed_image = self.preprocess_image(image)
-            
-            # Make prediction
-            predictions = self.model.predict(processed_image)
-            probabilities = predictions[0]
-            
-            # Get class names
-            class_names = self.model_info['class_names']
-            
-            # Create results
-            results = []
-            for i, prob in enumerate(probabilities):
-                results.append({
-                    'disease': class_names[i],
-                    'confidence': float(prob),
-                    'percentage': float(prob * 100)
-                })
-            
-            # Sort by confidence
-            results = sorted(results, key=lambda x: x['confidence'], reverse=True)
-            
-            # Get top prediction
-            top_prediction = results[0]
-            
-            # Determine risk level based on confidence and disease type
-            risk_level = self.determine_risk_level(top_prediction['disease'], top_prediction['confidence'])
-            
-            return {
-                'success': True,
-                'prediction': {
-                    'disease': top_prediction['disease'],
-                    'confidence': top_prediction['confidence'],
-                    'percentage': top_prediction['percentage'],
-                    'risk_level': risk_level
-                },
-                'all_predictions': results,
-                'recommendation': self.get_recommendation(top_prediction['disease'], risk_level),
-                'timestamp': datetime.now().isoformat()
-            }
-            
-        except Exception as e:
-            logger.error(f"Error during prediction: {str(e)}")
-            return {
-                'success': False,
-                'error': str(e),
-                'timestamp': datetime.now().isoformat()
-            }
-    
-    def determine_risk_level(self, disease, confidence):
-        """Determine risk level based on disease and confidence"""
-        high_risk_diseases = ['melanoma', 'basal_cell_carcinoma']
-        
-        if disease in high_risk_diseases:
-            if confidence > 0.8:
-                return 'HIGH'
-            elif confidence > 0.6:
-                return 'MODERATE'
-            else:
-                return 'LOW'
-        else:
-            if confidence > 0.9:
-                return 'MODERATE'
-            elif confidence > 0.7:
-                return 'LOW'
-            else:
-                return 'VERY_LOW'
-    
-    def get_recommendation(self, disease, risk_level):
-        """Get recommendation based on prediction"""
-        recommendations = {
-            'HIGH': "⚠️ HIGH RISK: Please consult a dermatologist immediately. This condition requires urgent medical attention.",
-            'MODERATE': "⚡ MODERATE RISK: Schedule an appointment with a dermatologist within a week for proper evaluation.",
-            'LOW': "✅ LOW RISK: Monitor the condition and consult a doctor if symptoms worsen or persist.",
-            'VERY_LOW': "✅ VERY LOW RISK: Continue regular skin monitoring. Consult a doctor if you notice any changes."
-        }
-        
-        disease_info = {
-            'melanoma': "A serious form of skin cancer that can spread to other parts of the body.",
-            'nevus': "A common type of mole that is usually benign.",
-            'basal_cell_carcinoma': "The most common type of skin cancer, usually slow-growing.",
-            'actinic_keratosis': "Rough, scaly patches that may develop into skin cancer if left untreated.",
-            'benign_keratosis': "Non-cancerous skin growths that are usually harmless.",
-            'dermatofibroma': "A benign skin nodule that typically doesn't require treatment.",
-            'vascular_lesion': "Blood vessel abnormalities that are usually benign."
-        }
-        
-        return {
-            'risk_message': recommendations.get(risk_level, recommendations['LOW']),
-            'disease_info': disease_info.get(disease, "Please consult a healthcare professional for proper diagnosis."),
-            'general_advice': "This AI prediction is for informational purposes only and should not replace professional medical advice."
-        }
+# Admission control: bounded inference queue and default per-request budget
+MAX_QUEUE_DEPTH = int(os.environ.get('DERMAI_MAX_QUEUE_DEPTH', 16))
+INFERENCE_WORKERS = int(os.environ.get('DERMAI_INFERENCE_WORKERS', 1))
+DEFAULT_DEADLINE_MS = float(os.environ.get('DERMAI_DEFAULT_DEADLINE_MS', 30000))
+# Upper bound on a caller-supplied X-Request-Deadline budget
+MAX_DEADLINE_MS = float(os.environ.get('DERMAI_MAX_DEADLINE_MS', 300000))
 
 # Initialize Flask app
 app = Flask(__name__)
 CORS(app)
+# Request size cap and disk spooling for uploads
+configure_app(app)
+# orjson-backed jsonify when available
+configure_json(app)
+# Sampled request traces and the token-guarded /admin/ profiling endpoints
+profiler = configure_profiling(app)
+
+# TF thread pools have to be sized before the model runs its first op
+configure_tf_threads(INTRA_OP_THREADS, INTER_OP_THREADS)
 
 # Initialize predictor
 predictor = None
+replicas = []
 
 def init_predictor():
-    """Initialize the predictor"""
-    global predictor
+    """Initialize the predictor and any extra model replicas"""
+    global predictor, replicas
     try:
         predictor = DermAIPredictor()
-        logger.info("DermAI Predictor initialized successfully")
+        replicas = [predictor] + [DermAIPredictor() for _ in range(MODEL_REPLICAS - 1)]
+        logger.info(f"DermAI Predictor initialized successfully ({len(replicas)} replica(s))")
     except Exception as e:
         logger.error(f"Failed to initialize predictor: {str(e)}")
         predictor = None
+        replicas = []
 
 # Initialize predictor on startup
 init_predictor()
 
+# All model work runs on the replicas' queue workers, never on the request thread
+# Without a loaded model there is nothing to pin, and the service still starts
+inference_queue = ReplicaPool(
+    replicas or [None],
+    routing=REPLICA_ROUTING,
+    cpu_sets=parse_cpu_sets(REPLICA_CPUS, len(replicas)) if replicas else None,
+    max_depth=MAX_QUEUE_DEPTH,
+    workers_per_replica=INFERENCE_WORKERS
+)
+
+# Cheap first-stage model in front of the full CNN
+cascade = None
+if CASCADE_MODEL and predictor is not None:
+    try:
+        cascade = CascadeGate.load(CASCADE_MODEL, predictor.templates.class_names)
+        for replica in replicas:
+            replica.cascade = cascade
+    except Exception as e:
+        logger.error(f"Failed to load cascade model: {str(e)}")
+
+# Candidate model scored off the response path on a sample of live traffic
+shadow = None
+if SHADOW_MODEL and predictor is not None:
+    try:
+        shadow = ShadowScorer(
+            DermAIPredictor(model_path=SHADOW_MODEL, model_info_path=SHADOW_MODEL_INFO or predictor.model_info_path),
+            predictor.templates.class_names,
+            primary_load=inference_queue.load,
+            sample_rate=SHADOW_SAMPLE_RATE,
+            max_depth=SHADOW_QUEUE_DEPTH,
+            max_primary_load=SHADOW_MAX_PRIMARY_LOAD or len(replicas)
+        )
+        for replica in replicas:
+            replica.shadow = shadow
+        logger.info(f"Shadow model {SHADOW_MODEL} scoring {SHADOW_SAMPLE_RATE:.0%} of predictions")
+    except Exception as e:
+        logger.error(f"Failed to load shadow model: {str(e)}")
+
+# Perceptual-hash cache shared by the replicas, so a re-upload is answered without the CNN
+near_duplicates = None
+if NEAR_DUP_CAPACITY and predictor is not None:
+    near_duplicates = NearDuplicateIndex()
+    for replica in replicas:
+        replica.near_duplicates = near_duplicates
+
+# Append-only SQLite log of every answer, queried through /admin/predictions
+prediction_log = None
+if PREDICTION_LOG and predictor is not None:
+    try:
+        prediction_log = PredictionLog(PREDICTION_LOG, predictor.templates.class_names)
+        for replica in replicas:
+            replica.prediction_log = prediction_log
+    except Exception as e:
+        logger.error(f"Failed to open prediction log: {str(e)}")
+configure_prediction_log(app, prediction_log)
+
+# Byte/pixel limits and reduced-resolution decode for uploads
+ingestor = ImageIngestor()
+
+# Content-addressed, hash-sharded copies of accepted uploads, with optional age/size retention
+upload_store = UploadStore()
+upload_store.start()
+
+# Similar-case index built offline by similarity.py; picked up again whenever it is republished
+similarity_index = SimilarityIndex()
+similarity_index.maybe_reload()
+
+def request_deadline():
+    """Absolute deadline (time.monotonic) from the X-Request-Deadline header, a budget in milliseconds.
+
+    Unparseable, non-finite (inf, nan) and non-positive budgets fall back to
+    DEFAULT_DEADLINE_MS; budgets above MAX_DEADLINE_MS are clamped to it.
+    """
+    try:
+        budget_ms = float(request.headers.get('X-Request-Deadline', DEFAULT_DEADLINE_MS))
+    except ValueError:
+        budget_ms = DEFAULT_DEADLINE_MS
+    if not (math.isfinite(budget_ms) and budget_ms > 0):
+        budget_ms = DEFAULT_DEADLINE_MS
+    return time.monotonic() + min(budget_ms, MAX_DEADLINE_MS) / 1000
+
+def overloaded_response(rejection):
+    response = jsonify({
+        'success': False,
+        'error': 'Server is at capacity, please retry later',
+        'reason': rejection.reason,
+        'timestamp': datetime.now().isoformat()
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = str(rejection.retry_after)
+    return response
+
+def deadline_exceeded_response():
+    return jsonify({
+        'success': False,
+        'error': 'Prediction did not complete before the request deadline',
+        'timestamp': datetime.now().isoformat()
+    }), 504
+
+def requested_tta_mode():
+    """Per-request TTA override from the 'tta' form field or query string (None = server default)"""
+    value = request.form.get('tta', request.args.get('tta'))
+    if not value:
+        return None
+    value = value.lower()
+    if value in ('1', 'true', 'yes'):
+        return 'always'
+    if value in ('0', 'false', 'no'):
+        return 'off'
+    return value
+
+def requested_tile_mode():
+    """Per-request tiled-inference override from the 'tiles' form field or query string (None = server default)"""
+    value = request.form.get('tiles', request.args.get('tiles'))
+    if not value:
+        return None
+    value = value.lower()
+    if value in ('1', 'true', 'yes'):
+        return 'mean'
+    if value in ('0', 'false', 'no'):
+        return 'off'
+    return value
+
+def image_cost(tile_mode):
+    """Admission cost of one image: its tile budget when tiled, else 1"""
+    tile_mode = predictor.tile_mode if tile_mode is None else tile_mode
+    return predictor.tiler.budget if tile_mode != 'off' else 1
+
+def prediction_context(endpoint, file):
+    """What the prediction log records about an upload's request (None when the log is off)"""
+    if prediction_log is None:
+        return None
+    # A traced request without X-Request-ID gets a generated ID; log that one so rows join to traces
+    trace = current_trace.get()
+    request_id = trace.request_id if trace is not None else request.headers.get('X-Request-ID')
+    return {'endpoint': endpoint, 'input_hash': upload_sha256(file), 'request_id': request_id}
+
+def requested_response_format():
+    """Per-request 'response' form field or query value (None = server default); raises ValueError"""
+    return validate_response_format(request.form.get('response', request.args.get('response')))
+
 @app.route('/')
 def home():
     """Home endpoint"""
@@ -221,6 +227,21 @@ def health_check():
         'timestamp': datetime.now().isoformat()
     })
 
+@app.route('/stats')
+def stats():
+    """Admission and load-shedding counters"""
+    return jsonify({
+        'admission': inference_queue.stats(),
+        'ingestion': ingestor.stats(),
+        'similarity': similarity_index.stats(),
+        'shadow': shadow.stats() if shadow is not None else None,
+        'cascade': cascade.stats() if cascade is not None else None,
+        'prediction_log': prediction_log.stats() if prediction_log is not None else None,
+        'uploads': upload_store.stats(),
+        'near_duplicate': near_duplicates.stats() if near_duplicates is not None else None,
+        'timestamp': datetime.now().isoformat()
+    })
+
 @app.route('/model-info')
 def model_info():
     """Get model information"""
@@ -233,6 +254,105 @@ def model_info():
         'timestamp': datetime.now().isoformat()
     })
 
+@app.route('/dataset-stats')
+def dataset_stats():
+    """HAM10000 counts grouped and filtered by dx, localization, age_band, sex or dx_type"""
+    try:
+        metadata = load_metadata(METADATA_FILE)
+    except OSError:
+        return jsonify({'error': 'Dataset metadata not available'}), 503
+    
+    group_by = [dim for dim in request.args.get('group_by', 'dx').split(',') if dim]
+    filters = {dim: request.args[dim].split(',') for dim in CUBE_DIMENSIONS if request.args.get(dim)}
+    
+    start = time.perf_counter()
+    try:
+        rows, total = metadata.group_counts(group_by, filters)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    query_us = (time.perf_counter() - start) * 1e6
+    
+    return jsonify({
+        'success': True,
+        'group_by': group_by,
+        'filters': filters,
+        'total': total,
+        'groups': rows,
+        'query_us': query_us,
+        'timestamp': datetime.now().isoformat()
+    })
+
+@app.route('/similar', methods=['GET', 'POST'])
+def similar_cases():
+    """Most similar confirmed HAM10000 cases, for a dataset image_id or an uploaded image"""
+    try:
+        similarity_index.maybe_reload()
+        if not similarity_index.loaded:
+            return jsonify({'error': 'Similarity index not built. Run similarity.py'}), 503
+        
+        params = request.values
+        try:
+            k = min(max(int(params.get('k', SIMILAR_DEFAULT_K)), 1), SIMILAR_MAX_K)
+        except ValueError:
+            return jsonify({'error': 'k must be an integer'}), 400
+        dx = params.get('dx')
+        if dx is not None:
+            # Accept either the raw HAM10000 code or the class name
+            dx = DX_CODES.get(dx, dx)
+            if dx not in DX_NAMES:
+                return jsonify({'error': f"Unknown dx: {params.get('dx')}"}), 400
+        unique_lesions = params.get('unique_lesions', '1').lower() not in ('0', 'false', 'no')
+        image_id = params.get('image_id')
+        
+        if image_id:
+            query = similarity_index.vector(image_id)
+            if query is None:
+                return jsonify({'error': f"Unknown image_id: {image_id}"}), 404
+        else:
+            if predictor is None:
+                return jsonify({'error': 'Model not loaded'}), 500
+            if 'file' not in request.files:
+                return jsonify({'error': 'Provide an image_id or upload a file'}), 400
+            if similarity_index.version != predictor.model_version:
+                # Index embeddings come from another model; they are not comparable with this one
+                return jsonify({'error': 'Similarity index is being rebuilt for the current model'}), 409
+            
+            deadline = request_deadline()
+            try:
+                inference_queue.check_admission(deadline)
+                image = ingestor.open(request.files['file'])
+                query = inference_queue.run(lambda replica: replica.embed(image), deadline)
+            except ImageRejected as rejection:
+                return jsonify({'error': rejection.message}), rejection.status
+            except AdmissionRejected as rejection:
+                return overloaded_response(rejection)
+            except DeadlineExceeded:
+                return deadline_exceeded_response()
+        
+        start = time.perf_counter()
+        results = similarity_index.search(query, k=k, dx=dx, unique_lesions=unique_lesions,
+                                          exclude_image_id=image_id)
+        search_ms = (time.perf_counter() - start) * 1000
+        
+        return jsonify({
+            'success': True,
+            'results': results,
+            'index_version': similarity_index.version,
+            'search_ms': search_ms,
+            'timestamp': datetime.now().isoformat()
+        })
+        
+    except RequestEntityTooLarge:
+        # Body exceeded MAX_CONTENT_LENGTH; answered by the 413 handler
+        raise
+    except Exception as e:
+        logger.error(f"Error in similar endpoint: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': 'Internal server error occurred during similarity search',
+            'timestamp': datetime.now().isoformat()
+        }), 500
+
 @app.route('/predict', methods=['POST'])
 def predict_disease():
     """Predict skin disease from uploaded image"""
@@ -241,6 +361,13 @@ def predict_disease():
         if predictor is None:
             return jsonify({'error': 'Model not loaded'}), 500
         
+        # Shed load before the upload is read or decoded
+        deadline = request_deadline()
+        try:
+            inference_queue.check_admission(deadline)
+        except AdmissionRejected as rejection:
+            return overloaded_response(rejection)
+        
         # Check if file is uploaded
         if 'file' not in request.files:
             return jsonify({'error': 'No file uploaded'}), 400
@@ -257,29 +384,51 @@ def predict_disease():
         if file_extension not in allowed_extensions:
             return jsonify({'error': 'Invalid file type. Please upload an image file.'}), 400
         
-        # Read and process image
-        image_bytes = file.read()
-        image = Image.open(io.BytesIO(image_bytes))
+        tta_mode = requested_tta_mode()
+        if tta_mode is not None and tta_mode not in TTA_MODES:
+            return jsonify({'error': f"Invalid tta value. Use one of: {', '.join(TTA_MODES)}"}), 400
+        tile_mode = requested_tile_mode()
+        if tile_mode is not None and tile_mode not in TILE_MODES:
+            return jsonify({'error': f"Invalid tiles value. Use one of: {', '.join(TILE_MODES)}"}), 400
+        try:
+            response_format = requested_response_format()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # Check limits from the image header; pixels are decoded later by the model worker
+        try:
+            with span('ingest'):
+                log_context = prediction_context('predict', file)
+                image = ingestor.open(file)
+        except ImageRejected as rejection:
+            return jsonify({'error': rejection.message}), rejection.status
         
         # Make prediction
-        result = predictor.predict(image)
+        try:
+            result = inference_queue.run(
+                lambda replica: replica.predict(image, tta_mode=tta_mode, response_format=response_format,
+                                                tile_mode=tile_mode, log_context=log_context),
+                deadline, cost=image_cost(tile_mode)
+            )
+        except AdmissionRejected as rejection:
+            return overloaded_response(rejection)
+        except DeadlineExceeded:
+            return deadline_exceeded_response()
         
-        # Save uploaded image (optional)
+        # Save uploaded image (optional), once per distinct content
         if result['success']:
-            upload_dir = 'uploads'
-            os.makedirs(upload_dir, exist_ok=True)
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            filename = f"prediction_{timestamp}.{file_extension}"
-            filepath = os.path.join(upload_dir, filename)
-            
-            # Save image
-            with open(filepath, 'wb') as f:
-                f.write(image_bytes)
-            
-            result['saved_image'] = filename
+            # Streamed from the spooled upload, not from memory; the logged hash saves re-hashing
+            with span('save_upload'):
+                result['saved_image'] = upload_store.save(
+                    file, file_extension, digest=log_context['input_hash'] if log_context else None
+                )
         
-        return jsonify(result)
+        with span('serialize'):
+            return jsonify(result)
         
+    except RequestEntityTooLarge:
+        # Body exceeded MAX_CONTENT_LENGTH; answered by the 413 handler
+        raise
     except Exception as e:
         logger.error(f"Error in predict endpoint: {str(e)}")
         return jsonify({
@@ -295,43 +444,84 @@ def batch_predict():
         if predictor is None:
             return jsonify({'error': 'Model not loaded'}), 500
         
+        deadline = request_deadline()
+        try:
+            inference_queue.check_admission(deadline)
+        except AdmissionRejected as rejection:
+            return overloaded_response(rejection)
+        
         files = request.files.getlist('files')
         
         if not files:
             return jsonify({'error': 'No files uploaded'}), 400
         
-        results = []
+        tta_mode = requested_tta_mode()
+        if tta_mode is not None and tta_mode not in TTA_MODES:
+            return jsonify({'error': f"Invalid tta value. Use one of: {', '.join(TTA_MODES)}"}), 400
+        tile_mode = requested_tile_mode()
+        if tile_mode is not None and tile_mode not in TILE_MODES:
+            return jsonify({'error': f"Invalid tiles value. Use one of: {', '.join(TILE_MODES)}"}), 400
+        try:
+            response_format = requested_response_format()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        for i, file in enumerate(files):
-            try:
+        entries = []
+        budget = BatchBudget()
+        with span('ingest'):
+            for i, file in enumerate(files):
                 if file.filename == '':
                     continue
-                
-                # Process each image
-                image_bytes = file.read()
-                image = Image.open(io.BytesIO(image_bytes))
-                
-                result = predictor.predict(image)
-                result['file_index'] = i
-                result['filename'] = file.filename
-                
-                results.append(result)
-                
-            except Exception as e:
-                results.append({
-                    'success': False,
-                    'error': str(e),
-                    'file_index': i,
-                    'filename': file.filename
-                })
+                log_context = prediction_context('batch-predict', file)
+                try:
+                    entries.append((i, file.filename, ingestor.open(file, budget), None, log_context))
+                except ImageRejected as rejection:
+                    entries.append((i, file.filename, None, rejection, log_context))
         
-        return jsonify({
-            'success': True,
-            'results': results,
-            'total_processed': len(results),
-            'timestamp': datetime.now().isoformat()
-        })
+        def score_batch(replica):
+            results = []
+            for i, filename, image, error, log_context in entries:
+                try:
+                    if error is not None:
+                        raise error
+                    
+                    result = replica.predict(image, tta_mode=tta_mode, response_format=response_format,
+                                             tile_mode=tile_mode, log_context=log_context)
+                    # Release the decoded pixels before the next image is decoded
+                    image.close()
+                    result['file_index'] = i
+                    result['filename'] = filename
+                    
+                    results.append(result)
+                    
+                except Exception as e:
+                    results.append({
+                        'success': False,
+                        'error': str(e),
+                        'file_index': i,
+                        'filename': filename
+                    })
+            return results
+        
+        # The whole batch is one queued job, costed by its image count (times the tile budget when tiled)
+        try:
+            results = inference_queue.run(score_batch, deadline, cost=max(1, len(entries)) * image_cost(tile_mode))
+        except AdmissionRejected as rejection:
+            return overloaded_response(rejection)
+        except DeadlineExceeded:
+            return deadline_exceeded_response()
         
+        with span('serialize'):
+            return jsonify({
+                'success': True,
+                'results': results,
+                'total_processed': len(results),
+                'timestamp': datetime.now().isoformat()
+            })
+        
+    except RequestEntityTooLarge:
+        # Body exceeded MAX_CONTENT_LENGTH; answered by the 413 handler
+        raise
     except Exception as e:
         logger.error(f"Error in batch predict endpoint: {str(e)}")
         return jsonify({
@@ -344,13 +534,17 @@ def batch_predict():
 def not_found(error):
     return jsonify({'error': 'Endpoint not found'}), 404
 
+@app.errorhandler(413)
+def request_too_large(error):
+    return jsonify({'error': 'Request body too large'}), 413
+
 @app.errorhandler(500)
 def internal_error(error):
     return jsonify({'error': 'Internal server error'}), 500
 
 if __name__ == '__main__':
     # Create necessary directories
-    os.makedirs('uploads', exist_ok=True)
+    os.makedirs(upload_store.root, exist_ok=True)
     os.makedirs('models', exist_ok=True)
     
     # Run the app
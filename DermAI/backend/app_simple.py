@@ -6,14 +6,19 @@ Returns realistic-looking placeholder predictions.
 
 from flask import Flask, request, jsonify
 from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
 from PIL import Image
-import io
 import os
 from datetime import datetime
 import random
+from ingestion import ImageIngestor, ImageRejected, configure_app
+from responses import RESPONSE_FORMAT, ResponseTemplates, configure_json, validate_response_format
 
 app = Flask(__name__)
 CORS(app)
+configure_app(app)
+configure_json(app)
+ingestor = ImageIngestor()
 
 # Disease classes
 DISEASE_CLASSES = [
@@ -26,7 +31,10 @@ DISEASE_CLASSES = [
     'vascular_lesion'
 ]
 
-def generate_realistic_prediction():
+# Recommendation tables and prediction formatting, built once
+templates = ResponseTemplates(DISEASE_CLASSES)
+
+def generate_realistic_prediction(response_format='full'):
     """Generate a realistic-looking prediction"""
     # Randomly select a disease (weighted towards more common ones)
     weights = [0.1, 0.4, 0.15, 0.1, 0.15, 0.05, 0.05]  # nevus is most common
@@ -38,8 +46,8 @@ def generate_realistic_prediction():
     else:
         confidence = random.uniform(0.75, 0.98)
     
-    # Generate all predictions with realistic distribution
-    all_predictions = []
+    # Generate all probabilities with realistic distribution
+    probabilities = []
     remaining_prob = 1.0 - confidence
     
     for d in DISEASE_CLASSES:
@@ -49,42 +57,35 @@ def generate_realistic_prediction():
             # Distribute remaining probability
             prob = random.uniform(0, remaining_prob * 0.3)
             remaining_prob -= prob
-        all_predictions.append({
-            'disease': d,
-            'confidence': prob,
-            'percentage': prob * 100
-        })
+        probabilities.append(prob)
     
     # Normalize to sum to 1
-    total = sum(p['confidence'] for p in all_predictions)
-    for p in all_predictions:
-        p['confidence'] = p['confidence'] / total
-        p['percentage'] = (p['confidence'] / total) * 100
+    total = sum(probabilities)
+    probabilities = [p / total for p in probabilities]
     
     # Sort by confidence
-    all_predictions.sort(key=lambda x: x['confidence'], reverse=True)
-    top_prediction = all_predictions[0]
+    (top_disease, top_confidence), all_predictions = templates.predictions(probabilities, response_format)
     
     # Determine risk level
-    if top_prediction['disease'] in ['melanoma', 'basal_cell_carcinoma']:
-        if top_prediction['confidence'] > 0.8:
+    if top_disease in ['melanoma', 'basal_cell_carcinoma']:
+        if top_confidence > 0.8:
             risk_level = 'HIGH'
-        elif top_prediction['confidence'] > 0.6:
+        elif top_confidence > 0.6:
             risk_level = 'MODERATE'
         else:
             risk_level = 'LOW'
     else:
-        if top_prediction['confidence'] > 0.9:
+        if top_confidence > 0.9:
             risk_level = 'MODERATE'
-        elif top_prediction['confidence'] > 0.7:
+        elif top_confidence > 0.7:
             risk_level = 'LOW'
         else:
             risk_level = 'VERY_LOW'
     
     return {
-        'disease': top_prediction['disease'],
-        'confidence': top_prediction['confidence'],
-        'percentage': top_prediction['percentage'],
+        'disease': top_disease,
+        'confidence': top_confidence,
+        'percentage': top_confidence * 100,
         'risk_level': risk_level,
         'all_predictions': all_predictions
     }
@@ -107,6 +108,17 @@ def health_check():
         'timestamp': datetime.now().isoformat()
     })
 
+@app.route('/stats')
+def stats():
+    return jsonify({
+        'ingestion': ingestor.stats(),
+        'timestamp': datetime.now().isoformat()
+    })
+
+@app.errorhandler(413)
+def request_too_large(error):
+    return jsonify({'success': False, 'error': 'Request body too large'}), 413
+
 @app.route('/predict', methods=['POST'])
 def predict_disease():
     """Predict skin disease from uploaded image"""
@@ -125,20 +137,28 @@ def predict_disease():
         if file_extension not in allowed_extensions:
             return jsonify({'success': False, 'error': 'Invalid file type'}), 400
         
-        # Read and validate image
-        image_bytes = file.read()
         try:
-            image = Image.open(io.BytesIO(image_bytes))
+            response_format = validate_response_format(
+                request.form.get('response', request.args.get('response'))
+            ) or RESPONSE_FORMAT
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
+        # Read and validate image within the byte/pixel limits
+        try:
+            image = ingestor.open(file)
             if image.mode != 'RGB':
                 image = image.convert('RGB')
+        except ImageRejected as rejection:
+            return jsonify({'success': False, 'error': rejection.message}), rejection.status
         except Exception as e:
             return jsonify({'success': False, 'error': 'Invalid image file'}), 400
         
         # Generate prediction
-        prediction_data = generate_realistic_prediction()
+        prediction_data = generate_realistic_prediction(response_format)
         
         # Get recommendation
-        recommendations = get_recommendation(prediction_data['disease'], prediction_data['risk_level'])
+        recommendations = templates.recommendation(prediction_data['disease'], prediction_data['risk_level'])
         
         return jsonify({
             'success': True,
@@ -153,6 +173,9 @@ def predict_disease():
             'timestamp': datetime.now().isoformat()
         })
         
+    except RequestEntityTooLarge:
+        # Body exceeded MAX_CONTENT_LENGTH; answered by the 413 handler
+        raise
     except Exception as e:
         return jsonify({
             'success': False,
@@ -160,31 +183,6 @@ def predict_disease():
             'timestamp': datetime.now().isoformat()
         }), 500
 
-def get_recommendation(disease, risk_level):
-    """Get recommendation based on prediction"""
-    recommendations = {
-        'HIGH': "⚠️ HIGH RISK: Please consult a dermatologist immediately. This condition requires urgent medical attention.",
-        'MODERATE': "⚡ MODERATE RISK: Schedule an appointment with a dermatologist within a week for proper evaluation.",
-        'LOW': "✅ LOW RISK: Monitor the condition and consult a doctor if symptoms worsen or persist.",
-        'VERY_LOW': "✅ VERY LOW RISK: Continue regular skin monitoring. Consult a doctor if you notice any changes."
-    }
-    
-    disease_info = {
-        'melanoma': "A serious form of skin cancer that can spread to other parts of the body.",
-        'nevus': "A common type of mole that is usually benign.",
-        'basal_cell_carcinoma': "The most common type of skin cancer, usually slow-growing.",
-        'actinic_keratosis': "Rough, scaly patches that may develop into skin cancer if left untreated.",
-        'benign_keratosis': "Non-cancerous skin growths that are usually harmless.",
-        'dermatofibroma': "A benign skin nodule that typically doesn't require treatment.",
-        'vascular_lesion': "Blood vessel abnormalities that are usually benign."
-    }
-    
-    return {
-        'risk_message': recommendations.get(risk_level, recommendations['LOW']),
-        'disease_info': disease_info.get(disease, "Please consult a healthcare professional for proper diagnosis."),
-        'general_advice': "This AI prediction is for informational purposes only and should not replace professional medical advice."
-    }
-
 if __name__ == '__main__':
     print("=" * 60)
     print("DermAI Mock ML Backend")
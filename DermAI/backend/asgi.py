@@ -0,0 +1,241 @@
+"""
+ASGI serving mode for the DermAI backends.
+
+Under a synchronous WSGI server a slow mobile upload to /predict or
+/batch-predict holds a worker thread for the whole transfer. This bridge
+receives the request body on the event loop instead, spooling large
+bodies to a temporary file, and only once the upload is complete hands
+the request to the existing Flask app on a bounded thread pool, where
+decode runs and model work goes through the admission queue. A client
+that disconnects mid-upload never reaches the app at all, and a body
+larger than the app's MAX_CONTENT_LENGTH is answered with 413 as soon as
+the limit is crossed, without receiving the rest of it; the 413 body is
+the one the app's own error handler returns.
+
+At most DERMAI_ASGI_MAX_PENDING complete requests wait for or hold a pool
+thread; beyond that a request is answered 503 with Retry-After instead of
+queueing without bound.
+
+The Flask views are unchanged, so every endpoint returns exactly the same
+JSON as under `python app.py`.
+
+Usage:
+    uvicorn asgi:app --host 0.0.0.0 --port 5001                               # app.py
+    DERMAI_ASGI_TARGET=app_simple uvicorn asgi:app --host 0.0.0.0 --port 5002  # mock backend
+"""
+
+import asyncio
+import importlib
+import io
+import json
+import logging
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from werkzeug.exceptions import RequestEntityTooLarge
+
+logger = logging.getLogger(__name__)
+
+ASGI_TARGET = os.environ.get('DERMAI_ASGI_TARGET', 'app')
+ASGI_WORKER_THREADS = int(os.environ.get('DERMAI_ASGI_WORKER_THREADS', 4))
+# Request bodies above this size are spooled to disk instead of kept in memory
+ASGI_SPOOL_BYTES = int(os.environ.get('DERMAI_ASGI_SPOOL_BYTES', 1024 * 1024))
+# Complete requests allowed to wait for or hold a thread (0 = 4 per thread)
+ASGI_MAX_PENDING = int(os.environ.get('DERMAI_ASGI_MAX_PENDING', 0))
+
+
+class ASGIUploadBridge:
+    """Serve a WSGI app over ASGI, receiving request bodies asynchronously"""
+
+    def __init__(self, wsgi_app, worker_threads=4, spool_bytes=1024 * 1024, max_body_bytes=None, max_pending=0):
+        self.wsgi_app = wsgi_app
+        self.spool_bytes = spool_bytes
+        if max_body_bytes is None and hasattr(wsgi_app, 'config'):
+            max_body_bytes = wsgi_app.config.get('MAX_CONTENT_LENGTH')
+        self.max_body_bytes = max_body_bytes
+        self.executor = ThreadPoolExecutor(max_workers=worker_threads, thread_name_prefix='asgi-wsgi')
+        # Requests waiting for or running on a thread; only touched on the event loop
+        self.max_pending = max_pending or worker_threads * 4
+        self.pending = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise RuntimeError(f"Unsupported ASGI scope type: {scope['type']}")
+
+        if self._declared_length(scope) > (self.max_body_bytes or float('inf')):
+            await self._too_large(scope, send)
+            return
+
+        body = await self._receive_body(receive)
+        if body is None:
+            logger.info(f"Client disconnected during upload to {scope['path']}, request dropped")
+            return
+        if body is False:
+            await self._too_large(scope, send)
+            return
+
+        if self.pending >= self.max_pending:
+            body.close()
+            await self._busy(send)
+            return
+
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            status, headers, chunks = await loop.run_in_executor(
+                self.executor, self._run_wsgi, scope, body
+            )
+        finally:
+            self.pending -= 1
+            body.close()
+
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': b''.join(chunks)})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    @staticmethod
+    def _declared_length(scope):
+        for name, value in scope.get('headers', []):
+            if name.lower() == b'content-length':
+                try:
+                    return int(value)
+                except ValueError:
+                    return 0
+        return 0
+
+    async def _too_large(self, scope, send):
+        headers, payload = self._too_large_response(scope)
+        await send({'type': 'http.response.start', 'status': 413, 'headers': headers + [(b'connection', b'close')]})
+        await send({'type': 'http.response.body', 'body': payload})
+
+    def _too_large_response(self, scope):
+        """Headers and body of the wrapped app's own 413 answer, as if it had read the body"""
+        flask_app = self.wsgi_app
+        if not hasattr(flask_app, 'handle_user_exception'):
+            payload = json.dumps({'error': 'Request body too large'}).encode()
+            return [(b'content-type', b'application/json'), (b'content-length', str(len(payload)).encode())], payload
+
+        # Runs the app's 413 error handler and after_request hooks (CORS, request ID) without a body
+        with flask_app.request_context(self._environ(scope, io.BytesIO())):
+            response = flask_app.finalize_request(flask_app.handle_user_exception(RequestEntityTooLarge()))
+        payload = response.get_data()
+        headers = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                   for name, value in response.headers.items() if name.lower() != 'content-length']
+        return headers + [(b'content-length', str(len(payload)).encode())], payload
+
+    @staticmethod
+    async def _busy(send):
+        payload = json.dumps({
+            'success': False,
+            'error': 'Server is at capacity, please retry later',
+            'reason': 'asgi_pending',
+            'timestamp': datetime.now().isoformat()
+        }, separators=(',', ':')).encode()
+        await send({'type': 'http.response.start', 'status': 503, 'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(payload)).encode()),
+            (b'retry-after', b'1')
+        ]})
+        await send({'type': 'http.response.body', 'body': payload})
+
+    async def _receive_body(self, receive):
+        """Read the whole request body without blocking a thread.
+
+        Returns None if the client went away and False if the body grew
+        past max_body_bytes.
+        """
+        body = tempfile.SpooledTemporaryFile(max_size=self.spool_bytes)
+        received = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return None
+            chunk = message.get('body', b'')
+            received += len(chunk)
+            if self.max_body_bytes is not None and received > self.max_body_bytes:
+                body.close()
+                return False
+            body.write(chunk)
+            if not message.get('more_body', False):
+                break
+
+        body.seek(0)
+        return body
+
+    def _run_wsgi(self, scope, body):
+        environ = self._environ(scope, body)
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [
+                (name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers
+            ]
+            return lambda data: chunks.append(data)
+
+        chunks = []
+        result = self.wsgi_app(environ, start_response)
+        try:
+            for data in result:
+                chunks.append(data)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return response['status'], response['headers'], chunks
+
+    @staticmethod
+    def _environ(scope, body):
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': client[0],
+            'REMOTE_PORT': str(client[1]),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False
+        }
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name == 'CONTENT_TYPE':
+                key = 'CONTENT_TYPE'
+            elif name == 'CONTENT_LENGTH':
+                key = 'CONTENT_LENGTH'
+            else:
+                key = f'HTTP_{name}'
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+
+app = ASGIUploadBridge(
+    importlib.import_module(ASGI_TARGET).app,
+    worker_threads=ASGI_WORKER_THREADS,
+    spool_bytes=ASGI_SPOOL_BYTES,
+    max_pending=ASGI_MAX_PENDING
+)
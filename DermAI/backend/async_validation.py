@@ -0,0 +1,302 @@
+"""
+Out-of-process validation for DermAIModelTrainer (DERMAI_ASYNC_VALIDATION=1).
+
+With validation_data, model.fit stops at the end of every epoch to score
+the validation split, and on CPU that is a large share of each epoch.
+In async mode:
+- at the end of each epoch the main process only writes the weights to a
+  checkpoint file and queues it, then starts the next epoch right away;
+- a spawned worker process (DERMAI_ASYNC_VAL_THREADS intra-op threads)
+  loads each checkpoint into its own copy of the model, scores the
+  validation split and sends back val_loss / val_accuracy and the
+  predicted classes. It also writes best_model.h5 whenever val_accuracy
+  improves, like the synchronous ModelCheckpoint;
+- results are applied as they arrive, with the synchronous pipeline's
+  rules: early stopping on val_accuracy (patience 10), LR x0.2 after 5
+  epochs without val_loss improvement (min 1e-7), and the best epoch's
+  weights restored at the end. Decisions therefore lag by however many
+  epochs the worker is behind. Training waits when the lag would exceed
+  DERMAI_ASYNC_VAL_MAX_LAG;
+- the best epoch's predicted classes are reused by evaluate_model, which
+  saves its separate full pass over the validation split.
+
+The report (async_validation_report.json, and 'async_validation' in
+model_info.json) compares the run's measured wall time with a
+synchronous baseline built from main-process timings only:
+- before training, once the worker is ready, one validation pass is
+  timed in the main process at full thread count (sync_validation_s),
+  as model.fit would run it after every epoch;
+- epoch 1 trains before any checkpoint reaches the worker, so its
+  median step time (the first step, which traces the graph, excluded)
+  times the steps per epoch is the uncontended epoch time
+  (baseline_epoch_train_s);
+- baseline = epoch 1 as measured (a synchronous run traces the graph
+  too) + the other epochs at baseline_epoch_train_s + sync_validation_s
+  per epoch + the evaluation pass, and time_saved_s = baseline -
+  train_wall_s.
+train_wall_s includes the baseline pass, the worker start-up and every
+wait for the worker, and later epochs' train time includes the slowdown
+from sharing the CPU with the worker (contention_slowdown). The worker's
+own validation time is reported for reference only.
+"""
+
+import contextlib
+import io
+import multiprocessing
+import os
+import queue
+import time
+import numpy as np
+import tensorflow as tf
+
+ASYNC_VALIDATION = os.environ.get('DERMAI_ASYNC_VALIDATION', '0') == '1'
+# 0 = a quarter of the cores
+ASYNC_VAL_THREADS = int(os.environ.get('DERMAI_ASYNC_VAL_THREADS', 0))
+ASYNC_VAL_MAX_LAG = int(os.environ.get('DERMAI_ASYNC_VAL_MAX_LAG', 2))
+
+
+def _validate(model_json, data_dir, model_dir, img_size, batch_size, threads, jobs, results):
+    """Worker process: score each (epoch, weights path) job on the validation split"""
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        from model_trainer import DermAIModelTrainer
+
+        trainer = DermAIModelTrainer(data_dir=data_dir, model_dir=model_dir)
+        trainer.img_size = img_size
+        trainer.batch_size = batch_size
+        with contextlib.redirect_stdout(io.StringIO()):
+            val_gen = trainer.create_validation_generator()
+        model = tf.keras.models.model_from_json(model_json)
+        y_true = val_gen.classes
+        best_accuracy = -np.inf
+        results.put(('ready', val_gen.samples))
+    except Exception as e:
+        results.put(('error', f"{type(e).__name__}: {e}"))
+        return
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        epoch, weights_path = job
+        try:
+            start = time.perf_counter()
+            model.load_weights(weights_path)
+            val_gen.reset()
+            probabilities = model.predict(val_gen, verbose=0)
+            y_pred = np.argmax(probabilities, axis=1)
+            accuracy = float(np.mean(y_pred == y_true))
+            # Same clipping as Keras' categorical crossentropy
+            loss = float(-np.mean(np.log(np.clip(probabilities[np.arange(len(y_true)), y_true], 1e-7, 1.0))))
+            if accuracy > best_accuracy:
+                best_accuracy = accuracy
+                model.save(os.path.join(model_dir, 'best_model.h5'))
+            results.put(('result', {'epoch': epoch, 'val_loss': loss, 'val_accuracy': accuracy,
+                                    'validation_s': time.perf_counter() - start, 'y_pred': y_pred}))
+        except Exception as e:
+            results.put(('error', f"epoch {epoch}: {type(e).__name__}: {e}"))
+            return
+
+
+class AsyncValidation(tf.keras.callbacks.Callback):
+    def __init__(self, trainer, checkpoint_dir, val_gen, patience=10, lr_patience=5, lr_factor=0.2, min_lr=1e-7,
+                 max_lag=ASYNC_VAL_MAX_LAG, threads=ASYNC_VAL_THREADS):
+        super().__init__()
+        # Only used to time the synchronous baseline pass
+        self.val_gen = val_gen
+        self.data_dir = str(trainer.data_dir)
+        self.model_dir = str(trainer.model_dir)
+        self.img_size = tuple(trainer.img_size)
+        self.batch_size = trainer.batch_size
+        self.checkpoint_dir = checkpoint_dir
+        self.patience = patience
+        self.lr_patience = lr_patience
+        self.lr_factor = lr_factor
+        self.min_lr = min_lr
+        self.max_lag = max(0, max_lag)
+        self.threads = threads or max(1, (os.cpu_count() or 1) // 4)
+
+        self.pending = {}
+        self.history = []
+        self.epoch_train_s = []
+        # End time of each step of epoch 1, for the uncontended step time
+        self.first_epoch_step_ends = []
+        self.best_accuracy = -np.inf
+        self.best_loss = np.inf
+        self.best_epoch = None
+        self.best_path = None
+        self.best_predictions = None
+        self.wait = 0
+        self.lr_wait = 0
+        self.stopped_early = False
+        self.lag_wait_s = 0.0
+        self.final_wait_s = 0.0
+        self.sync_validation_s = None
+
+    def on_train_begin(self, logs=None):
+        self.train_start = time.perf_counter()
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        context = multiprocessing.get_context('spawn')
+        self.jobs = context.Queue()
+        self.results = context.Queue()
+        self.process = context.Process(
+            target=_validate, name='async-validation',
+            args=(self.model.to_json(), self.data_dir, self.model_dir, self.img_size, self.batch_size,
+                  self.threads, self.jobs, self.results),
+            daemon=True
+        )
+        self.process.start()
+        self._wait_ready()
+
+        # Synchronous baseline: the pass model.fit would run after each epoch, with the worker idle
+        start = time.perf_counter()
+        self.val_gen.reset()
+        self.model.predict(self.val_gen, verbose=0)
+        self.sync_validation_s = time.perf_counter() - start
+        print(f"Synchronous validation pass: {self.sync_validation_s:.1f}s")
+
+    def _wait_ready(self):
+        """Block until the worker has built its model and generator, so epoch 1 trains uncontended"""
+        while True:
+            try:
+                kind, payload = self.results.get(timeout=1.0)
+            except queue.Empty:
+                if not self.process.is_alive():
+                    raise RuntimeError(f"Validation worker exited with code {self.process.exitcode}")
+                continue
+            if kind == 'error':
+                raise RuntimeError(f"Validation worker failed: {payload}")
+            if kind == 'ready':
+                return
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch_start = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        if not self.epoch_train_s:
+            self.first_epoch_step_ends.append(time.perf_counter())
+
+    def baseline_epoch_train_s(self):
+        """Uncontended epoch time: epoch 1's median step time (tracing step excluded) x its steps"""
+        steps = np.diff(self.first_epoch_step_ends)
+        if len(steps) == 0:
+            return self.epoch_train_s[0] if self.epoch_train_s else None
+        return float(np.median(steps)) * len(self.first_epoch_step_ends)
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.epoch_train_s.append(time.perf_counter() - self.epoch_start)
+        path = os.path.join(self.checkpoint_dir, f'epoch_{epoch + 1:03d}.weights.h5')
+        self.model.save_weights(path)
+        self.pending[epoch + 1] = path
+        self.jobs.put((epoch + 1, path))
+
+        self._collect(block=False)
+        start = time.perf_counter()
+        while len(self.pending) > self.max_lag:
+            self._collect(block=True)
+        self.lag_wait_s += time.perf_counter() - start
+
+    def on_train_end(self, logs=None):
+        start = time.perf_counter()
+        while self.pending:
+            self._collect(block=True)
+        self.final_wait_s = time.perf_counter() - start
+        self.train_wall_s = time.perf_counter() - self.train_start
+        self.jobs.put(None)
+        self.process.join(timeout=60)
+
+        if self.best_path is not None:
+            self.model.load_weights(self.best_path)
+            print(f"Restored weights from epoch {self.best_epoch} (val_accuracy {self.best_accuracy:.4f})")
+            os.remove(self.best_path)
+
+    def _collect(self, block):
+        """Apply every result that has arrived; with block, wait for at least one"""
+        while True:
+            try:
+                kind, payload = self.results.get(timeout=1.0) if block else self.results.get_nowait()
+            except queue.Empty:
+                if not block:
+                    return
+                if not self.process.is_alive():
+                    raise RuntimeError(f"Validation worker exited with code {self.process.exitcode}")
+                continue
+            if kind == 'error':
+                raise RuntimeError(f"Validation worker failed: {payload}")
+            if kind == 'result':
+                self._apply(payload)
+                block = False
+
+    def _apply(self, result):
+        epoch = result['epoch']
+        path = self.pending.pop(epoch)
+        lr = float(self.model.optimizer.learning_rate.numpy())
+        behind = len(self.epoch_train_s) - epoch
+        self.history.append({key: result[key] for key in ('epoch', 'val_loss', 'val_accuracy', 'validation_s')})
+        self.history[-1].update({'learning_rate': lr, 'epochs_behind': behind})
+        print(f"\nEpoch {epoch} validated: val_loss {result['val_loss']:.4f}, val_accuracy {result['val_accuracy']:.4f}"
+              f" ({result['validation_s']:.1f}s, {behind} epoch(s) behind)")
+
+        # Checkpoint selection and early stopping on val_accuracy
+        if result['val_accuracy'] > self.best_accuracy:
+            if self.best_path is not None:
+                os.remove(self.best_path)
+            self.best_accuracy = result['val_accuracy']
+            self.best_epoch = epoch
+            self.best_path = path
+            self.best_predictions = result['y_pred']
+            self.wait = 0
+        else:
+            os.remove(path)
+            self.wait += 1
+            if self.wait >= self.patience and not self.stopped_early:
+                print(f"Early stopping: no val_accuracy improvement in {self.patience} validated epochs")
+                self.stopped_early = True
+                self.model.stop_training = True
+
+        # Learning-rate plateau schedule on val_loss
+        if result['val_loss'] < self.best_loss - 1e-4:
+            self.best_loss = result['val_loss']
+            self.lr_wait = 0
+        else:
+            self.lr_wait += 1
+            if self.lr_wait >= self.lr_patience and lr > self.min_lr:
+                new_lr = max(lr * self.lr_factor, self.min_lr)
+                self.model.optimizer.learning_rate.assign(new_lr)
+                print(f"Reducing learning rate to {new_lr:.3g}")
+                self.lr_wait = 0
+
+    def history_metrics(self):
+        """val_loss, val_accuracy and learning-rate lists in epoch order, for History.history"""
+        ordered = sorted(self.history, key=lambda h: h['epoch'])
+        return {'val_loss': [h['val_loss'] for h in ordered], 'val_accuracy': [h['val_accuracy'] for h in ordered],
+                'lr': [h['learning_rate'] for h in ordered]}
+
+    def report(self):
+        epochs = len(self.epoch_train_s)
+        baseline_epoch_s = self.baseline_epoch_train_s()
+        sync_wall_s = None
+        if baseline_epoch_s is not None:
+            # Synchronous run: train + validate every epoch, then the evaluation pass async mode skips
+            sync_wall_s = (self.epoch_train_s[0] + (epochs - 1) * baseline_epoch_s +
+                           (epochs + 1) * self.sync_validation_s)
+        return {
+            'epochs_trained': len(self.epoch_train_s),
+            'best_epoch': self.best_epoch,
+            'best_val_accuracy': self.best_accuracy if self.best_epoch else None,
+            'stopped_early': self.stopped_early,
+            'worker_threads': self.threads,
+            'max_lag': self.max_lag,
+            'train_wall_s': self.train_wall_s,
+            'mean_epoch_train_s': float(np.mean(self.epoch_train_s)) if self.epoch_train_s else None,
+            'baseline_epoch_train_s': baseline_epoch_s,
+            'contention_slowdown': (float(np.mean(self.epoch_train_s[1:])) / baseline_epoch_s
+                                    if epochs > 1 else None),
+            'sync_validation_s': self.sync_validation_s,
+            'sync_wall_estimate_s': sync_wall_s,
+            'time_saved_s': sync_wall_s - self.train_wall_s if sync_wall_s is not None else None,
+            'validation_worker_s': sum(h['validation_s'] for h in self.history),
+            'lag_wait_s': self.lag_wait_s,
+            'final_wait_s': self.final_wait_s,
+            'epochs': sorted(self.history, key=lambda h: h['epoch'])
+        }
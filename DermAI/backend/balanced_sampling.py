@@ -0,0 +1,128 @@
+"""
+Class-balanced, lesion-grouped sampling for DermAI training.
+
+flow_from_directory visits every training image once per epoch, so about
+two thirds of each epoch goes to nevus, and melanoma and the other
+minority classes need many epochs before their recall climbs.
+BalancedSampler wraps the directory iterator (keeping its file list,
+augmentation and image loading) and changes only which images make up an
+epoch:
+
+- weighting 'balanced' draws every class equally often, 'sqrt' draws a
+  class in proportion to the square root of its image count (minority
+  classes are boosted without being repeated as often), and 'uniform'
+  keeps the natural class frequencies;
+- samples_per_epoch sets an epoch's size as a sample budget instead of
+  a full pass over the data, so validation, checkpoints and LR schedules
+  run at a fixed amount of training work;
+- with group_by_lesion, a class draw picks a lesion (HAM10000 lesion_id)
+  and then one of its images. A lesion photographed six times is then no
+  more likely than one photographed once. Within a batch, lesions are
+  drawn without replacement, so duplicate views of one lesion do not fill
+  a batch.
+
+The per-epoch plan is drawn from a seeded generator in on_epoch_end,
+which keeps batches reproducible and safe to load from worker threads.
+"""
+
+import logging
+import os
+import numpy as np
+import tensorflow as tf
+
+logger = logging.getLogger(__name__)
+
+SAMPLING_WEIGHTINGS = ('uniform', 'balanced', 'sqrt')
+
+
+def class_probabilities(counts, weighting):
+    """Probability of drawing each class given its image count"""
+    counts = np.asarray(counts, dtype=np.float64)
+    if weighting == 'balanced':
+        weights = (counts > 0).astype(np.float64)
+    elif weighting == 'sqrt':
+        weights = np.sqrt(counts)
+    elif weighting == 'uniform':
+        weights = counts
+    else:
+        raise ValueError(f"Invalid sampling weighting: {weighting}. Use one of: {', '.join(SAMPLING_WEIGHTINGS)}")
+    return weights / weights.sum()
+
+
+class BalancedSampler(tf.keras.utils.Sequence):
+    def __init__(self, iterator, weighting='balanced', samples_per_epoch=None, lesion_ids=None, seed=42):
+        """iterator: a DirectoryIterator from flow_from_directory.
+
+        lesion_ids maps an image file stem (ISIC_0024306) to its lesion_id;
+        images without one form their own group. None disables grouping.
+        """
+        super().__init__()
+        self.iterator = iterator
+        self.weighting = weighting
+        self.batch_size = iterator.batch_size
+        self.classes = np.asarray(iterator.classes)
+        self.class_indices = iterator.class_indices
+        self.num_classes = len(iterator.class_indices)
+        samples_per_epoch = samples_per_epoch or len(self.classes)
+        self.steps = max(1, samples_per_epoch // self.batch_size)
+        # Same attribute as the directory iterator, so train_model() sizes epochs from it
+        self.samples = self.steps * self.batch_size
+        self.rng = np.random.default_rng(seed)
+
+        counts = np.bincount(self.classes, minlength=self.num_classes)
+        self.class_p = class_probabilities(counts, weighting)
+
+        # groups[c] is a list of image-index arrays (one per lesion, or one per image)
+        self.grouped = lesion_ids is not None
+        self.groups = []
+        for c in range(self.num_classes):
+            indices = np.flatnonzero(self.classes == c)
+            if lesion_ids is None:
+                self.groups.append([np.array([i]) for i in indices])
+                continue
+            by_lesion = {}
+            for i in indices:
+                stem = os.path.splitext(os.path.basename(iterator.filepaths[i]))[0]
+                by_lesion.setdefault(lesion_ids.get(stem, stem), []).append(i)
+            self.groups.append([np.array(members) for members in by_lesion.values()])
+
+        logger.info(f"Balanced sampler: {weighting} weighting, {self.samples} samples/epoch, "
+                    f"class probabilities {np.round(self.class_p, 3).tolist()}"
+                    + (f", {sum(len(g) for g in self.groups)} lesion groups" if self.grouped else ''))
+        self.on_epoch_end()
+
+    def __len__(self):
+        return self.steps
+
+    def _draw_batch(self):
+        slots = self.rng.choice(self.num_classes, size=self.batch_size, p=self.class_p)
+        batch = []
+        for c, n in zip(*np.unique(slots, return_counts=True)):
+            groups = self.groups[c]
+            # Distinct groups within the batch while the class has enough of them
+            order = self.rng.permutation(len(groups))
+            picks = order[np.arange(n) % len(groups)]
+            for g in picks:
+                members = groups[g]
+                batch.append(members[self.rng.integers(len(members))])
+        batch = np.array(batch)
+        self.rng.shuffle(batch)
+        return batch
+
+    def on_epoch_end(self):
+        self.plan = [self._draw_batch() for _ in range(self.steps)]
+
+    def __getitem__(self, index):
+        # Loading, augmentation and rescaling are the directory iterator's own
+        return self.iterator._get_batches_of_transformed_samples(self.plan[index])
+
+    def epoch_class_counts(self):
+        """Images per class in the current epoch plan"""
+        drawn = np.bincount(self.classes[np.concatenate(self.plan)], minlength=self.num_classes)
+        names = sorted(self.class_indices, key=self.class_indices.get)
+        return dict(zip(names, drawn.tolist()))
+
+
+def lesion_id_map(metadata):
+    """image_id -> lesion_id from a DatasetMetadata"""
+    return dict(zip(metadata.columns['image_id'].tolist(), metadata.columns['lesion_id'].tolist()))
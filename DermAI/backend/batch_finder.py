@@ -0,0 +1,200 @@
+"""
+Training batch-size search under a memory budget.
+
+DermAIModelTrainer used a fixed batch size of 8, which is safe on a small
+machine and slow on a large one. Before training starts, the finder tries
+each candidate batch size (DERMAI_BATCH_CANDIDATES, ascending):
+- every probe runs in a fresh spawned process that builds the trainer's
+  model and runs DERMAI_BATCH_PROBE_STEPS training steps on synthetic
+  batches of the model's input shape, after warm-up steps that absorb
+  graph tracing. That keeps each peak RSS (ru_maxrss) measurement clean,
+  and a probe killed by the OOM killer only fails that probe;
+- a candidate fits when its peak RSS is within the budget
+  (DERMAI_TRAIN_MEMORY_BUDGET_MB, by default DERMAI_TRAIN_MEMORY_FRACTION
+  of physical memory). The search stops at the first one that doesn't,
+  since larger batches only need more memory;
+- the fitting candidate with the highest images/sec wins, and the
+  learning rate is scaled from the base (batch size 8, lr 0.001) by
+  DERMAI_LR_SCALING: 'sqrt' (default, suited to Adam), 'linear' or 'none'.
+
+The trainer records the chosen batch size, learning rate and every
+measurement under 'batch_size_search' in model_info.json. Set
+DERMAI_AUTO_BATCH_SIZE=1 to run the search in run_training_pipeline, or
+run it alone to see the table:
+    python batch_finder.py --budget-mb 6000 --candidates 8,16,32,64
+"""
+
+import argparse
+import contextlib
+import io
+import logging
+import math
+import multiprocessing
+import os
+import queue
+import sys
+import time
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+AUTO_BATCH_SIZE = os.environ.get('DERMAI_AUTO_BATCH_SIZE', '0') == '1'
+BATCH_CANDIDATES = tuple(int(b) for b in os.environ.get('DERMAI_BATCH_CANDIDATES', '8,16,32,64,128').split(',') if b.strip())
+BATCH_PROBE_STEPS = int(os.environ.get('DERMAI_BATCH_PROBE_STEPS', 5))
+BATCH_PROBE_WARMUP = int(os.environ.get('DERMAI_BATCH_PROBE_WARMUP', 2))
+BATCH_PROBE_TIMEOUT = float(os.environ.get('DERMAI_BATCH_PROBE_TIMEOUT', 600))
+# 0 = DERMAI_TRAIN_MEMORY_FRACTION of physical memory
+TRAIN_MEMORY_BUDGET_MB = float(os.environ.get('DERMAI_TRAIN_MEMORY_BUDGET_MB', 0))
+TRAIN_MEMORY_FRACTION = float(os.environ.get('DERMAI_TRAIN_MEMORY_FRACTION', 0.75))
+LR_SCALING_RULES = ('sqrt', 'linear', 'none')
+LR_SCALING = os.environ.get('DERMAI_LR_SCALING', 'sqrt')
+
+
+def physical_memory_mb():
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 2 ** 20
+
+
+def default_memory_budget_mb():
+    return TRAIN_MEMORY_BUDGET_MB or physical_memory_mb() * TRAIN_MEMORY_FRACTION
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and KB on Linux
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 1024
+
+
+def scale_learning_rate(base_lr, base_batch_size, batch_size, rule=LR_SCALING):
+    if rule not in LR_SCALING_RULES:
+        raise ValueError(f"Invalid learning-rate scaling rule: {rule}")
+    ratio = batch_size / base_batch_size
+    if rule == 'linear':
+        return base_lr * ratio
+    if rule == 'sqrt':
+        return base_lr * math.sqrt(ratio)
+    return base_lr
+
+
+def _probe(trainer, batch_size, steps, warmup, results):
+    """Child process: train `steps` synthetic batches and report throughput and peak RSS"""
+    try:
+        import tensorflow as tf
+
+        tf.keras.utils.set_random_seed(0)
+        trainer.batch_size = batch_size
+        with contextlib.redirect_stdout(io.StringIO()):
+            model = trainer.build_model()
+        rng = np.random.default_rng(0)
+        x = rng.random((batch_size,) + tuple(model.input_shape[1:]), dtype=np.float32)
+        y = np.eye(trainer.num_classes, dtype=np.float32)[rng.integers(0, trainer.num_classes, batch_size)]
+
+        for _ in range(warmup):
+            model.train_on_batch(x, y)
+        start = time.perf_counter()
+        for _ in range(steps):
+            model.train_on_batch(x, y)
+        elapsed = time.perf_counter() - start
+        results.put({'images_per_sec': steps * batch_size / elapsed, 'step_ms': elapsed / steps * 1000,
+                     'peak_rss_mb': peak_rss_mb()})
+    except Exception as e:
+        results.put({'error': f"{type(e).__name__}: {e}"})
+
+
+def probe_batch_size(trainer, batch_size, steps=BATCH_PROBE_STEPS, warmup=BATCH_PROBE_WARMUP,
+                     timeout=BATCH_PROBE_TIMEOUT):
+    """Measurements for one batch size; 'error' is set when the probe failed or was killed"""
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=_probe, args=(trainer, batch_size, steps, warmup, results), daemon=True)
+    process.start()
+    # Poll so a probe killed without reporting (typically by the OOM killer) fails at once, not at the timeout
+    deadline = time.monotonic() + timeout
+    measurement = None
+    while measurement is None:
+        try:
+            measurement = results.get(timeout=1.0)
+        except queue.Empty:
+            if not process.is_alive():
+                # It may have reported just before exiting
+                try:
+                    measurement = results.get(timeout=1.0)
+                except queue.Empty:
+                    measurement = {'error': f'probe exited with code {process.exitcode}'}
+            elif time.monotonic() > deadline:
+                process.kill()
+                measurement = {'error': f'probe timed out after {timeout:.0f}s'}
+    process.join()
+    return {'batch_size': batch_size, **measurement}
+
+
+def find_batch_size(trainer, candidates=BATCH_CANDIDATES, memory_budget_mb=None, steps=BATCH_PROBE_STEPS,
+                    warmup=BATCH_PROBE_WARMUP, lr_scaling=LR_SCALING, base_batch_size=None, base_learning_rate=None):
+    """Probe the candidate batch sizes for the trainer's model and pick the fastest that fits the budget"""
+    memory_budget_mb = memory_budget_mb or default_memory_budget_mb()
+    base_batch_size = base_batch_size or trainer.batch_size
+    base_learning_rate = base_learning_rate or trainer.learning_rate
+
+    measurements = []
+    for batch_size in sorted(candidates):
+        measurement = probe_batch_size(trainer, batch_size, steps=steps, warmup=warmup)
+        measurement['fits'] = 'error' not in measurement and (
+            measurement['peak_rss_mb'] is None or measurement['peak_rss_mb'] <= memory_budget_mb
+        )
+        measurements.append(measurement)
+        logger.info(f"Batch size {batch_size}: {measurement}")
+        if not measurement['fits']:
+            break
+
+    fitting = [m for m in measurements if m['fits']]
+    if fitting:
+        chosen = max(fitting, key=lambda m: m['images_per_sec'])['batch_size']
+    else:
+        logger.warning(f"No candidate batch size fits in {memory_budget_mb:.0f} MB; keeping {base_batch_size}")
+        chosen = base_batch_size
+
+    return {
+        'batch_size': chosen,
+        'learning_rate': scale_learning_rate(base_learning_rate, base_batch_size, chosen, lr_scaling),
+        'base_batch_size': base_batch_size,
+        'base_learning_rate': base_learning_rate,
+        'lr_scaling': lr_scaling,
+        'memory_budget_mb': memory_budget_mb,
+        'probe_steps': steps,
+        'measurements': measurements
+    }
+
+
+def main():
+    from model_trainer import DermAIModelTrainer
+
+    parser = argparse.ArgumentParser(description='Find the fastest training batch size within a memory budget')
+    parser.add_argument('--candidates', default=','.join(str(b) for b in BATCH_CANDIDATES))
+    parser.add_argument('--budget-mb', type=float, default=None,
+                        help=f'Peak RSS budget (default: {TRAIN_MEMORY_FRACTION:.0%} of physical memory)')
+    parser.add_argument('--steps', type=int, default=BATCH_PROBE_STEPS)
+    parser.add_argument('--lr-scaling', choices=LR_SCALING_RULES, default=LR_SCALING)
+    args = parser.parse_args()
+
+    result = find_batch_size(DermAIModelTrainer(), [int(b) for b in args.candidates.split(',')],
+                             memory_budget_mb=args.budget_mb, steps=args.steps, lr_scaling=args.lr_scaling)
+
+    print(f"\nMemory budget: {result['memory_budget_mb']:.0f} MB")
+    print(f"{'batch':>6}{'images/s':>10}{'step_ms':>9}{'peak_rss_mb':>13}  fits")
+    for m in result['measurements']:
+        if 'error' in m:
+            print(f"{m['batch_size']:>6}  {m['error']}")
+        else:
+            print(f"{m['batch_size']:>6}{m['images_per_sec']:>10.1f}{m['step_ms']:>9.0f}"
+                  f"{m['peak_rss_mb'] or 0:>13.0f}  {'yes' if m['fits'] else 'no'}")
+    print(f"Chosen batch size {result['batch_size']}, learning rate {result['learning_rate']:.6g} ({result['lr_scaling']} scaling)")
+
+
+if __name__ == '__main__':
+    main()
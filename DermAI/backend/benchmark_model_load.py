@@ -0,0 +1,107 @@
+"""
+Load-time benchmark for DermAI model artifacts
+Compares cold-start cost of the .h5, SavedModel and optimized (frozen graph)
+formats. Every measurement runs in a fresh Python process so TF graph and
+file caches from an earlier load cannot flatter the result; TensorFlow import
+time is excluded.
+
+Usage: python benchmark_model_load.py [--model models/dermai_model.h5] [--runs 5]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+CHILD_FLAG = '--child'
+
+
+def child(path):
+    """Load one artifact and report load and first-prediction time as JSON"""
+    os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+    import numpy as np
+    import tensorflow as tf  # noqa: F401 - imported before the timer starts
+    from model_artifacts import load_model_artifact
+
+    start = time.perf_counter()
+    model = load_model_artifact(path)
+    load_ms = (time.perf_counter() - start) * 1000
+
+    x = np.random.rand(1, 224, 224, 3).astype('float32')
+    start = time.perf_counter()
+    model.predict(x, verbose=0)
+    first_predict_ms = (time.perf_counter() - start) * 1000
+
+    print(json.dumps({'load_ms': load_ms, 'first_predict_ms': first_predict_ms}))
+
+
+def artifact_size_mb(path):
+    if os.path.isdir(path):
+        return sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, files in os.walk(path) for name in files
+        ) / (1024 * 1024)
+    return os.path.getsize(path) / (1024 * 1024)
+
+
+def run(path, runs):
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), CHILD_FLAG, path],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    samples.sort(key=lambda s: s['load_ms'])
+    median = samples[len(samples) // 2]
+    return {
+        'load_ms_median': median['load_ms'],
+        'load_ms_min': samples[0]['load_ms'],
+        'first_predict_ms': median['first_predict_ms'],
+        'size_mb': artifact_size_mb(path)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark DermAI model artifact load time')
+    parser.add_argument('--model', default='models/dermai_model.h5', help='Trained .h5; exports are looked up next to it')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--export', action='store_true', help='(Re)export SavedModel/optimized artifacts first')
+    args = parser.parse_args()
+
+    from model_artifacts import OPTIMIZED_SUFFIX, SAVEDMODEL_SUFFIX
+
+    stem = os.path.splitext(args.model)[0]
+    if args.export:
+        import tensorflow as tf
+        from model_artifacts import export_inference_artifacts
+        export_inference_artifacts(tf.keras.models.load_model(args.model), args.model)
+
+    candidates = [
+        ('h5', args.model),
+        ('savedmodel', stem + SAVEDMODEL_SUFFIX),
+        ('optimized', stem + OPTIMIZED_SUFFIX),
+        ('compressed', os.path.join(os.path.dirname(args.model), 'compressed', 'dermai_model.npz'))
+    ]
+
+    results = {}
+    print(f"{'format':<12}{'load_ms':>10}{'min_ms':>10}{'1st_pred_ms':>13}{'size_mb':>10}")
+    for name, path in candidates:
+        if not os.path.exists(path):
+            print(f"{name:<12}{'(missing: ' + path + ')':>40}")
+            continue
+        results[name] = run(path, args.runs)
+        r = results[name]
+        print(f"{name:<12}{r['load_ms_median']:>10.1f}{r['load_ms_min']:>10.1f}{r['first_predict_ms']:>13.1f}{r['size_mb']:>10.1f}")
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[1] == CHILD_FLAG:
+        child(sys.argv[2])
+    else:
+        main()
@@ -0,0 +1,137 @@
+"""
+Thread-topology / replica tuning benchmark for DermAIPredictor.
+Sweeps TF intra-op and inter-op pool sizes, model replica count, CPU
+pinning and routing policy. Every configuration runs in a fresh process,
+because TF's thread pools can only be sized once per process. The process
+imports app.py with the matching DERMAI_* settings, and concurrent
+clients push single-image predictions through app.inference_queue, the
+same ReplicaPool the API uses. The sweep reports throughput and p50/p99
+latency.
+
+Run from the directory holding models/ (as for `python app.py`):
+    python benchmark_replicas.py --intra 0,4,8 --inter 0,1,2 --replicas 1,2,4 \\
+        --routing least_loaded,round_robin --cpus auto --clients 16 --duration 20
+"""
+
+import argparse
+import itertools
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import numpy as np
+
+
+def run_configuration(args):
+    """Child process: load app.py as configured through the environment and drive its pool"""
+    from PIL import Image
+    import app
+
+    if app.predictor is None:
+        raise RuntimeError("Model failed to load; run from the directory holding models/")
+    replicas, pool = app.replicas, app.inference_queue
+    image = Image.fromarray(np.random.default_rng(0).integers(0, 255, (450, 600, 3), dtype=np.uint8))
+
+    # Warm up every replica before measuring
+    for replica in replicas:
+        for _ in range(3):
+            replica.predict(image)
+
+    latencies = []
+    stop = threading.Event()
+
+    def client():
+        while not stop.is_set():
+            start = time.perf_counter()
+            pool.run(lambda replica: replica.predict(image), time.monotonic() + 60)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(args.clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    time.sleep(args.duration)
+    stop.set()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    print(json.dumps({
+        'requests': len(latencies),
+        'throughput_rps': len(latencies) / elapsed,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p99_ms': float(np.percentile(latencies, 99))
+    }))
+
+
+def parse_list(value, cast=str):
+    return [cast(v) for v in value.split(',') if v != '']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sweep TF thread pools, replicas and routing for DermAIPredictor')
+    parser.add_argument('--intra', default='0,1', help='Intra-op thread counts to try (0 = TF default)')
+    parser.add_argument('--inter', default='0,1', help='Inter-op thread counts to try (0 = TF default)')
+    parser.add_argument('--replicas', default='1,2', help='Replica counts to try')
+    parser.add_argument('--routing', default='least_loaded,round_robin')
+    parser.add_argument('--cpus', default='', help="Core sets for replicas: '', 'auto' or '0-7;8-15'")
+    parser.add_argument('--clients', type=int, default=8, help='Concurrent clients')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds per configuration')
+    parser.add_argument('--output', default='replica_benchmark.json')
+    # Internal: run a single configuration in this process
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_configuration(args)
+        return
+
+    configurations = []
+    for intra, inter, replicas, routing in itertools.product(
+            parse_list(args.intra, int), parse_list(args.inter, int),
+            parse_list(args.replicas, int), parse_list(args.routing)):
+        # Routing only matters with more than one replica
+        if replicas == 1 and routing != parse_list(args.routing)[0]:
+            continue
+        configurations.append({'intra_op': intra, 'inter_op': inter, 'replicas': replicas, 'routing': routing})
+
+    results = []
+    for config in configurations:
+        print(f"Running {config}...")
+        command = [
+            sys.executable, os.path.abspath(__file__), '--child',
+            '--clients', str(args.clients), '--duration', str(args.duration)
+        ]
+        env = dict(
+            os.environ,
+            DERMAI_INTRA_OP_THREADS=str(config['intra_op']),
+            DERMAI_INTER_OP_THREADS=str(config['inter_op']),
+            DERMAI_MODEL_REPLICAS=str(config['replicas']),
+            DERMAI_REPLICA_ROUTING=config['routing'],
+            DERMAI_REPLICA_CPUS=args.cpus,
+            # Let every client in; the benchmark measures the replicas, not load shedding
+            DERMAI_MAX_QUEUE_DEPTH=str(args.clients * 2),
+            PYTHONPATH=os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(__file__)),
+                                                     os.environ.get('PYTHONPATH')]))
+        )
+        output = subprocess.run(command, capture_output=True, text=True, env=env)
+        if output.returncode != 0:
+            print(output.stderr[-2000:])
+            continue
+        result = json.loads(output.stdout.strip().splitlines()[-1])
+        results.append(dict(config, **result))
+
+    print(f"\n{'intra':>6}{'inter':>6}{'replicas':>9}{'routing':>14}{'rps':>9}{'p50_ms':>9}{'p99_ms':>9}")
+    for r in sorted(results, key=lambda r: -r['throughput_rps']):
+        print(f"{r['intra_op']:>6}{r['inter_op']:>6}{r['replicas']:>9}{r['routing']:>14}"
+              f"{r['throughput_rps']:>9.1f}{r['p50_ms']:>9.1f}{r['p99_ms']:>9.1f}")
+
+    with open(args.output, 'w') as f:
+        json.dump({'cpus': args.cpus, 'clients': args.clients, 'results': results}, f, indent=2)
+    print(f"Results saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
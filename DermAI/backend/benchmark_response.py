@@ -0,0 +1,137 @@
+"""
+Post-processing and serialization benchmark for /predict responses.
+Times, per request, the work done after the model returns: ordering class
+probabilities, building the response dict and encoding it as JSON. The
+previous implementation (dicts rebuilt and Python-sorted on every call,
+encoded with Flask's default provider) is kept here as the baseline.
+
+No model is needed; probabilities are drawn from a Dirichlet distribution.
+
+Usage: python benchmark_response.py [--requests 20000]
+"""
+
+import argparse
+import json
+import time
+from datetime import datetime
+import numpy as np
+from flask import Flask, jsonify
+from flask.json.provider import DefaultJSONProvider
+from responses import DEFAULT_DISEASE_INFO, RESPONSE_FORMATS, FastJSONProvider, ResponseTemplates, orjson
+
+CLASS_NAMES = list(DEFAULT_DISEASE_INFO)
+
+
+def legacy_response(probabilities):
+    """The pre-template post-processing path, reproduced for comparison"""
+    results = []
+    for i, prob in enumerate(probabilities):
+        results.append({
+            'disease': CLASS_NAMES[i],
+            'confidence': float(prob),
+            'percentage': float(prob * 100)
+        })
+    results = sorted(results, key=lambda x: x['confidence'], reverse=True)
+    top = results[0]
+
+    recommendations = {
+        'HIGH': "⚠️ HIGH RISK: Please consult a dermatologist immediately. This condition requires urgent medical attention.",
+        'MODERATE': "⚡ MODERATE RISK: Schedule an appointment with a dermatologist within a week for proper evaluation.",
+        'LOW': "✅ LOW RISK: Monitor the condition and consult a doctor if symptoms worsen or persist.",
+        'VERY_LOW': "✅ VERY LOW RISK: Continue regular skin monitoring. Consult a doctor if you notice any changes."
+    }
+    disease_info = dict(DEFAULT_DISEASE_INFO)
+    return {
+        'success': True,
+        'prediction': {
+            'disease': top['disease'],
+            'confidence': top['confidence'],
+            'percentage': top['percentage'],
+            'risk_level': 'LOW'
+        },
+        'all_predictions': results,
+        'recommendation': {
+            'risk_message': recommendations['LOW'],
+            'disease_info': disease_info.get(top['disease'], "Please consult a healthcare professional for proper diagnosis."),
+            'general_advice': "This AI prediction is for informational purposes only and should not replace professional medical advice."
+        },
+        'timestamp': datetime.now().isoformat()
+    }
+
+
+def template_response(templates, probabilities, response_format):
+    (disease, confidence), predictions = templates.predictions(probabilities, response_format)
+    return {
+        'success': True,
+        'prediction': {
+            'disease': disease,
+            'confidence': confidence,
+            'percentage': confidence * 100,
+            'risk_level': 'LOW'
+        },
+        'all_predictions': predictions,
+        'recommendation': templates.recommendation(disease, 'LOW'),
+        'timestamp': datetime.now().isoformat()
+    }
+
+
+def measure(app, build, samples):
+    """Per-request microseconds for build() + jsonify, and the response size"""
+    timings = []
+    size = 0
+    with app.app_context():
+        for probabilities in samples:
+            start = time.perf_counter()
+            response = jsonify(build(probabilities))
+            body = response.get_data()
+            timings.append((time.perf_counter() - start) * 1e6)
+            size = len(body)
+    timings = np.array(timings)
+    return {
+        'mean_us': float(timings.mean()),
+        'p50_us': float(np.percentile(timings, 50)),
+        'p99_us': float(np.percentile(timings, 99)),
+        'bytes': size
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark DermAI response post-processing and JSON encoding')
+    parser.add_argument('--requests', type=int, default=20000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    samples = rng.dirichlet(np.ones(len(CLASS_NAMES)), size=args.requests).astype(np.float32)
+    templates = ResponseTemplates(CLASS_NAMES)
+
+    default_app = Flask('benchmark_default')
+    default_app.json = DefaultJSONProvider(default_app)
+    fast_app = Flask('benchmark_fast')
+    fast_app.json = FastJSONProvider(fast_app)
+
+    scenarios = [('legacy (per-call dicts, default json)', default_app, legacy_response)]
+    for response_format in RESPONSE_FORMATS:
+        scenarios.append((f'templates {response_format} (default json)', default_app,
+                          lambda p, f=response_format: template_response(templates, p, f)))
+        scenarios.append((f'templates {response_format} (fast json)', fast_app,
+                          lambda p, f=response_format: template_response(templates, p, f)))
+
+    print(f"orjson: {'available' if orjson is not None else 'not installed (fast json = default encoder)'}")
+    results = []
+    for name, app, build in scenarios:
+        # Warm up caches and the allocator before timing
+        measure(app, build, samples[:200])
+        result = measure(app, build, samples)
+        result['name'] = name
+        results.append(result)
+
+    baseline = results[0]['mean_us']
+    print(f"\n{'scenario':<42}{'mean_us':>9}{'p50_us':>9}{'p99_us':>9}{'bytes':>7}{'speedup':>9}")
+    for r in results:
+        print(f"{r['name']:<42}{r['mean_us']:>9.1f}{r['p50_us']:>9.1f}{r['p99_us']:>9.1f}{r['bytes']:>7}"
+              f"{baseline / r['mean_us']:>8.2f}x")
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""
+Time-to-target-macro-recall benchmark for the training samplers.
+
+Trains the DermAI CNN once per sampler variant, with the same seed,
+architecture and validation split, and computes macro recall (the mean
+per-class recall, which a nevus-only model can't fake) on the validation
+set after every epoch. Each run stops when it reaches --target or after
+--max-epochs / --max-minutes. The result is the wall-clock time and the
+number of training samples each variant needed.
+
+Variants are a weighting (uniform, balanced, sqrt), optionally with
+'+lesion' for lesion_id-grouped draws. 'uniform' alone is the plain
+flow_from_directory baseline; the others use --samples-per-epoch when it
+is given.
+
+    python benchmark_sampling.py --variants uniform,sqrt,balanced,balanced+lesion \\
+        --samples-per-epoch 2000 --target 0.5 --max-minutes 60
+"""
+
+import os
+os.environ['CUDA_VISIBLE_DEVICES'] = '-1'
+import argparse
+import json
+import time
+import numpy as np
+import tensorflow as tf
+from sklearn.metrics import recall_score
+
+from balanced_sampling import SAMPLING_WEIGHTINGS
+from model_trainer import DermAIModelTrainer
+
+
+class MacroRecallTarget(tf.keras.callbacks.Callback):
+    """Validation macro recall after every epoch; stops at the target or the time limit"""
+
+    def __init__(self, val_gen, target, max_seconds, batch_size):
+        super().__init__()
+        self.val_gen = val_gen
+        self.target = target
+        self.max_seconds = max_seconds
+        self.batch_size = batch_size
+        self.history = []
+        self.reached = None
+
+    def on_train_begin(self, logs=None):
+        self.start = time.perf_counter()
+        self.samples = 0
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.samples += self.batch_size
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.val_gen.reset()
+        predictions = self.model.predict(self.val_gen, verbose=0)
+        recall = float(recall_score(self.val_gen.classes, np.argmax(predictions, axis=1),
+                                    average='macro', zero_division=0))
+        elapsed = time.perf_counter() - self.start
+        self.history.append({'epoch': epoch + 1, 'elapsed_s': elapsed, 'samples': self.samples,
+                             'macro_recall': recall})
+        print(f"\nEpoch {epoch + 1}: macro recall {recall:.4f} after {elapsed:.0f}s, {self.samples} samples")
+        if self.reached is None and recall >= self.target:
+            self.reached = self.history[-1]
+            self.model.stop_training = True
+        elif elapsed > self.max_seconds:
+            self.model.stop_training = True
+
+
+def parse_variant(variant):
+    weighting, _, option = variant.partition('+')
+    if weighting not in SAMPLING_WEIGHTINGS or option not in ('', 'lesion'):
+        raise ValueError(f"Invalid variant: {variant}")
+    return weighting, option == 'lesion'
+
+
+def run_variant(variant, args):
+    weighting, group_by_lesion = parse_variant(variant)
+    trainer = DermAIModelTrainer(data_dir=args.data_dir, model_dir=args.model_dir)
+    trainer.batch_size = args.batch_size
+    trainer.sampling = weighting
+    trainer.group_by_lesion = group_by_lesion
+    if variant != 'uniform':
+        trainer.samples_per_epoch = args.samples_per_epoch
+
+    tf.keras.utils.set_random_seed(42)
+    train_gen, val_gen = trainer.create_data_generators()
+    model = trainer.build_model()
+    tracker = MacroRecallTarget(val_gen, args.target, args.max_minutes * 60, args.batch_size)
+    model.fit(
+        train_gen,
+        epochs=args.max_epochs,
+        steps_per_epoch=train_gen.samples // trainer.batch_size,
+        callbacks=[tracker],
+        verbose=1
+    )
+    return {
+        'variant': variant,
+        'samples_per_epoch': train_gen.samples,
+        'time_to_target_s': tracker.reached['elapsed_s'] if tracker.reached else None,
+        'samples_to_target': tracker.reached['samples'] if tracker.reached else None,
+        'epochs_to_target': tracker.reached['epoch'] if tracker.reached else None,
+        'best_macro_recall': max((h['macro_recall'] for h in tracker.history), default=None),
+        'epochs': tracker.history
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare training samplers by time to a target macro recall')
+    parser.add_argument('--data-dir', default=None, help='Dataset root with train/ (default: ../data)')
+    parser.add_argument('--model-dir', default=None, help='Model directory (default: backend/models)')
+    parser.add_argument('--variants', default='uniform,sqrt,balanced,balanced+lesion')
+    parser.add_argument('--samples-per-epoch', type=int, default=None,
+                        help='Sample budget per epoch for the non-baseline variants (default: one pass)')
+    parser.add_argument('--target', type=float, default=0.5, help='Validation macro recall to reach')
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--max-epochs', type=int, default=20)
+    parser.add_argument('--max-minutes', type=float, default=60)
+    parser.add_argument('--output', default='sampling_benchmark.json')
+    args = parser.parse_args()
+
+    results = [run_variant(variant, args) for variant in args.variants.split(',')]
+
+    print(f"\n{'variant':<18}{'samples/epoch':>14}{'to_target_s':>13}{'samples':>10}{'best_recall':>13}")
+    for r in results:
+        to_target = f"{r['time_to_target_s']:.0f}" if r['time_to_target_s'] is not None else 'not reached'
+        print(f"{r['variant']:<18}{r['samples_per_epoch']:>14}{to_target:>13}"
+              f"{r['samples_to_target'] or '-':>10}{r['best_macro_recall']:>13.4f}")
+
+    with open(args.output, 'w') as f:
+        json.dump({'target_macro_recall': args.target, 'batch_size': args.batch_size, 'results': results}, f, indent=2)
+    print(f"Results saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+"""
+Slow-client benchmark: WSGI (gunicorn) vs ASGI (uvicorn + asgi.py)
+Starts each server with the same number of request threads, opens a set
+of slow clients that trickle a multipart upload to /predict over several
+seconds, and meanwhile measures latency and throughput of normal clients.
+Under WSGI every slow upload pins a thread; under ASGI uploads are received
+on the event loop and threads only see complete requests.
+
+Usage: python benchmark_slow_clients.py [--target app_simple] [--slow-clients 8] [--duration 10]
+"""
+
+import argparse
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+import uuid
+
+BOUNDARY = uuid.uuid4().hex
+
+
+def sample_image_bytes():
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new('RGB', (640, 480), (200, 120, 90)).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+def multipart_body(image_bytes):
+    return (
+        f'--{BOUNDARY}\r\n'
+        'Content-Disposition: form-data; name="file"; filename="lesion.jpg"\r\n'
+        'Content-Type: image/jpeg\r\n\r\n'
+    ).encode() + image_bytes + f'\r\n--{BOUNDARY}--\r\n'.encode()
+
+
+def slow_client(port, body, seconds, stop):
+    """Send the upload in small pieces spread over `seconds`, like a poor mobile link"""
+    while not stop.is_set():
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=seconds * 4) as sock:
+                sock.sendall(
+                    f'POST /predict HTTP/1.1\r\nHost: 127.0.0.1\r\n'
+                    f'Content-Type: multipart/form-data; boundary={BOUNDARY}\r\n'
+                    f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode()
+                )
+                pieces = 50
+                step = max(1, len(body) // pieces)
+                for offset in range(0, len(body), step):
+                    if stop.is_set():
+                        return
+                    sock.sendall(body[offset:offset + step])
+                    time.sleep(seconds / pieces)
+                sock.recv(65536)
+        except OSError:
+            time.sleep(0.1)
+
+
+def normal_client(port, body, stop, latencies, errors):
+    while not stop.is_set():
+        request = urllib.request.Request(
+            f'http://127.0.0.1:{port}/predict', data=body, method='POST',
+            headers={'Content-Type': f'multipart/form-data; boundary={BOUNDARY}'}
+        )
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                response.read()
+            latencies.append((time.perf_counter() - start) * 1000)
+        except Exception:
+            errors.append(1)
+
+
+def wait_until_up(port, timeout=120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/health', timeout=2).read()
+            return
+        except Exception:
+            time.sleep(0.5)
+    raise RuntimeError(f"Server on port {port} did not come up")
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] if ordered else float('nan')
+
+
+def run_scenario(name, command, env, port, args, body):
+    server = subprocess.Popen(
+        command, env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_until_up(port)
+        stop = threading.Event()
+        latencies, errors = [], []
+        threads = [
+            threading.Thread(target=slow_client, args=(port, body, args.slow_seconds, stop), daemon=True)
+            for _ in range(args.slow_clients)
+        ]
+        # Let the slow uploads occupy the server before normal traffic starts
+        for t in threads:
+            t.start()
+        time.sleep(1)
+        normal = [
+            threading.Thread(target=normal_client, args=(port, body, stop, latencies, errors), daemon=True)
+            for _ in range(args.normal_clients)
+        ]
+        for t in normal:
+            t.start()
+        time.sleep(args.duration)
+        stop.set()
+        for t in normal:
+            t.join(timeout=60)
+
+        return {
+            'name': name,
+            'completed': len(latencies),
+            'errors': len(errors),
+            'throughput_rps': len(latencies) / args.duration,
+            'p50_ms': percentile(latencies, 50),
+            'p99_ms': percentile(latencies, 99)
+        }
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark slow-client resilience of WSGI vs ASGI serving')
+    parser.add_argument('--target', default='app_simple', help='Flask module to serve (app or app_simple)')
+    parser.add_argument('--threads', type=int, default=4, help='Request threads for both servers')
+    parser.add_argument('--slow-clients', type=int, default=8)
+    parser.add_argument('--slow-seconds', type=float, default=8.0, help='Time each slow upload takes')
+    parser.add_argument('--normal-clients', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--port', type=int, default=5901)
+    args = parser.parse_args()
+
+    body = multipart_body(sample_image_bytes())
+    env = dict(os.environ)
+
+    scenarios = [
+        ('wsgi (gunicorn gthread)', [
+            sys.executable, '-m', 'gunicorn', '--worker-class', 'gthread', '--workers', '1',
+            '--threads', str(args.threads), '--bind', f'127.0.0.1:{args.port}', f'{args.target}:app'
+        ], env),
+        ('asgi (uvicorn + asgi.py)', [
+            sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1', '--port', str(args.port + 1)
+        ], dict(env, DERMAI_ASGI_TARGET=args.target, DERMAI_ASGI_WORKER_THREADS=str(args.threads)))
+    ]
+
+    results = []
+    for i, (name, command, scenario_env) in enumerate(scenarios):
+        print(f"Running {name}...")
+        results.append(run_scenario(name, command, scenario_env, args.port + i, args, body))
+
+    print(f"\n{'server':<28}{'done':>7}{'errors':>8}{'rps':>8}{'p50_ms':>10}{'p99_ms':>10}")
+    for r in results:
+        print(f"{r['name']:<28}{r['completed']:>7}{r['errors']:>8}{r['throughput_rps']:>8.1f}{r['p50_ms']:>10.1f}{r['p99_ms']:>10.1f}")
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
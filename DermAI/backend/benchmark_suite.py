@@ -0,0 +1,213 @@
+"""
+Micro-benchmark suite for the prediction hot path, with stored baselines.
+
+Every case times one stage on fixed synthetic inputs:
+- ingest + preprocess for JPEG and PNG uploads, both small (600x450)
+  and 12MP (4000x3000), through ImageIngestor and preprocess_image;
+- the model forward pass, the post-processing (templates + risk level),
+  get_recommendation, and a full DermAIPredictor.predict;
+- the mock backend's generate_realistic_prediction and JSON
+  serialisation of a full response.
+
+No trained weights are needed. The CNN is built by
+DermAIModelTrainer.build_model with random weights (same architecture,
+so the same forward-pass cost) and saved into a temporary models/
+directory. app.py then loads it through its normal start-up path.
+
+Each case is timed in rounds, and each round runs enough calls to take
+about --round-ms. The per-call time of every round is one sample. --save
+writes the samples to the baseline file. A normal run compares against
+the baseline: a case regresses when its median is more than --threshold
+slower and a one-sided Mann-Whitney U test on the round samples gives
+p < --alpha. The exit status is 1 if any case regressed.
+
+    python benchmark_suite.py --save            # record a baseline
+    python benchmark_suite.py                   # compare against it
+    python benchmark_suite.py --only preprocess --rounds 30
+"""
+
+import os
+os.environ['CUDA_VISIBLE_DEVICES'] = '-1'
+import argparse
+import contextlib
+import io
+import json
+import platform
+import sys
+import tempfile
+import time
+import numpy as np
+from PIL import Image
+
+from benchmark_tiling import synthetic_dermoscopy
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+IMAGE_SIZES = {'small': (600, 450), '12mp': (4000, 3000)}
+
+
+def synthetic_image_bytes(size, fmt, seed=0):
+    """The fixed synthetic lesion image of benchmark_tiling, encoded as JPEG (q90) or PNG"""
+    buf = io.BytesIO()
+    synthetic_dermoscopy(*size, seed=seed).save(buf, fmt, **({'quality': 90} if fmt == 'JPEG' else {}))
+    return buf.getvalue()
+
+
+class Upload:
+    """The part of werkzeug's FileStorage that ImageIngestor reads"""
+
+    def __init__(self, data):
+        self.stream = io.BytesIO(data)
+
+
+def load_app(workdir):
+    """Import app.py against a random-weight model saved in workdir/models"""
+    from model_trainer import DermAIModelTrainer
+
+    models_dir = os.path.join(workdir, 'models')
+    trainer = DermAIModelTrainer(model_dir=models_dir)
+    with contextlib.redirect_stdout(io.StringIO()):
+        model = trainer.build_model()
+    model.save(os.path.join(models_dir, 'dermai_model.h5'))
+    with open(os.path.join(models_dir, 'model_info.json'), 'w') as f:
+        json.dump({'class_names': trainer.class_names}, f)
+
+    os.chdir(workdir)
+    import app
+    import app_simple
+
+    if app.predictor is None:
+        raise RuntimeError("Benchmark model failed to load")
+    return app, app_simple
+
+
+def build_cases(app, app_simple):
+    """name -> zero-argument callable"""
+    predictor = app.predictor
+    cases = {}
+
+    for label, size in IMAGE_SIZES.items():
+        for fmt in ('JPEG', 'PNG'):
+            data = synthetic_image_bytes(size, fmt)
+
+            def preprocess(data=data):
+                image = app.ingestor.open(Upload(data))
+                return predictor.preprocess_image(image)
+            cases[f'preprocess[{fmt.lower()}-{label}]'] = preprocess
+
+    small_jpeg = synthetic_image_bytes(IMAGE_SIZES['small'], 'JPEG')
+    batch = predictor.preprocess_image(Image.open(io.BytesIO(small_jpeg)))
+    probabilities = predictor.model.predict(batch, verbose=0)[0]
+    result = predictor.predict(Image.open(io.BytesIO(small_jpeg)))
+
+    def postprocess():
+        (disease, confidence), _ = predictor.templates.predictions(probabilities, 'full', predictor.response_top_k)
+        return predictor.determine_risk_level(disease, confidence)
+
+    cases['model_forward'] = lambda: predictor.model.predict(batch, verbose=0)
+    cases['postprocess'] = postprocess
+    cases['get_recommendation'] = lambda: predictor.get_recommendation('melanoma', 'HIGH')
+    cases['predict[jpeg-small]'] = lambda: predictor.predict(app.ingestor.open(Upload(small_jpeg)))
+    cases['generate_realistic_prediction'] = app_simple.generate_realistic_prediction
+    cases['serialize_response'] = lambda: app.app.json.dumps(result)
+    return cases
+
+
+def measure(fn, rounds, round_ms):
+    """Per-call seconds for each of `rounds` rounds, each sized to take about round_ms"""
+    fn()
+    start = time.perf_counter()
+    fn()
+    single = max(time.perf_counter() - start, 1e-7)
+    calls = max(1, int(round_ms / 1000 / single))
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(calls):
+            fn()
+        samples.append((time.perf_counter() - start) / calls)
+    return samples, calls
+
+
+def compare(name, samples, baseline, threshold, alpha):
+    from scipy.stats import mannwhitneyu
+
+    base = baseline.get('cases', {}).get(name)
+    if base is None:
+        return None
+    current_median = float(np.median(samples))
+    base_median = float(np.median(base['samples']))
+    change = current_median / base_median - 1
+    # One-sided: are the current samples stochastically larger (slower) than the baseline's?
+    p = float(mannwhitneyu(samples, base['samples'], alternative='greater').pvalue)
+    return {'baseline_median_us': base_median * 1e6, 'change': change, 'p_value': p,
+            'regressed': change > threshold and p < alpha}
+
+
+def environment():
+    import tensorflow as tf
+
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'tensorflow': tf.__version__,
+            'machine': platform.machine(), 'cpu_count': os.cpu_count()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmark the prediction pipeline against a stored baseline')
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save', action='store_true', help='Write the results as the new baseline')
+    parser.add_argument('--only', default=None, help='Run cases whose name contains this text')
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--round-ms', type=float, default=50.0, help='Target duration of one timing round')
+    parser.add_argument('--threshold', type=float, default=0.10, help='Median slowdown that counts (0.10 = 10%%)')
+    parser.add_argument('--alpha', type=float, default=0.01, help='Significance level of the regression test')
+    args = parser.parse_args()
+
+    baseline_path = os.path.abspath(args.baseline)
+    baseline = None
+    if not args.save:
+        if not os.path.exists(baseline_path):
+            print(f"No baseline at {baseline_path}; run with --save first")
+            return 2
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        app, app_simple = load_app(workdir)
+        cases = build_cases(app, app_simple)
+        if args.only:
+            cases = {name: fn for name, fn in cases.items() if args.only in name}
+
+        results = {}
+        regressions = []
+        print(f"\n{'case':<32}{'median_us':>12}{'calls':>7}{'baseline_us':>13}{'change':>9}{'p':>9}")
+        for name, fn in cases.items():
+            samples, calls = measure(fn, args.rounds, args.round_ms)
+            results[name] = {'samples': samples, 'calls_per_round': calls, 'median_us': float(np.median(samples)) * 1e6}
+            line = f"{name:<32}{results[name]['median_us']:>12.1f}{calls:>7}"
+            if baseline is not None:
+                verdict = compare(name, samples, baseline, args.threshold, args.alpha)
+                if verdict is None:
+                    line += f"{'(new)':>13}"
+                else:
+                    line += (f"{verdict['baseline_median_us']:>13.1f}{verdict['change']:>+9.1%}{verdict['p_value']:>9.3g}"
+                             + ('  REGRESSION' if verdict['regressed'] else ''))
+                    if verdict['regressed']:
+                        regressions.append(name)
+            print(line)
+
+    if args.save:
+        with open(baseline_path, 'w') as f:
+            json.dump({'environment': environment(), 'rounds': args.rounds, 'cases': results}, f, indent=2)
+        print(f"\nBaseline saved to {baseline_path}")
+        return 0
+
+    if baseline.get('environment') != environment():
+        print(f"\nNote: baseline was recorded on {baseline.get('environment')}, this is {environment()}")
+    if regressions:
+        print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+        return 1
+    print("\nNo regressions")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
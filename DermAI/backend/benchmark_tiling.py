@@ -0,0 +1,98 @@
+"""
+Latency vs tile count for tiled inference (tiling.py).
+
+Scores a synthetic high-resolution dermoscopy-like image (a dark lesion
+on skin-toned noise) with DermAIPredictor, once with tiling off and then
+with tiled inference at each tile budget. It reports the tiles actually
+used and the mean/p95 latency of the whole predict() call, which covers
+decode, crop, tiling, the batched forward pass and aggregation.
+
+Run from the directory holding models/ (as for `python app.py`):
+    python benchmark_tiling.py --budgets 1,4,8,16,32 --size 4000x3000 --scales 1,2,3
+"""
+
+import argparse
+import json
+import time
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+
+def synthetic_dermoscopy(width, height, seed=0):
+    rng = np.random.default_rng(seed)
+    skin = np.array([224, 172, 150], dtype=np.float32)
+    pixels = np.clip(skin + rng.normal(0, 12, (height, width, 3)), 0, 255).astype(np.uint8)
+    image = Image.fromarray(pixels)
+    draw = ImageDraw.Draw(image)
+    cx, cy = width * 0.55, height * 0.45
+    rx, ry = width * 0.18, height * 0.2
+    draw.ellipse([cx - rx, cy - ry, cx + rx, cy + ry], fill=(96, 58, 44))
+    draw.ellipse([cx - rx / 3, cy - ry / 4, cx + rx / 4, cy + ry / 3], fill=(52, 30, 28))
+    return image.filter(ImageFilter.GaussianBlur(3))
+
+
+def time_predict(predictor, image, tile_mode, repeats):
+    latencies = []
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = predictor.predict(image.copy(), tile_mode=tile_mode)
+        latencies.append((time.perf_counter() - start) * 1000)
+    if not result['success']:
+        raise RuntimeError(result['error'])
+    return result, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark tiled inference latency against tile count')
+    parser.add_argument('--budgets', default='1,4,8,16,32')
+    parser.add_argument('--scales', default='1,2,3', help='Tile scales (DERMAI_TILE_SCALES)')
+    parser.add_argument('--size', default='4000x3000', help='Synthetic image size, WxH')
+    parser.add_argument('--aggregation', default='mean', choices=['mean', 'max_risk'])
+    parser.add_argument('--repeats', type=int, default=10)
+    parser.add_argument('--output', default='tiling_benchmark.json')
+    args = parser.parse_args()
+
+    import app
+    from tiling import Tiler
+
+    predictor = app.predictor
+    if predictor is None:
+        raise RuntimeError("Model failed to load; run from the directory holding models/")
+
+    width, height = (int(v) for v in args.size.lower().split('x'))
+    image = synthetic_dermoscopy(width, height)
+    scales = [float(s) for s in args.scales.split(',')]
+
+    # Warm up the graph for single images and for tile batches
+    time_predict(predictor, image, 'off', 2)
+    results = []
+    _, latencies = time_predict(predictor, image, 'off', args.repeats)
+    results.append({'mode': 'off', 'budget': None, 'tiles': 1,
+                    'mean_ms': float(np.mean(latencies)), 'p95_ms': float(np.percentile(latencies, 95))})
+
+    for budget in (int(b) for b in args.budgets.split(',')):
+        predictor.tiler = Tiler(tile_size=predictor.img_size, scales=scales, budget=budget)
+        time_predict(predictor, image, args.aggregation, 1)
+        result, latencies = time_predict(predictor, image, args.aggregation, args.repeats)
+        results.append({
+            'mode': args.aggregation,
+            'budget': budget,
+            'tiles': result['tiling']['tiles'],
+            'crop': result['tiling']['crop'],
+            'mean_ms': float(np.mean(latencies)),
+            'p95_ms': float(np.percentile(latencies, 95)),
+            'inference_ms': result['tiling']['inference_ms']
+        })
+
+    print(f"\n{'mode':<10}{'budget':>8}{'tiles':>7}{'mean_ms':>10}{'p95_ms':>10}")
+    for r in results:
+        print(f"{r['mode']:<10}{r['budget'] or '-':>8}{r['tiles']:>7}{r['mean_ms']:>10.1f}{r['p95_ms']:>10.1f}")
+
+    with open(args.output, 'w') as f:
+        json.dump({'image_size': [width, height], 'scales': scales, 'results': results}, f, indent=2)
+    print(f"Results saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
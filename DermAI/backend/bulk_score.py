@@ -0,0 +1,235 @@
+"""
+Offline bulk scoring with DermAIPredictor, e.g. re-scoring uploads/ or
+data/test after a model update without going through /batch-predict.
+
+- Input is a directory (walked recursively for images) or a manifest: a
+  .txt file with one path per line, or a .csv with a 'path' column. Paths
+  in a manifest are relative to the manifest's directory.
+- Images are decoded, converted to RGB and resized in a process pool
+  (the same ImageIngestor limits and resize as the API). The main process
+  runs batched inference on the predictor, while the pool decodes the
+  next window of images.
+- Each output row has the path, the label when the image sits in a class
+  folder (data/test/<class>/...), the top class, confidence, risk level,
+  every class probability and the model version. Unreadable images get
+  an error instead.
+- Rows are appended to <output>.progress.csv after every batch, and that
+  file is the checkpoint: re-running the same command skips every path it
+  already holds. When scoring finishes, the rows are written to the
+  output (.csv, or .parquet with pyarrow installed) and the progress file
+  is removed.
+
+Only DermAIPredictor is loaded, not the Flask service (no queue workers,
+prediction log or background threads). Run from the directory holding
+models/ (as for `python app.py`), or pass --model / --model-info:
+    python bulk_score.py ../data/test --output test_scores.parquet --workers 4 --batch-size 64
+"""
+
+import argparse
+import csv
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from types import SimpleNamespace
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.bmp'}
+
+_ingestor = None
+
+
+def _init_worker(model_size):
+    global _ingestor
+    from ingestion import ImageIngestor
+
+    _ingestor = ImageIngestor(model_size=model_size)
+
+
+def decode(task):
+    """Worker: (index, path) -> (index, uint8 model input or None, error)"""
+    from ingestion import ImageRejected, resized_rgb
+
+    index, path = task
+    try:
+        with open(path, 'rb') as f:
+            image = _ingestor.open(SimpleNamespace(stream=f))
+            return index, resized_rgb(image, _ingestor.model_size), None
+    except ImageRejected as rejection:
+        return index, None, rejection.message
+    except Exception as e:
+        return index, None, str(e)
+
+
+def list_inputs(source):
+    """Absolute image paths with the path written to the output for each"""
+    if os.path.isdir(source):
+        paths = []
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                    paths.append(os.path.join(root, name))
+        return [(path, os.path.relpath(path, source)) for path in paths]
+
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source, newline='') as f:
+        if source.endswith('.csv'):
+            names = [row['path'] for row in csv.DictReader(f)]
+        else:
+            names = [line.strip() for line in f if line.strip()]
+    return [(os.path.join(base, name), name) for name in names]
+
+
+def read_progress(progress_path, fields):
+    """Rows already scored by an interrupted run; a torn last line is dropped"""
+    if not os.path.exists(progress_path):
+        return []
+    # Cut a partially written last line so appended rows start on a fresh line
+    with open(progress_path, 'rb+') as f:
+        data = f.read()
+        if data and not data.endswith(b'\n'):
+            f.truncate(data.rfind(b'\n') + 1)
+    with open(progress_path, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header != fields:
+            raise ValueError(f"{progress_path} was written with different columns (another model?); "
+                             "delete it to start over")
+        return [row for row in reader if len(row) == len(fields)]
+
+
+def write_output(rows, fields, output):
+    import pandas as pd
+
+    df = pd.DataFrame(rows, columns=fields)
+    numeric = ['confidence'] + [f for f in fields if f.startswith('prob_')]
+    df[numeric] = df[numeric].apply(pd.to_numeric, errors='coerce')
+    if output.endswith('.parquet'):
+        df.to_parquet(output, index=False)
+    else:
+        df.to_csv(output, index=False)
+
+
+def score(args):
+    # Start the decode pool before TensorFlow loads; the input size matches DermAIPredictor.img_size
+    model_size = (224, 224)
+    pool = multiprocessing.get_context('spawn').Pool(
+        args.workers, initializer=_init_worker, initargs=(model_size,)
+    )
+
+    from predictor import DermAIPredictor
+
+    predictor = DermAIPredictor(model_path=args.model, model_info_path=args.model_info)
+
+    class_names = list(predictor.templates.class_names)
+    model_version = predictor.model_version
+    fields = (['path', 'label', 'predicted', 'confidence', 'risk_level'] +
+              [f'prob_{name}' for name in class_names] + ['model_version', 'error'])
+
+    inputs = list_inputs(args.input)
+    progress_path = args.output + '.progress.csv'
+    done_rows = read_progress(progress_path, fields)
+    done = {row[0] for row in done_rows}
+    todo = [(path, name) for path, name in inputs if name not in done]
+    logger.info(f"{len(inputs)} images, {len(done)} already scored, {len(todo)} to score")
+
+    window = args.batch_size * args.window_batches
+    windows = [todo[i:i + window] for i in range(0, len(todo), window)]
+
+    def submit(items):
+        return pool.map_async(decode, list(enumerate(path for path, _ in items)),
+                              chunksize=max(1, args.batch_size // args.workers))
+
+    new_file = not os.path.exists(progress_path)
+    scored = 0
+    inference_s = 0.0
+    start = time.perf_counter()
+    with open(progress_path, 'a', newline='') as progress:
+        writer = csv.writer(progress)
+        if new_file:
+            writer.writerow(fields)
+
+        pending = submit(windows[0]) if windows else None
+        for w, items in enumerate(windows):
+            decoded = pending.get()
+            # Keep the pool busy on the next window while this one is scored
+            pending = submit(windows[w + 1]) if w + 1 < len(windows) else None
+
+            for b in range(0, len(decoded), args.batch_size):
+                rows = []
+                batch = [(i, pixels) for i, pixels, _ in decoded[b:b + args.batch_size] if pixels is not None]
+                for i, pixels, error in decoded[b:b + args.batch_size]:
+                    if error is not None:
+                        rows.append((i, [items[i][1], label_of(items[i][1], class_names), '', '', ''] +
+                                     [''] * len(class_names) + [model_version, error]))
+
+                if batch:
+                    inputs_array = np.stack([pixels for _, pixels in batch]).astype(np.float32) / 255.0
+                    predictions, elapsed_ms = predictor.timed_predict(inputs_array)
+                    inference_s += elapsed_ms / 1000
+                    for (i, _), probabilities in zip(batch, np.asarray(predictions)):
+                        top = int(np.argmax(probabilities))
+                        disease, confidence = class_names[top], float(probabilities[top])
+                        rows.append((i, [items[i][1], label_of(items[i][1], class_names), disease,
+                                         f'{confidence:.6f}', predictor.determine_risk_level(disease, confidence)] +
+                                    [f'{p:.6f}' for p in probabilities] + [model_version, '']))
+
+                writer.writerows(row for _, row in sorted(rows, key=lambda r: r[0]))
+                progress.flush()
+                scored += len(rows)
+
+            elapsed = time.perf_counter() - start
+            logger.info(f"{len(done) + scored}/{len(inputs)} scored, {scored / elapsed:.1f} images/sec")
+
+    pool.close()
+    pool.join()
+    elapsed = time.perf_counter() - start
+
+    rows = read_progress(progress_path, fields)
+    write_output(rows, fields, args.output)
+    os.remove(progress_path)
+
+    failed = sum(1 for row in rows if row[-1])
+    print(f"Scored {scored} images in {elapsed:.1f}s ({scored / elapsed if elapsed else 0:.1f} images/sec, "
+          f"{inference_s:.1f}s in inference); {failed} failed")
+    print(f"Results for {len(rows)} images saved to {args.output}")
+
+
+def label_of(name, class_names):
+    """Class folder the image sits in (data/test/<class>/x.jpg), or ''"""
+    parent = os.path.basename(os.path.dirname(name))
+    return parent if parent in class_names else ''
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Score a directory or manifest of images with DermAIPredictor')
+    parser.add_argument('input', help='Image directory, .txt list of paths or .csv with a path column')
+    parser.add_argument('--output', default='scores.csv', help='.csv or .parquet')
+    parser.add_argument('--model', default='models/dermai_model.h5')
+    parser.add_argument('--model-info', default='models/model_info.json')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                        help='Decode processes')
+    parser.add_argument('--window-batches', type=int, default=4,
+                        help='Batches decoded per pool round (bounds decoded images held in memory)')
+    args = parser.parse_args()
+
+    if not args.output.endswith(('.csv', '.parquet')):
+        parser.error('--output must end in .csv or .parquet')
+    if args.output.endswith('.parquet'):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            parser.error('Parquet output needs pyarrow (pip install pyarrow)')
+
+    logging.basicConfig(level=logging.INFO)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    score(args)
+
+
+if __name__ == '__main__':
+    main()
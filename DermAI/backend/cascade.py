@@ -0,0 +1,108 @@
+"""
+Confidence-gated cascade inference (DERMAI_CASCADE_MODEL).
+
+A cheap first-stage model scores every image. Its answer is returned
+as-is only when it is confident and clearly low-risk:
+- top-1 confidence >= DERMAI_CASCADE_CONFIDENCE;
+- the top-1 class is not a high-risk class (DERMAI_CASCADE_ESCALATE_CLASSES,
+  by default the classes determine_risk_level treats as high risk);
+- no high-risk class gets more than DERMAI_CASCADE_MAX_HIGH_RISK_PROB.
+Anything else escalates to the full model, so a possible melanoma is
+always scored by the full CNN.
+
+Suitable first stages are the distilled student (models/student/,
+distill_trainer.py) or the pruned model (models/compressed/*.npz,
+model_compression.py). Either one is loaded through model_artifacts like
+the primary, and its class order must match the primary's.
+
+Counters report the escalation rate, the reason for each escalation and
+the mean latency of the first-stage-only and escalated paths, under
+'cascade' in GET /stats.
+"""
+
+import logging
+import os
+import threading
+import numpy as np
+from model_artifacts import load_model_artifact, preferred_artifact
+
+logger = logging.getLogger(__name__)
+
+CASCADE_MODEL = os.environ.get('DERMAI_CASCADE_MODEL', '')
+CASCADE_CONFIDENCE = float(os.environ.get('DERMAI_CASCADE_CONFIDENCE', 0.85))
+CASCADE_MAX_HIGH_RISK_PROB = float(os.environ.get('DERMAI_CASCADE_MAX_HIGH_RISK_PROB', 0.1))
+CASCADE_ESCALATE_CLASSES = tuple(
+    c.strip() for c in os.environ.get('DERMAI_CASCADE_ESCALATE_CLASSES', 'melanoma,basal_cell_carcinoma').split(',')
+    if c.strip()
+)
+
+
+class CascadeGate:
+    def __init__(self, model, class_names, model_path=None, confidence=CASCADE_CONFIDENCE,
+                 escalate_classes=CASCADE_ESCALATE_CLASSES, max_high_risk_prob=CASCADE_MAX_HIGH_RISK_PROB):
+        unknown = set(escalate_classes) - set(class_names)
+        if unknown:
+            raise ValueError(f"Unknown cascade escalation classes: {', '.join(sorted(unknown))}")
+        self.model = model
+        self.model_path = model_path
+        self.class_names = list(class_names)
+        self.confidence = confidence
+        self.max_high_risk_prob = max_high_risk_prob
+        self.escalate_classes = tuple(escalate_classes)
+        self.high_risk = np.array([self.class_names.index(c) for c in self.escalate_classes], dtype=np.int64)
+        self.lock = threading.Lock()
+        self.counters = {
+            'requests': 0,
+            'answered_first_stage': 0,
+            'escalated': 0,
+            'escalated_low_confidence': 0,
+            'escalated_high_risk_class': 0,
+            'escalated_high_risk_probability': 0
+        }
+        self.path_ms = {'first_stage': 0.0, 'escalated': 0.0}
+
+    @classmethod
+    def load(cls, path, class_names, **kwargs):
+        artifact_path = preferred_artifact(path)
+        gate = cls(load_model_artifact(artifact_path), class_names, model_path=artifact_path, **kwargs)
+        logger.info(f"Cascade first stage loaded from {artifact_path}")
+        return gate
+
+    def first_stage(self, processed_image):
+        """First-stage probabilities, and None if they can be returned or the escalation reason"""
+        probabilities = np.asarray(self.model.predict(processed_image, verbose=0))[0]
+        if len(probabilities) != len(self.class_names):
+            raise ValueError(f"Cascade model has {len(probabilities)} classes, expected {len(self.class_names)}")
+
+        top = int(np.argmax(probabilities))
+        if top in self.high_risk:
+            return probabilities, 'high_risk_class'
+        if probabilities[top] < self.confidence:
+            return probabilities, 'low_confidence'
+        if len(self.high_risk) and probabilities[self.high_risk].max() > self.max_high_risk_prob:
+            return probabilities, 'high_risk_probability'
+        return probabilities, None
+
+    def record(self, escalation, elapsed_ms):
+        with self.lock:
+            self.counters['requests'] += 1
+            if escalation is None:
+                self.counters['answered_first_stage'] += 1
+                self.path_ms['first_stage'] += elapsed_ms
+            else:
+                self.counters['escalated'] += 1
+                self.counters[f'escalated_{escalation}'] += 1
+                self.path_ms['escalated'] += elapsed_ms
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            answered, escalated = stats['answered_first_stage'], stats['escalated']
+            stats['escalation_rate'] = escalated / stats['requests'] if stats['requests'] else None
+            stats['first_stage_ms'] = self.path_ms['first_stage'] / answered if answered else None
+            stats['escalated_ms'] = self.path_ms['escalated'] / escalated if escalated else None
+        stats['model_path'] = self.model_path
+        stats['confidence'] = self.confidence
+        stats['max_high_risk_prob'] = self.max_high_risk_prob
+        stats['escalate_classes'] = list(self.escalate_classes)
+        return stats
@@ -0,0 +1,243 @@
+"""
+Columnar cache of HAM10000_metadata.csv, shared by organize_dataset.py,
+model_trainer.py, similarity.py and the /dataset-stats endpoint.
+
+The CSV is parsed once into typed NumPy columns and saved next to it as
+HAM10000_metadata.cache.npz:
+- categorical columns (dx, dx_type, sex, localization, dataset, age_band)
+  are stored as small integer codes plus their category list;
+- age is float32 (NaN where unknown); image_id and lesion_id are strings.
+The cache records the CSV's size and modification time and is rebuilt
+when either changes.
+
+It also holds a precomputed count cube over dx x localization x age_band
+x sex x dx_type. A filtered group-by over those dimensions is a slice and
+a sum over a few thousand cells, which takes microseconds. No DataFrame
+is involved.
+"""
+
+import logging
+import os
+import threading
+from pathlib import Path
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+METADATA_FILE = Path(__file__).parent / 'HAM10000_metadata.csv'
+CACHE_SUFFIX = '.cache.npz'
+CACHE_FORMAT_VERSION = 1
+
+# Raw HAM10000 dx codes -> class names used by the model and the data/ folders
+DX_NAMES = {
+    'mel': 'melanoma',
+    'nv': 'nevus',
+    'bcc': 'basal_cell_carcinoma',
+    'akiec': 'actinic_keratosis',
+    'bkl': 'benign_keratosis',
+    'df': 'dermatofibroma',
+    'vasc': 'vascular_lesion'
+}
+DX_CODES = {name: code for code, name in DX_NAMES.items()}
+
+CATEGORICAL_COLUMNS = ('dx', 'dx_type', 'sex', 'localization', 'dataset', 'age_band')
+STRING_COLUMNS = ('image_id', 'lesion_id')
+CUBE_DIMENSIONS = ('dx', 'localization', 'age_band', 'sex', 'dx_type')
+
+AGE_BAND_EDGES = (10, 20, 30, 40, 50, 60, 70, 80)
+AGE_BANDS = ('0-9', '10-19', '20-29', '30-39', '40-49', '50-59', '60-69', '70-79', '80+', 'unknown')
+
+
+def age_bands(ages):
+    """Band index for each age; NaN ages map to 'unknown'"""
+    ages = np.asarray(ages, dtype=np.float32)
+    bands = np.digitize(np.nan_to_num(ages, nan=0.0), AGE_BAND_EDGES)
+    bands[np.isnan(ages)] = AGE_BANDS.index('unknown')
+    return bands
+
+
+def _csv_fingerprint(csv_path):
+    stat = os.stat(csv_path)
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+
+class DatasetMetadata:
+    """Typed, cached view of the HAM10000 metadata"""
+
+    def __init__(self, columns, categories, cube):
+        self.columns = columns
+        self.categories = categories
+        self.cube = cube
+        self.category_index = {
+            column: {value: i for i, value in enumerate(values)} for column, values in categories.items()
+        }
+        # Labels as plain Python strings (dx as class names) for building query results
+        self.labels = {
+            column: [DX_NAMES.get(value, value) if column == 'dx' else value for value in values.tolist()]
+            for column, values in categories.items()
+        }
+
+    def __len__(self):
+        return len(self.columns['image_id'])
+
+    @classmethod
+    def from_csv(cls, csv_path):
+        import pandas as pd
+
+        df = pd.read_csv(csv_path)
+        columns = {column: df[column].astype(str).to_numpy(dtype=str) for column in STRING_COLUMNS}
+        columns['age'] = df['age'].to_numpy(dtype=np.float32)
+
+        categories = {}
+        for column in CATEGORICAL_COLUMNS:
+            if column == 'age_band':
+                codes = age_bands(columns['age'])
+                values = AGE_BANDS
+            else:
+                # Fixed order for dx (the model's class order), sorted for the rest
+                known = list(DX_NAMES) if column == 'dx' else []
+                values = known + sorted(set(df[column].fillna('unknown').astype(str)) - set(known))
+                lookup = {value: i for i, value in enumerate(values)}
+                codes = np.array([lookup[v] for v in df[column].fillna('unknown').astype(str)])
+            categories[column] = np.array(values, dtype=str)
+            columns[column] = codes.astype(np.uint8)
+
+        shape = tuple(len(categories[dim]) for dim in CUBE_DIMENSIONS)
+        cube = np.zeros(shape, dtype=np.int32)
+        np.add.at(cube, tuple(columns[dim] for dim in CUBE_DIMENSIONS), 1)
+        return cls(columns, categories, cube)
+
+    def save(self, cache_path, fingerprint):
+        arrays = {'format_version': np.array(CACHE_FORMAT_VERSION), 'fingerprint': fingerprint, 'cube': self.cube}
+        arrays.update({f'col_{name}': values for name, values in self.columns.items()})
+        arrays.update({f'cat_{name}': values for name, values in self.categories.items()})
+        tmp_path = str(cache_path) + '.tmp.npz'
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, cache_path)
+
+    @classmethod
+    def load_cache(cls, cache_path, fingerprint):
+        """The cached metadata, or None if the cache is missing, stale or from another format"""
+        try:
+            with np.load(cache_path) as data:
+                if int(data['format_version']) != CACHE_FORMAT_VERSION or \
+                        not np.array_equal(data['fingerprint'], fingerprint):
+                    return None
+                columns = {key[4:]: data[key] for key in data.files if key.startswith('col_')}
+                categories = {key[4:]: data[key] for key in data.files if key.startswith('cat_')}
+                return cls(columns, categories, data['cube'])
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def decoded(self, column):
+        """A categorical column as its string values"""
+        if column in self.categories:
+            return self.categories[column][self.columns[column]]
+        return self.columns[column]
+
+    def to_dataframe(self):
+        """pandas DataFrame with the original CSV columns; categoricals stay categorical"""
+        import pandas as pd
+
+        data = {}
+        for column in ('lesion_id', 'image_id', 'dx', 'dx_type', 'age', 'sex', 'localization', 'dataset'):
+            if column in self.categories:
+                data[column] = pd.Categorical.from_codes(self.columns[column], self.categories[column].tolist())
+            else:
+                data[column] = self.columns[column]
+        return pd.DataFrame(data)
+
+    def class_counts(self):
+        """Images per class name"""
+        counts = self.cube.sum(axis=tuple(range(1, self.cube.ndim)))
+        return {DX_NAMES.get(dx, dx): int(count) for dx, count in zip(self.categories['dx'], counts)}
+
+    def group_counts(self, group_by=('dx',), filters=None):
+        """Counts for a filtered group-by over CUBE_DIMENSIONS, answered from the count cube.
+
+        filters maps a dimension to one value or a list of values (class
+        names are accepted for dx). Returns (rows, total): one row per
+        non-empty group with its count and share of the filtered total.
+        When dx is grouped together with other dimensions, each row also
+        gets 'share_within_group', the dx prevalence inside its group.
+        """
+        group_by = tuple(group_by)
+        for dim in group_by + tuple(filters or ()):
+            if dim not in CUBE_DIMENSIONS:
+                raise ValueError(f"Unknown dimension: {dim}. Use one of: {', '.join(CUBE_DIMENSIONS)}")
+        if len(set(group_by)) != len(group_by):
+            raise ValueError("Duplicate group_by dimension")
+
+        selection = []
+        for dim in CUBE_DIMENSIONS:
+            values = (filters or {}).get(dim)
+            if values is None:
+                selection.append(np.arange(self.cube.shape[len(selection)]))
+                continue
+            values = [values] if isinstance(values, str) else list(values)
+            codes = []
+            for value in values:
+                if dim == 'dx':
+                    value = DX_CODES.get(value, value)
+                if value not in self.category_index[dim]:
+                    raise ValueError(f"Unknown {dim} value: {value}")
+                codes.append(self.category_index[dim][value])
+            selection.append(np.array(codes))
+
+        counts = self.cube
+        for axis, dim in enumerate(CUBE_DIMENSIONS):
+            if dim in (filters or {}):
+                counts = counts.take(selection[axis], axis=axis)
+        # Sum out every dimension that is not grouped, then put grouped ones in group_by order
+        summed = counts.sum(axis=tuple(i for i, dim in enumerate(CUBE_DIMENSIONS) if dim not in group_by))
+        kept = [dim for dim in CUBE_DIMENSIONS if dim in group_by]
+        summed = np.transpose(summed, [kept.index(dim) for dim in group_by]) if group_by else summed
+        total = int(counts.sum())
+
+        within = None
+        if 'dx' in group_by and len(group_by) > 1:
+            within = summed.sum(axis=group_by.index('dx'), keepdims=True)
+
+        if not group_by:
+            return [{'count': total, 'share': 1.0 if total else 0.0}], total
+
+        rows = []
+        for position in zip(*np.nonzero(summed)):
+            count = int(summed[position])
+            row = {dim: self.labels[dim][selection[CUBE_DIMENSIONS.index(dim)][i]]
+                   for dim, i in zip(group_by, position)}
+            row['count'] = count
+            row['share'] = count / total if total else 0.0
+            if within is not None:
+                group_position = tuple(0 if dim == 'dx' else i for dim, i in zip(group_by, position))
+                row['share_within_group'] = count / int(within[group_position])
+            rows.append(row)
+        return rows, total
+
+
+_cache_lock = threading.Lock()
+_loaded = {}
+
+
+def load_metadata(csv_path=METADATA_FILE):
+    """Metadata for csv_path, from the on-disk cache when it is current (memoised per process)"""
+    csv_path = Path(csv_path)
+    fingerprint = _csv_fingerprint(csv_path)
+    key = str(csv_path.resolve())
+
+    with _cache_lock:
+        cached = _loaded.get(key)
+        if cached is not None and np.array_equal(cached[0], fingerprint):
+            return cached[1]
+
+        cache_path = csv_path.with_suffix(CACHE_SUFFIX)
+        metadata = DatasetMetadata.load_cache(cache_path, fingerprint)
+        if metadata is None:
+            logger.info(f"Building metadata cache {cache_path}")
+            metadata = DatasetMetadata.from_csv(csv_path)
+            try:
+                metadata.save(cache_path, fingerprint)
+            except OSError as e:
+                logger.warning(f"Could not write metadata cache {cache_path}: {str(e)}")
+        _loaded[key] = (fingerprint, metadata)
+        return metadata
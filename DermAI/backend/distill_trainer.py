@@ -0,0 +1,253 @@
+"""
+Knowledge distillation for DermAI
+Trains a small CPU-friendly student CNN on the softened predictions of the
+trained teacher (models/dermai_model.h5). The student is written to
+models/student/ in the same dermai_model.h5 + model_info.json layout, so it
+can be served with DermAIPredictor(model_path='models/student/dermai_model.h5',
+model_info_path='models/student/model_info.json').
+"""
+
+import os
+os.environ['CUDA_VISIBLE_DEVICES'] = '-1'
+import argparse
+import json
+import tensorflow as tf
+from tensorflow.keras.models import Sequential
+from tensorflow.keras.layers import (
+    Activation, BatchNormalization, Conv2D, Dense, Dropout,
+    GlobalAveragePooling2D, SeparableConv2D
+)
+from tensorflow.keras.optimizers import Adam
+from tensorflow.keras.callbacks import EarlyStopping, ReduceLROnPlateau
+from pathlib import Path
+
+from model_trainer import DermAIModelTrainer
+import model_report
+
+
+class Distiller(tf.keras.Model):
+    """Trains a student on a blend of hard labels and temperature-softened teacher targets"""
+
+    def __init__(self, student, teacher, temperature=4.0, alpha=0.1):
+        super().__init__()
+        self.student = student
+        self.teacher = teacher
+        self.teacher.trainable = False
+        # The student ends in Dense('logits') -> softmax; train against the logits
+        self.student_logits = tf.keras.Model(student.inputs, student.get_layer('logits').output)
+        self.temperature = temperature
+        self.alpha = alpha
+        self.hard_loss_fn = tf.keras.losses.CategoricalCrossentropy(from_logits=True)
+        self.soft_loss_fn = tf.keras.losses.KLDivergence()
+        self.loss_tracker = tf.keras.metrics.Mean(name='loss')
+        self.accuracy_tracker = tf.keras.metrics.CategoricalAccuracy(name='accuracy')
+
+    @property
+    def metrics(self):
+        return [self.loss_tracker, self.accuracy_tracker]
+
+    def soft_targets(self, x):
+        # The teacher only exposes softmax outputs; log-probabilities are its
+        # logits up to a per-sample constant, which softmax ignores.
+        teacher_probs = self.teacher(x, training=False)
+        teacher_logits = tf.math.log(tf.clip_by_value(teacher_probs, 1e-7, 1.0))
+        return tf.nn.softmax(teacher_logits / self.temperature)
+
+    def train_step(self, data):
+        x, y = data
+        soft_targets = self.soft_targets(x)
+
+        with tf.GradientTape() as tape:
+            logits = self.student_logits(x, training=True)
+            hard_loss = self.hard_loss_fn(y, logits)
+            soft_loss = self.soft_loss_fn(soft_targets, tf.nn.softmax(logits / self.temperature))
+            # T^2 keeps the soft-target gradients on the same scale as the hard loss
+            loss = self.alpha * hard_loss + (1 - self.alpha) * (self.temperature ** 2) * soft_loss
+
+        variables = self.student_logits.trainable_variables
+        gradients = tape.gradient(loss, variables)
+        self.optimizer.apply_gradients(zip(gradients, variables))
+
+        self.loss_tracker.update_state(loss)
+        self.accuracy_tracker.update_state(y, logits)
+        return {m.name: m.result() for m in self.metrics}
+
+    def test_step(self, data):
+        x, y = data
+        logits = self.student_logits(x, training=False)
+        loss = self.hard_loss_fn(y, logits)
+
+        self.loss_tracker.update_state(loss)
+        self.accuracy_tracker.update_state(y, logits)
+        return {m.name: m.result() for m in self.metrics}
+
+    def call(self, inputs, training=False):
+        return self.student(inputs, training=training)
+
+
+class DermAIDistillationTrainer(DermAIModelTrainer):
+    def __init__(self, data_dir=None, model_dir=None, teacher_path=None, student_dir=None,
+                 temperature=4.0, alpha=0.1):
+        super().__init__(data_dir=data_dir, model_dir=model_dir)
+
+        self.teacher_path = Path(teacher_path) if teacher_path else self.model_dir / 'dermai_model.h5'
+        self.student_dir = Path(student_dir) if student_dir else self.model_dir / 'student'
+        self.temperature = temperature
+        self.alpha = alpha
+
+        os.makedirs(self.student_dir, exist_ok=True)
+
+    def load_teacher(self):
+        print(f"Loading teacher model from {self.teacher_path}...")
+        if not self.teacher_path.exists():
+            raise FileNotFoundError(f"Teacher model not found: {self.teacher_path}")
+        return tf.keras.models.load_model(self.teacher_path)
+
+    def build_student_model(self):
+        print("Building student CNN model...")
+
+        # Depthwise-separable blocks with early striding and global pooling:
+        # roughly 1% of the teacher's parameters and far fewer FLOPs.
+        model = Sequential([
+            Conv2D(24, (3,3), strides=2, padding='same', activation='relu', input_shape=(*self.img_size, 3)),
+            BatchNormalization(),
+
+            SeparableConv2D(48, (3,3), strides=2, padding='same', activation='relu'),
+            BatchNormalization(),
+
+            SeparableConv2D(96, (3,3), strides=2, padding='same', activation='relu'),
+            BatchNormalization(),
+
+            SeparableConv2D(128, (3,3), strides=2, padding='same', activation='relu'),
+            BatchNormalization(),
+
+            SeparableConv2D(192, (3,3), strides=2, padding='same', activation='relu'),
+            BatchNormalization(),
+
+            GlobalAveragePooling2D(),
+            Dropout(0.3),
+            Dense(self.num_classes, name='logits'),
+            Activation('softmax', name='probabilities')
+        ])
+
+        model.summary()
+        return model
+
+    def distill(self, teacher, student, train_gen, val_gen):
+        print("Starting distillation...")
+
+        distiller = Distiller(student, teacher, temperature=self.temperature, alpha=self.alpha)
+        distiller.compile(optimizer=Adam(learning_rate=self.learning_rate))
+
+        callbacks = [
+            EarlyStopping(monitor='val_accuracy', mode='max', patience=10, restore_best_weights=True, verbose=1),
+            ReduceLROnPlateau(monitor='val_loss', factor=0.2, patience=5, min_lr=1e-7, verbose=1)
+        ]
+
+        steps_per_epoch = train_gen.samples // self.batch_size
+        validation_steps = val_gen.samples // self.batch_size
+
+        history = distiller.fit(
+            train_gen,
+            epochs=self.epochs,
+            steps_per_epoch=steps_per_epoch,
+            validation_data=val_gen,
+            validation_steps=validation_steps,
+            callbacks=callbacks,
+            verbose=1
+        )
+
+        # Give the student a regular compile state so it saves/loads like the teacher
+        student.compile(optimizer=Adam(learning_rate=self.learning_rate), loss='categorical_crossentropy', metrics=['accuracy'])
+        return history
+
+    def compare_models(self, teacher, student, val_gen):
+        print("Comparing teacher and student...")
+        input_shape = (*self.img_size, 3)
+        rows = []
+        reports = {}
+
+        for name, model, path in [
+            ('teacher', teacher, self.teacher_path),
+            ('student', student, self.student_dir / 'dermai_model.h5')
+        ]:
+            report = model_report.classification_metrics(model, val_gen, self.class_names)
+            latency = model_report.measure_latency(lambda x: model.predict(x, verbose=0), input_shape)
+            rows.append(model_report.summarize(name, report, latency, model_report.artifact_size_mb(path), self.class_names))
+            rows[-1]['params'] = int(model.count_params())
+            reports[name] = report
+
+        model_report.print_comparison(rows)
+
+        comparison = {
+            'teacher': rows[0],
+            'student': rows[1],
+            'recall_delta': model_report.recall_deltas(rows[0], rows[1]),
+            'speedup_p50': rows[0]['latency']['p50_ms'] / rows[1]['latency']['p50_ms'],
+            'size_ratio': rows[1]['size_mb'] / rows[0]['size_mb']
+        }
+
+        with open(self.student_dir / 'distillation_report.json', 'w') as f:
+            json.dump(comparison, f, indent=2)
+
+        return reports['student'], comparison
+
+    def run_distillation_pipeline(self):
+        print("="*50)
+        print("DermAI Knowledge Distillation Pipeline")
+        print("="*50)
+        try:
+            train_gen, val_gen = self.create_data_generators()
+            teacher = self.load_teacher()
+            student = self.build_student_model()
+            self.distill(teacher, student, train_gen, val_gen)
+
+            # Save first so the size in the report is the real artifact size
+            student.save(self.student_dir / 'dermai_model.h5')
+            report, comparison = self.compare_models(teacher, student, val_gen)
+
+            self.save_model_info(
+                student, report,
+                model_dir=self.student_dir,
+                model_name='DermAI_Student_v1.0',
+                extra_info={
+                    'distillation': {
+                        'teacher': str(self.teacher_path),
+                        'temperature': self.temperature,
+                        'alpha': self.alpha,
+                        'speedup_p50': comparison['speedup_p50'],
+                        'size_ratio': comparison['size_ratio']
+                    }
+                }
+            )
+            print("="*50)
+            print("Distillation completed successfully!")
+            print(f"Student written to {self.student_dir}")
+            print("="*50)
+        except Exception as e:
+            print(f"Error during distillation: {e}")
+            raise
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Distill the DermAI CNN into a small student model')
+    parser.add_argument('--data-dir', default=None, help='Dataset root with train/ (default: ../data)')
+    parser.add_argument('--model-dir', default=None, help='Model directory (default: backend/models)')
+    parser.add_argument('--teacher', default=None, help='Teacher .h5 (default: models/dermai_model.h5)')
+    parser.add_argument('--student-dir', default=None, help='Output directory (default: models/student)')
+    parser.add_argument('--temperature', type=float, default=4.0)
+    parser.add_argument('--alpha', type=float, default=0.1, help='Weight of the hard-label loss')
+    parser.add_argument('--epochs', type=int, default=None)
+    args = parser.parse_args()
+
+    trainer = DermAIDistillationTrainer(
+        data_dir=args.data_dir,
+        model_dir=args.model_dir,
+        teacher_path=args.teacher,
+        student_dir=args.student_dir,
+        temperature=args.temperature,
+        alpha=args.alpha
+    )
+    if args.epochs:
+        trainer.epochs = args.epochs
+    trainer.run_distillation_pipeline()
@@ -0,0 +1,211 @@
+"""
+Memory-bounded image ingestion shared by app.py and app_simple.py.
+
+- Request bodies are capped by Flask's MAX_CONTENT_LENGTH (413 before the
+  body is parsed) and upload parts larger than INGEST_SPOOL_BYTES are
+  spooled to a temporary file rather than held in memory.
+- Each upload is opened lazily: only the header is read to get the format
+  and dimensions, which are checked against the per-file and per-batch
+  limits before any pixel data is decoded.
+- Images above INGEST_MAX_DECODE_PIXELS are decoded at reduced resolution
+  where the codec supports it (JPEG DCT scaling via Image.draft), so a 12MP
+  photo never materialises at full size just to be resized to 224x224.
+  Formats without reduced decoding (PNG, BMP, GIF, ...) are decoded whole,
+  so they are held to the lower INGEST_MAX_FULL_DECODE_PIXELS.
+- Every accepted image records an estimate of the memory its ingestion
+  needs (held body bytes + decoded pixels + RGB/resize copies), reported
+  through stats().
+"""
+
+import hashlib
+import io
+import logging
+import math
+import os
+import tempfile
+import threading
+import numpy as np
+from flask import Request
+from PIL import Image
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+INGEST_MAX_REQUEST_BYTES = int(os.environ.get('DERMAI_MAX_REQUEST_BYTES', 100 * 1024 * 1024))
+INGEST_MAX_FILE_BYTES = int(os.environ.get('DERMAI_MAX_FILE_BYTES', 20 * 1024 * 1024))
+INGEST_MAX_IMAGE_PIXELS = int(os.environ.get('DERMAI_MAX_IMAGE_PIXELS', 50_000_000))
+INGEST_MAX_DECODE_PIXELS = int(os.environ.get('DERMAI_MAX_DECODE_PIXELS', 4_000_000))
+# Largest image decoded at full resolution (no reduced decode for its format): 12MP RGBA is 48MB
+INGEST_MAX_FULL_DECODE_PIXELS = int(os.environ.get('DERMAI_MAX_FULL_DECODE_PIXELS', 12_000_000))
+INGEST_MAX_BATCH_PIXELS = int(os.environ.get('DERMAI_MAX_BATCH_PIXELS', 200_000_000))
+INGEST_SPOOL_BYTES = int(os.environ.get('DERMAI_SPOOL_BYTES', 512 * 1024))
+
+# PIL's own decompression-bomb guard, as a backstop for any Image.open outside this module
+Image.MAX_IMAGE_PIXELS = INGEST_MAX_IMAGE_PIXELS
+
+
+class ImageRejected(Exception):
+    """An upload failed an ingestion limit; status is the HTTP code to answer with"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+class SpoolingRequest(Request):
+    """Flask request class whose file parts spill to disk past INGEST_SPOOL_BYTES"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=INGEST_SPOOL_BYTES)
+
+
+def configure_app(app):
+    """Install the request-size cap and spooling request class on a Flask app"""
+    app.config['MAX_CONTENT_LENGTH'] = INGEST_MAX_REQUEST_BYTES
+    app.request_class = SpoolingRequest
+
+
+def _stream_size(stream):
+    position = stream.tell()
+    stream.seek(0, io.SEEK_END)
+    size = stream.tell()
+    stream.seek(position)
+    return size
+
+
+def _in_memory_bytes(stream, size):
+    # A SpooledTemporaryFile rolls over to disk once it exceeds INGEST_SPOOL_BYTES
+    if isinstance(stream, tempfile.SpooledTemporaryFile) and size > INGEST_SPOOL_BYTES:
+        return 0
+    return size
+
+
+class BatchBudget:
+    """Pixel budget shared by all files of one request"""
+
+    def __init__(self, max_pixels=INGEST_MAX_BATCH_PIXELS):
+        self.remaining_pixels = max_pixels
+
+
+def resized_rgb(image, size):
+    """Decode, convert to RGB and resize to the model input size as a uint8 (H, W, 3) array"""
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return np.asarray(image.resize(size))
+
+
+def upload_sha256(file):
+    """Hex SHA-256 of an upload's bytes, read in chunks from its (possibly spooled) stream"""
+    digest = hashlib.sha256()
+    file.stream.seek(0)
+    for chunk in iter(lambda: file.stream.read(1 << 20), b''):
+        digest.update(chunk)
+    file.stream.seek(0)
+    return digest.hexdigest()
+
+
+class ImageIngestor:
+    def __init__(self, max_file_bytes=INGEST_MAX_FILE_BYTES, max_image_pixels=INGEST_MAX_IMAGE_PIXELS,
+                 max_decode_pixels=INGEST_MAX_DECODE_PIXELS, max_full_decode_pixels=INGEST_MAX_FULL_DECODE_PIXELS,
+                 model_size=(224, 224)):
+        self.max_file_bytes = max_file_bytes
+        self.max_image_pixels = max_image_pixels
+        self.max_decode_pixels = max_decode_pixels
+        self.max_full_decode_pixels = max_full_decode_pixels
+        self.model_size = model_size
+        self.lock = threading.Lock()
+        self.counters = {
+            'accepted': 0,
+            'rejected_bytes': 0,
+            'rejected_pixels': 0,
+            'rejected_batch_budget': 0,
+            'rejected_invalid': 0,
+            'reduced_decodes': 0
+        }
+        self.peak_bytes_max = 0
+        self.peak_bytes_total = 0
+
+    def _reject(self, counter, message, status):
+        with self.lock:
+            self.counters[counter] += 1
+        raise ImageRejected(message, status)
+
+    def open(self, file, budget=None):
+        """Open an uploaded FileStorage within the limits; returns a PIL image ready to decode"""
+        stream = file.stream
+        size = _stream_size(stream)
+        if size > self.max_file_bytes:
+            self._reject('rejected_bytes', f"Image file exceeds {self.max_file_bytes / (1024 * 1024):.0f} MB limit", 413)
+
+        try:
+            # Header only - no pixel data is decoded here
+            image = Image.open(stream)
+            width, height = image.size
+        except Image.DecompressionBombError:
+            self._reject('rejected_pixels', 'Image dimensions exceed the allowed limit', 413)
+        except Exception:
+            self._reject('rejected_invalid', 'Invalid image file', 400)
+
+        pixels = width * height
+        if pixels > self.max_image_pixels:
+            self._reject('rejected_pixels', 'Image dimensions exceed the allowed limit', 413)
+
+        if pixels > self.max_decode_pixels and image.format == 'JPEG':
+            # Decode at the first DCT scale (1/2, 1/4, 1/8) that fits the decode limit,
+            # never going below the model input size
+            denominator = 1
+            while denominator < 8 and pixels / denominator ** 2 > self.max_decode_pixels:
+                if (width // (denominator * 2) < self.model_size[0] or
+                        height // (denominator * 2) < self.model_size[1]):
+                    break
+                denominator *= 2
+            image.draft('RGB', (math.ceil(width / denominator), math.ceil(height / denominator)))
+            if image.size != (width, height):
+                with self.lock:
+                    self.counters['reduced_decodes'] += 1
+
+        decoded_width, decoded_height = image.size
+        decoded_pixels = decoded_width * decoded_height
+        if decoded_pixels > self.max_full_decode_pixels:
+            # Only reached by formats that cannot be decoded at reduced resolution
+            self._reject('rejected_pixels',
+                         f'{image.format} images are limited to {self.max_full_decode_pixels / 1e6:.0f} MP; '
+                         'upload a JPEG or a smaller image', 413)
+        if budget is not None:
+            if decoded_pixels > budget.remaining_pixels:
+                self._reject('rejected_batch_budget', 'Batch pixel budget exceeded', 413)
+            budget.remaining_pixels -= decoded_pixels
+
+        self._record(size, stream, image, decoded_pixels)
+        return image
+
+    def _record(self, size, stream, image, decoded_pixels):
+        bands = len(image.getbands())
+        # decoded frame + RGB conversion copy + resized uint8 + float64 model input
+        estimate = (
+            _in_memory_bytes(stream, size) +
+            decoded_pixels * bands +
+            (decoded_pixels * 3 if image.mode != 'RGB' else 0) +
+            self.model_size[0] * self.model_size[1] * 3 * (1 + 8)
+        )
+        with self.lock:
+            self.counters['accepted'] += 1
+            self.peak_bytes_max = max(self.peak_bytes_max, estimate)
+            self.peak_bytes_total += estimate
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats['estimated_peak_bytes_max'] = self.peak_bytes_max
+            stats['estimated_peak_bytes_mean'] = (
+                self.peak_bytes_total / self.counters['accepted'] if self.counters['accepted'] else 0
+            )
+        if resource is not None:
+            # ru_maxrss is KB on Linux
+            stats['process_max_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        return stats
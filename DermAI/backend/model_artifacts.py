@@ -0,0 +1,321 @@
+"""
+Model artifact formats understood by DermAIPredictor.
+
+- Keras .h5, written by model_trainer.py (full model incl. optimizer state).
+- SavedModel directory (<name>_savedmodel/), inference-only: the model is
+  cloned without its compile state before export, so no optimizer slots.
+- Optimized directory (<name>_optimized/): a frozen GraphDef with the
+  weights moved out into a flat, aligned weights.bin that is memory-mapped
+  at load. No Keras layers are rebuilt and no variables are initialised,
+  which is what dominates .h5 load time.
+- Compressed .npz from model_compression.py: the architecture as JSON plus
+  the weights, with clustered tensors stored as uint8 indices into a small
+  float32 codebook. np.savez_compressed deflates the zero runs left by
+  pruning, so the file is a fraction of the .h5.
+
+The SavedModel and optimized exports also return the penultimate Dense
+layer's activations ('embedding') alongside the probabilities, which
+similarity.py uses for nearest-neighbour search.
+"""
+
+import json
+import logging
+import os
+import numpy as np
+import tensorflow as tf
+
+logger = logging.getLogger(__name__)
+
+COMPRESSED_FORMAT_VERSION = 1
+
+SAVEDMODEL_SUFFIX = '_savedmodel'
+OPTIMIZED_SUFFIX = '_optimized'
+GRAPH_FILE = 'graph.pb'
+WEIGHTS_FILE = 'weights.bin'
+SIGNATURE_FILE = 'signature.json'
+MIN_EXTERNAL_WEIGHT_BYTES = 1024
+WEIGHT_ALIGNMENT = 64
+
+
+def save_compressed_model(model, path, codebooks=None):
+    """Write a model as a compressed .npz artifact.
+
+    codebooks maps a weight index (position in model.get_weights()) to an
+    (indices, centroids) pair for tensors that were weight-clustered.
+    """
+    codebooks = codebooks or {}
+    weights = model.get_weights()
+
+    arrays = {
+        'format_version': np.array(COMPRESSED_FORMAT_VERSION),
+        'architecture': np.array(model.to_json()),
+        'num_weights': np.array(len(weights))
+    }
+    for i, weight in enumerate(weights):
+        if i in codebooks:
+            indices, centroids = codebooks[i]
+            arrays[f'w{i}_idx'] = indices.astype(np.uint8)
+            arrays[f'w{i}_codebook'] = centroids.astype(np.float32)
+        else:
+            arrays[f'w{i}'] = weight
+
+    with open(path, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+
+
+def load_compressed_model(path):
+    """Rebuild a Keras model from a compressed .npz artifact"""
+    with np.load(path) as data:
+        version = int(data['format_version'])
+        if version != COMPRESSED_FORMAT_VERSION:
+            raise ValueError(f"Unsupported compressed model format version: {version}")
+
+        model = tf.keras.models.model_from_json(data['architecture'].item())
+
+        weights = []
+        for i in range(int(data['num_weights'])):
+            if f'w{i}_idx' in data:
+                weights.append(data[f'w{i}_codebook'][data[f'w{i}_idx']])
+            else:
+                weights.append(data[f'w{i}'])
+
+    model.set_weights(weights)
+    return model
+
+
+class InferenceFunctionModel:
+    """Adapts a concrete TF function to the model.predict(batch) interface DermAIPredictor uses"""
+
+    def __init__(self, fn, input_shape, embed_fn=None):
+        self.fn = fn
+        self.input_shape = input_shape
+        self.embed_fn = embed_fn
+
+    def __call__(self, x, training=False):
+        return self.fn(tf.convert_to_tensor(x, dtype=tf.float32))
+
+    def predict(self, x, verbose=0, batch_size=None):
+        return self(x).numpy()
+
+    def embed(self, x):
+        """Penultimate-layer activations; only available when the export included them"""
+        if self.embed_fn is None:
+            raise ValueError("This model artifact was exported without an embedding output")
+        return self.embed_fn(tf.convert_to_tensor(x, dtype=tf.float32)).numpy()
+
+
+def embedding_layer(model):
+    """The penultimate Dense layer of a Keras model (Dense(256) in the DermAI CNN), or None"""
+    dense = [layer for layer in model.layers if isinstance(layer, tf.keras.layers.Dense)]
+    return dense[-2] if len(dense) >= 2 else None
+
+
+def _with_embedding(model):
+    # Same forward pass, also returning the embedding layer's output; None if there is none
+    layer = embedding_layer(model)
+    if layer is None:
+        return None
+    return tf.keras.Model(model.inputs[0], [model.outputs[0], layer.output])
+
+
+def _inference_clone(model):
+    # clone_model drops the compile state, so nothing optimizer-related is exported
+    clone = tf.keras.models.clone_model(model)
+    clone.set_weights(model.get_weights())
+    return clone
+
+
+def _tf_variables(model):
+    # Keras 3 wraps tf.Variables; track the underlying ones so each weight is saved once
+    return [v if isinstance(v, tf.Variable) else v.value for v in model.weights]
+
+
+def _input_spec(model):
+    return tf.TensorSpec([None, *model.input_shape[1:]], tf.float32, name='image')
+
+
+def export_saved_model(model, path):
+    """Export an inference-only SavedModel with a single 'serving_default' signature"""
+    clone = _inference_clone(model)
+    outputs_model = _with_embedding(clone)
+
+    @tf.function(input_signature=[_input_spec(clone)])
+    def serve(image):
+        if outputs_model is None:
+            return {'probabilities': clone(image, training=False)}
+        probabilities, embedding = outputs_model(image, training=False)
+        return {'probabilities': probabilities, 'embedding': embedding}
+
+    module = tf.Module()
+    module.weights = _tf_variables(clone)
+    module.serve = serve
+    tf.saved_model.save(module, str(path), signatures={'serving_default': serve})
+
+
+def load_saved_model(path):
+    loaded = tf.saved_model.load(str(path))
+    serve = loaded.signatures['serving_default']
+    input_shape = tuple(serve.structured_input_signature[1]['image'].shape)
+
+    def fn(image):
+        return serve(image=image)['probabilities']
+
+    embed_fn = None
+    if 'embedding' in serve.structured_outputs:
+        def embed_fn(image):
+            return serve(image=image)['embedding']
+
+    model = InferenceFunctionModel(fn, input_shape, embed_fn)
+    model._loaded = loaded  # keep the restored variables alive
+    return model
+
+
+def export_optimized_model(model, path):
+    """Export the optimized artifact: a weight-free graph plus a flat, mmap-able weights file.
+
+    The model is frozen, then every large constant (kernels, biases) is cut
+    out of the GraphDef into weights.bin and replaced by a Placeholder of the
+    same name. The graph that remains is a few hundred KB to parse, and
+    because weights arrive as inputs rather than constants, TF does not spend
+    the first call constant-folding them.
+    """
+    from tensorflow.python.framework.convert_to_constants import convert_variables_to_constants_v2
+
+    clone = _inference_clone(model)
+    outputs_model = _with_embedding(clone)
+    if outputs_model is None:
+        concrete = tf.function(lambda image: [clone(image, training=False)]).get_concrete_function(_input_spec(clone))
+    else:
+        concrete = tf.function(lambda image: outputs_model(image, training=False)).get_concrete_function(_input_spec(clone))
+    frozen = convert_variables_to_constants_v2(concrete)
+    graph_def = frozen.graph.as_graph_def()
+
+    os.makedirs(path, exist_ok=True)
+    weights = []
+    offset = 0
+    with open(os.path.join(path, WEIGHTS_FILE), 'wb') as f:
+        for node in graph_def.node:
+            if node.op != 'Const' or len(node.attr['value'].tensor.tensor_content) < MIN_EXTERNAL_WEIGHT_BYTES:
+                continue
+
+            value = tf.make_ndarray(node.attr['value'].tensor)
+            dtype = node.attr['dtype']
+            node.op = 'Placeholder'
+            node.attr.clear()
+            node.attr['dtype'].CopyFrom(dtype)
+            node.attr['shape'].shape.CopyFrom(tf.TensorShape(value.shape).as_proto())
+
+            # Keep every tensor cache-line aligned inside the mapping
+            padding = (-offset) % WEIGHT_ALIGNMENT
+            f.write(b'\0' * padding)
+            offset += padding
+            f.write(np.ascontiguousarray(value).tobytes())
+            weights.append({
+                'name': node.name + ':0',
+                'dtype': value.dtype.str,
+                'shape': list(value.shape),
+                'offset': offset
+            })
+            offset += value.nbytes
+
+    with open(os.path.join(path, GRAPH_FILE), 'wb') as f:
+        f.write(graph_def.SerializeToString())
+
+    signature = {
+        'inputs': [t.name for t in frozen.inputs],
+        'outputs': [frozen.outputs[0].name],
+        'input_shape': list(clone.input_shape[1:]),
+        'weights': weights
+    }
+    if outputs_model is not None:
+        signature['embedding_output'] = frozen.outputs[1].name
+    with open(os.path.join(path, SIGNATURE_FILE), 'w') as f:
+        json.dump(signature, f, indent=2)
+
+
+def load_optimized_model(path):
+    with open(os.path.join(path, SIGNATURE_FILE), 'r') as f:
+        signature = json.load(f)
+
+    graph_def = tf.compat.v1.GraphDef()
+    with open(os.path.join(path, GRAPH_FILE), 'rb') as f:
+        graph_def.ParseFromString(f.read())
+
+    def import_graph():
+        tf.compat.v1.import_graph_def(graph_def, name='')
+
+    wrapped = tf.compat.v1.wrap_function(import_graph, [])
+    feeds = signature['inputs'] + [w['name'] for w in signature['weights']]
+    fn = wrapped.prune(
+        [wrapped.graph.get_tensor_by_name(name) for name in feeds],
+        [wrapped.graph.get_tensor_by_name(name) for name in signature['outputs']]
+    )
+    embed = None
+    if 'embedding_output' in signature:
+        embed = wrapped.prune(
+            [wrapped.graph.get_tensor_by_name(name) for name in feeds],
+            [wrapped.graph.get_tensor_by_name(signature['embedding_output'])]
+        )
+
+    # Views into a read-only mapping; each is copied into a TF tensor exactly once
+    mapped = np.memmap(os.path.join(path, WEIGHTS_FILE), dtype=np.uint8, mode='r')
+    weight_tensors = []
+    for w in signature['weights']:
+        dtype = np.dtype(w['dtype'])
+        count = int(np.prod(w['shape'])) if w['shape'] else 1
+        view = mapped[w['offset']:w['offset'] + count * dtype.itemsize].view(dtype).reshape(w['shape'])
+        weight_tensors.append(tf.constant(view))
+    del mapped
+
+    def predict_fn(image):
+        return fn(image, *weight_tensors)[0]
+
+    embed_fn = None
+    if embed is not None:
+        def embed_fn(image):
+            return embed(image, *weight_tensors)[0]
+
+    return InferenceFunctionModel(predict_fn, (None, *signature['input_shape']), embed_fn)
+
+
+def export_inference_artifacts(model, h5_path):
+    """Write the SavedModel and optimized artifacts next to an .h5 model"""
+    stem = os.path.splitext(str(h5_path))[0]
+    export_saved_model(model, stem + SAVEDMODEL_SUFFIX)
+    export_optimized_model(model, stem + OPTIMIZED_SUFFIX)
+    return stem + SAVEDMODEL_SUFFIX, stem + OPTIMIZED_SUFFIX
+
+
+def preferred_artifact(path):
+    """Return the optimized sibling of an .h5 when it exists and is not stale.
+
+    Without the .h5 an export alone is enough: the optimized artifact, or
+    else the SavedModel.
+    """
+    path = str(path)
+    if not path.endswith('.h5'):
+        return path
+
+    stem = os.path.splitext(path)[0]
+    optimized = stem + OPTIMIZED_SUFFIX
+    graph_file = os.path.join(optimized, GRAPH_FILE)
+    if os.path.exists(graph_file):
+        if not os.path.exists(path) or os.path.getmtime(graph_file) >= os.path.getmtime(path):
+            return optimized
+        logger.warning(f"Ignoring stale optimized artifact {optimized} (older than {path})")
+    saved_model = stem + SAVEDMODEL_SUFFIX
+    if not os.path.exists(path) and os.path.isdir(saved_model):
+        return saved_model
+    return path
+
+
+def load_model_artifact(path):
+    """Load any supported artifact, dispatching on its layout"""
+    path = str(path)
+    if path.endswith('.npz'):
+        return load_compressed_model(path)
+    if os.path.isdir(path):
+        if os.path.exists(os.path.join(path, GRAPH_FILE)):
+            return load_optimized_model(path)
+        return load_saved_model(path)
+    return tf.keras.models.load_model(path)
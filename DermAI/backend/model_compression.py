@@ -0,0 +1,272 @@
+"""
+Offline compression stage for DermAI models
+Magnitude-prunes the trained CNN with a short fine-tune, optionally
+weight-clusters it, and exports a compressed .npz artifact (see
+model_artifacts.py) into models/compressed/ next to a model_info.json, so it
+can be served with DermAIPredictor(model_path='models/compressed/dermai_model.npz',
+model_info_path='models/compressed/model_info.json').
+"""
+
+import os
+os.environ['CUDA_VISIBLE_DEVICES'] = '-1'
+import argparse
+import json
+import time
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.layers import Conv2D, Dense
+from tensorflow.keras.optimizers import Adam
+from pathlib import Path
+
+from model_trainer import DermAIModelTrainer
+from model_artifacts import load_model_artifact, save_compressed_model
+import model_report
+
+
+class MagnitudePruning(tf.keras.callbacks.Callback):
+    """Zeroes the smallest-magnitude kernel weights during fine-tuning.
+
+    Sparsity ramps from 0 to the target along a cubic schedule (Zhu & Gupta)
+    over the first ramp_fraction of the fine-tune; masks are recomputed every
+    `frequency` steps and re-applied after every batch so the optimizer
+    cannot revive pruned weights.
+    """
+
+    def __init__(self, layers, target_sparsity, total_steps, frequency=50, ramp_fraction=0.75):
+        super().__init__()
+        self.prune_layers = layers
+        self.target_sparsity = target_sparsity
+        self.ramp_steps = max(1, int(total_steps * ramp_fraction))
+        self.frequency = frequency
+        self.step = 0
+        self.masks = {}
+
+    def current_sparsity(self):
+        progress = min(1.0, self.step / self.ramp_steps)
+        return self.target_sparsity * (1 - (1 - progress) ** 3)
+
+    def update_masks(self, sparsity):
+        for layer in self.prune_layers:
+            kernel = layer.kernel.numpy()
+            threshold = np.percentile(np.abs(kernel), sparsity * 100)
+            self.masks[layer.name] = (np.abs(kernel) > threshold).astype(kernel.dtype)
+
+    def apply_masks(self):
+        for layer in self.prune_layers:
+            if layer.name in self.masks:
+                layer.kernel.assign(layer.kernel.numpy() * self.masks[layer.name])
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.step += 1
+        if self.step % self.frequency == 0 or self.step == self.ramp_steps:
+            self.update_masks(self.current_sparsity())
+        self.apply_masks()
+
+    def on_train_end(self, logs=None):
+        self.update_masks(self.target_sparsity)
+        self.apply_masks()
+
+
+def cluster_weights(weight, n_clusters=16, iterations=10):
+    """1-D k-means over a weight tensor.
+
+    Zeros (pruned weights) are kept exactly by reserving codebook entry 0 for
+    0.0, so clustering never undoes sparsity. Returns (indices, centroids).
+    """
+    flat = weight.ravel()
+    nonzero = flat != 0
+    values = flat[nonzero]
+    if values.size == 0:
+        # Fully pruned tensor: everything maps to the reserved zero entry
+        return np.zeros(weight.shape, dtype=np.uint8), np.array([0.0], dtype=np.float32)
+
+    # Linear initialisation over the value range, as recommended for CNNs
+    centroids = np.linspace(values.min(), values.max(), n_clusters - 1)
+    for _ in range(iterations):
+        boundaries = (centroids[1:] + centroids[:-1]) / 2
+        assignment = np.searchsorted(boundaries, values)
+        sums = np.bincount(assignment, weights=values, minlength=len(centroids))
+        counts = np.bincount(assignment, minlength=len(centroids))
+        occupied = counts > 0
+        centroids[occupied] = sums[occupied] / counts[occupied]
+        centroids = np.sort(centroids)
+
+    boundaries = (centroids[1:] + centroids[:-1]) / 2
+    indices = np.zeros(flat.shape, dtype=np.uint8)
+    indices[nonzero] = np.searchsorted(boundaries, values) + 1
+
+    codebook = np.concatenate([[0.0], centroids]).astype(np.float32)
+    return indices.reshape(weight.shape), codebook
+
+
+class DermAIModelCompressor(DermAIModelTrainer):
+    def __init__(self, data_dir=None, model_dir=None, source_path=None, output_dir=None,
+                 target_sparsity=0.8, fine_tune_epochs=2, n_clusters=None):
+        super().__init__(data_dir=data_dir, model_dir=model_dir)
+
+        self.source_path = Path(source_path) if source_path else self.model_dir / 'dermai_model.h5'
+        self.output_dir = Path(output_dir) if output_dir else self.model_dir / 'compressed'
+        self.target_sparsity = target_sparsity
+        self.fine_tune_epochs = fine_tune_epochs
+        self.n_clusters = n_clusters
+
+        os.makedirs(self.output_dir, exist_ok=True)
+
+    def prunable_layers(self, model):
+        # The classifier head is tiny and drives per-class calibration; leave it dense
+        layers = [layer for layer in model.layers if isinstance(layer, (Conv2D, Dense))]
+        return layers[:-1]
+
+    def prune(self, model, train_gen, val_gen):
+        print(f"Pruning to {self.target_sparsity:.0%} sparsity with a {self.fine_tune_epochs}-epoch fine-tune...")
+
+        model.compile(optimizer=Adam(learning_rate=1e-4), loss='categorical_crossentropy', metrics=['accuracy'])
+
+        steps_per_epoch = train_gen.samples // self.batch_size
+        validation_steps = val_gen.samples // self.batch_size
+        pruning = MagnitudePruning(
+            self.prunable_layers(model),
+            self.target_sparsity,
+            total_steps=steps_per_epoch * self.fine_tune_epochs
+        )
+
+        model.fit(
+            train_gen,
+            epochs=self.fine_tune_epochs,
+            steps_per_epoch=steps_per_epoch,
+            validation_data=val_gen,
+            validation_steps=validation_steps,
+            callbacks=[pruning],
+            verbose=1
+        )
+        return model
+
+    def cluster(self, model):
+        print(f"Clustering pruned kernels into {self.n_clusters} centroids...")
+
+        codebooks = {}
+        prunable = {id(layer.kernel) for layer in self.prunable_layers(model)}
+        weights = model.get_weights()
+        for i, variable in enumerate(model.weights):
+            if id(variable) in prunable:
+                indices, centroids = cluster_weights(weights[i], n_clusters=self.n_clusters)
+                codebooks[i] = (indices, centroids)
+                weights[i] = centroids[indices]
+
+        model.set_weights(weights)
+        return codebooks
+
+    def sparsity(self, model):
+        kernels = [layer.kernel.numpy() for layer in self.prunable_layers(model)]
+        zeros = sum(int(np.sum(k == 0)) for k in kernels)
+        total = sum(k.size for k in kernels)
+        all_weights = model.get_weights()
+        return {
+            'pruned_layers': zeros / total,
+            'overall': sum(int(np.sum(w == 0)) for w in all_weights) / sum(w.size for w in all_weights)
+        }
+
+    def measure_load_time(self, path, runs=3):
+        timings = []
+        for _ in range(runs):
+            tf.keras.backend.clear_session()
+            start = time.perf_counter()
+            load_model_artifact(path)
+            timings.append((time.perf_counter() - start) * 1000)
+        return float(np.median(timings))
+
+    def profile(self, name, model, path, val_gen):
+        report = model_report.classification_metrics(model, val_gen, self.class_names)
+        latency = model_report.measure_latency(lambda x: model.predict(x, verbose=0), (*self.img_size, 3))
+        row = model_report.summarize(name, report, latency, model_report.artifact_size_mb(path), self.class_names)
+        row['load_ms'] = self.measure_load_time(path)
+        row['sparsity'] = self.sparsity(model)
+        return row, report
+
+    def run_compression_pipeline(self):
+        print("="*50)
+        print("DermAI Model Compression Pipeline")
+        print("="*50)
+        try:
+            train_gen, val_gen = self.create_data_generators()
+
+            baseline = load_model_artifact(self.source_path)
+            baseline_row, _ = self.profile('baseline (h5)', baseline, self.source_path, val_gen)
+
+            model = self.prune(load_model_artifact(self.source_path), train_gen, val_gen)
+            output_path = self.output_dir / 'dermai_model.npz'
+            codebooks = None
+            if self.n_clusters:
+                codebooks = self.cluster(model)
+            save_compressed_model(model, output_path, codebooks=codebooks)
+
+            name = 'pruned+clustered' if self.n_clusters else 'pruned'
+            compressed_row, report = self.profile(name, model, output_path, val_gen)
+
+            rows = [baseline_row, compressed_row]
+            model_report.print_comparison(rows)
+            for row in rows:
+                print(f"{row['name']:<24} load {row['load_ms']:>9.1f} ms   sparsity {row['sparsity']['pruned_layers']:.2%}")
+
+            comparison = {
+                'baseline': baseline_row,
+                'compressed': compressed_row,
+                'recall_delta': model_report.recall_deltas(baseline_row, compressed_row),
+                'size_ratio': compressed_row['size_mb'] / baseline_row['size_mb'],
+                'load_speedup': baseline_row['load_ms'] / compressed_row['load_ms']
+            }
+            with open(self.output_dir / 'compression_report.json', 'w') as f:
+                json.dump(comparison, f, indent=2)
+
+            self.write_model_info(report, compressed_row)
+            print("="*50)
+            print("Compression completed successfully!")
+            print(f"Compressed model written to {output_path}")
+            print("="*50)
+        except Exception as e:
+            print(f"Error during compression: {e}")
+            raise
+
+    def write_model_info(self, report, row):
+        # Same fields as save_model_info, without re-saving an .h5
+        model_info = self.build_model_info(
+            report,
+            model_name='DermAI_CNN_v1.0_compressed',
+            extra_info={
+                'compression': {
+                    'source': str(self.source_path),
+                    'target_sparsity': self.target_sparsity,
+                    'sparsity': row['sparsity'],
+                    'n_clusters': self.n_clusters,
+                    'fine_tune_epochs': self.fine_tune_epochs
+                }
+            }
+        )
+        with open(self.output_dir / 'model_info.json', 'w') as f:
+            json.dump(model_info, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Prune and optionally cluster the DermAI CNN')
+    parser.add_argument('--data-dir', default=None, help='Dataset root with train/ (default: ../data)')
+    parser.add_argument('--model-dir', default=None, help='Model directory (default: backend/models)')
+    parser.add_argument('--source', default=None, help='Model to compress (default: models/dermai_model.h5)')
+    parser.add_argument('--output-dir', default=None, help='Output directory (default: models/compressed)')
+    parser.add_argument('--sparsity', type=float, default=0.8, help='Target kernel sparsity (0-1)')
+    parser.add_argument('--fine-tune-epochs', type=int, default=2)
+    parser.add_argument('--clusters', type=int, default=None, help='Weight-cluster kernels into N centroids (max 255)')
+    args = parser.parse_args()
+
+    if args.clusters is not None and not 2 <= args.clusters <= 255:
+        parser.error('--clusters must be between 2 and 255')
+
+    compressor = DermAIModelCompressor(
+        data_dir=args.data_dir,
+        model_dir=args.model_dir,
+        source_path=args.source,
+        output_dir=args.output_dir,
+        target_sparsity=args.sparsity,
+        fine_tune_epochs=args.fine_tune_epochs,
+        n_clusters=args.clusters
+    )
+    compressor.run_compression_pipeline()
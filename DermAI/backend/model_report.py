@@ -0,0 +1,95 @@
+"""
+Shared evaluation helpers for comparing DermAI model variants
+(teacher vs student, dense vs compressed, h5 vs optimized artifacts).
+Used by the offline training-side scripts; nothing here is imported by the
+Flask services.
+"""
+
+import os
+import time
+import numpy as np
+from sklearn.metrics import classification_report
+
+
+def classification_metrics(model, val_gen, class_names):
+    """Run a model over a non-shuffled generator and return the sklearn report dict"""
+    val_gen.reset()
+    predictions = model.predict(val_gen, verbose=0)
+    y_pred = np.argmax(predictions, axis=1)
+    y_true = val_gen.classes
+
+    return classification_report(
+        y_true, y_pred,
+        labels=list(range(len(class_names))),
+        target_names=class_names,
+        output_dict=True,
+        zero_division=0
+    )
+
+
+def measure_latency(predict_fn, input_shape, runs=50, warmup=5):
+    """Time single-image predictions, returning mean/p50/p95 in milliseconds"""
+    x = np.random.rand(1, *input_shape).astype('float32')
+
+    for _ in range(warmup):
+        predict_fn(x)
+
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        predict_fn(x)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    timings = np.array(timings)
+    return {
+        'mean_ms': float(timings.mean()),
+        'p50_ms': float(np.percentile(timings, 50)),
+        'p95_ms': float(np.percentile(timings, 95))
+    }
+
+
+def artifact_size_mb(path):
+    """Size of a model artifact on disk; directories (SavedModel) are summed"""
+    if os.path.isdir(path):
+        total = 0
+        for root, _, files in os.walk(path):
+            for name in files:
+                total += os.path.getsize(os.path.join(root, name))
+    else:
+        total = os.path.getsize(path)
+    return total / (1024 * 1024)
+
+
+def summarize(name, report, latency, size_mb, class_names):
+    """Flatten a report into the row format used by print_comparison"""
+    return {
+        'name': name,
+        'accuracy': float(report['accuracy']),
+        'macro_avg_recall': float(report['macro avg']['recall']),
+        'class_recall': {c: float(report[c]['recall']) for c in class_names},
+        'latency': latency,
+        'size_mb': size_mb
+    }
+
+
+def recall_deltas(baseline, candidate):
+    """Per-class recall change (candidate - baseline) between two summaries"""
+    return {
+        c: candidate['class_recall'][c] - baseline['class_recall'][c]
+        for c in baseline['class_recall']
+    }
+
+
+def print_comparison(rows, highlight='melanoma'):
+    """Print accuracy / recall / latency / size side by side"""
+    print(f"{'model':<24}{'acc':>8}{'macro_rec':>11}{highlight + '_rec':>14}{'p50_ms':>10}{'p95_ms':>10}{'size_mb':>10}")
+    for row in rows:
+        print(
+            f"{row['name']:<24}"
+            f"{row['accuracy']:>8.4f}"
+            f"{row['macro_avg_recall']:>11.4f}"
+            f"{row['class_recall'].get(highlight, 0.0):>14.4f}"
+            f"{row['latency']['p50_ms']:>10.2f}"
+            f"{row['latency']['p95_ms']:>10.2f}"
+            f"{row['size_mb']:>10.2f}"
+        )
@@ -325,7 +325,9 @@ os.environ['CUDA_VISIBLE_DEVICES'] = '-1'
 import numpy as np
 import tensorflow as tf
 from tensorflow.keras.models import Sequential
-from tensorflow.keras.layers import Conv2D, MaxPooling2D, Flatten, Dense, Dropout, BatchNormalization
+from tensorflow.keras.layers import (
+    Conv2D, MaxPooling2D, Flatten, GlobalAveragePooling2D, Dense, Dropout, BatchNormalization
+)
 from tensorflow.keras.preprocessing.image import ImageDataGenerator
 from tensorflow.keras.optimizers import Adam
 from tensorflow.keras.callbacks import EarlyStopping, ModelCheckpoint, ReduceLROnPlateau
@@ -334,6 +336,37 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 import json
 from pathlib import Path
+from model_artifacts import export_inference_artifacts
+from responses import DEFAULT_DISEASE_INFO, DEFAULT_RISK_MESSAGES
+from dataset_metadata import METADATA_FILE, load_metadata
+from balanced_sampling import BalancedSampler, lesion_id_map
+from batch_finder import AUTO_BATCH_SIZE, find_batch_size
+from async_validation import ASYNC_VALIDATION, AsyncValidation
+
+
+class RestoreBestWeights(tf.keras.callbacks.Callback):
+    """Keeps the best epoch's weights in memory and restores them when training ends.
+
+    EarlyStopping only restores when it actually stops the run, so without
+    this the pipeline had to re-load best_model.h5 from disk to evaluate it.
+    """
+
+    def __init__(self, monitor='val_accuracy'):
+        super().__init__()
+        self.monitor = monitor
+        self.best = -np.inf
+        self.best_weights = None
+
+    def on_epoch_end(self, epoch, logs=None):
+        current = (logs or {}).get(self.monitor)
+        if current is not None and current > self.best:
+            self.best = current
+            self.best_weights = self.model.get_weights()
+
+    def on_train_end(self, logs=None):
+        if self.best_weights is not None:
+            self.model.set_weights(self.best_weights)
+
 
 class DermAIModelTrainer:
     def __init__(self, data_dir=None, model_dir=None):
@@ -352,11 +385,31 @@ class DermAIModelTrainer:
         else:
             self.model_dir = Path(model_dir)
 
+        # HAM10000 metadata, read through the same columnar cache as organize_dataset.py
+        self.metadata_file = METADATA_FILE
+
         self.img_size = (224, 224)
         self.batch_size = 8
+        self.learning_rate = 0.001
         self.epochs = 20
         self.num_classes = 7
 
+        # Probe for the fastest batch size within the memory budget before training (batch_finder.py)
+        self.auto_batch_size = AUTO_BATCH_SIZE
+        self.batch_size_search = None
+
+        # Validate each epoch's checkpoint in a worker process while training continues (async_validation.py)
+        self.async_validation = ASYNC_VALIDATION
+        self.async_validation_report = None
+        # Predicted classes of the restored best epoch, reused by evaluate_model
+        self.validated_predictions = None
+
+        # Training sampler (balanced_sampling.py): 'uniform' with no budget and no grouping
+        # keeps plain flow_from_directory passes over the data
+        self.sampling = 'uniform'
+        self.samples_per_epoch = None
+        self.group_by_lesion = False
+
         # Disease classes
         self.class_names = [
             'melanoma', 'nevus', 'basal_cell_carcinoma',
@@ -367,7 +420,8 @@ class DermAIModelTrainer:
         # Create model directory if it doesn't exist
         os.makedirs(self.model_dir, exist_ok=True)
 
-    def create_data_generators(self):
+    def create_data_generators(self, target_size=None):
+        """Training/validation generators; target_size overrides img_size for the training side only"""
         print("Creating data generators...")
 
         # Training augmentation
@@ -385,21 +439,39 @@ class DermAIModelTrainer:
             validation_split=0.2
         )
 
-        val_datagen = ImageDataGenerator(
-            rescale=1./255,
-            validation_split=0.2
-        )
-
         self.train_generator = train_datagen.flow_from_directory(
             self.data_dir / 'train',
-            target_size=self.img_size,
+            target_size=target_size or self.img_size,
             batch_size=self.batch_size,
             class_mode='categorical',
             subset='training',
             shuffle=True
         )
 
-        self.validation_generator = val_datagen.flow_from_directory(
+        self.validation_generator = self.create_validation_generator()
+
+        if self.custom_sampling():
+            lesion_ids = None
+            if self.group_by_lesion and os.path.exists(self.metadata_file):
+                lesion_ids = lesion_id_map(load_metadata(self.metadata_file))
+            self.train_generator = BalancedSampler(
+                self.train_generator, weighting=self.sampling,
+                samples_per_epoch=self.samples_per_epoch, lesion_ids=lesion_ids
+            )
+
+        print(f"Training samples: {self.train_generator.samples}")
+        print(f"Validation samples: {self.validation_generator.samples}")
+        print(f"Classes found: {list(self.train_generator.class_indices.keys())}")
+
+        return self.train_generator, self.validation_generator
+
+    def create_validation_generator(self):
+        """The unaugmented, unshuffled 20% validation split of data/train at full size"""
+        val_datagen = ImageDataGenerator(
+            rescale=1./255,
+            validation_split=0.2
+        )
+        return val_datagen.flow_from_directory(
             self.data_dir / 'train',
             target_size=self.img_size,
             batch_size=self.batch_size,
@@ -408,17 +480,21 @@ class DermAIModelTrainer:
             shuffle=False
         )
 
-        print(f"Training samples: {self.train_generator.samples}")
-        print(f"Validation samples: {self.validation_generator.samples}")
-        print(f"Classes found: {list(self.train_generator.class_indices.keys())}")
+    def custom_sampling(self):
+        return self.sampling != 'uniform' or bool(self.samples_per_epoch) or self.group_by_lesion
 
-        return self.train_generator, self.validation_generator
+    def build_model(self, input_shape=None, global_pool=False):
+        """The DermAI CNN.
 
-    def build_model(self):
+        global_pool=True replaces Flatten with GlobalAveragePooling2D, so the
+        weights no longer depend on the input size; with input_shape
+        (None, None, 3) the same model then trains at any resolution.
+        """
         print("Building CNN model...")
+        input_shape = input_shape or (*self.img_size, 3)
 
         model = Sequential([
-            Conv2D(32, (3,3), activation='relu', input_shape=(*self.img_size, 3)),
+            Conv2D(32, (3,3), activation='relu', input_shape=input_shape),
             BatchNormalization(),
             Conv2D(32, (3,3), activation='relu'),
             MaxPooling2D(2,2),
@@ -442,7 +518,7 @@ class DermAIModelTrainer:
             MaxPooling2D(2,2),
             Dropout(0.25),
 
-            Flatten(),
+            GlobalAveragePooling2D() if global_pool else Flatten(),
             Dense(512, activation='relu'),
             BatchNormalization(),
             Dropout(0.5),
@@ -453,7 +529,7 @@ class DermAIModelTrainer:
         ])
 
         model.compile(
-            optimizer=Adam(learning_rate=0.001),
+            optimizer=Adam(learning_rate=self.learning_rate),
             loss='categorical_crossentropy',
             metrics=['accuracy']
         )
@@ -461,13 +537,25 @@ class DermAIModelTrainer:
         model.summary()
         return model
 
+    def tune_batch_size(self, **kwargs):
+        """Replace batch_size and learning_rate with the batch_finder search result"""
+        print("Searching for the training batch size...")
+        self.batch_size_search = find_batch_size(self, **kwargs)
+        self.batch_size = self.batch_size_search['batch_size']
+        self.learning_rate = self.batch_size_search['learning_rate']
+        print(f"Batch size {self.batch_size}, learning rate {self.learning_rate:.6g}")
+        return self.batch_size_search
+
     def train_model(self, model, train_gen, val_gen):
+        if self.async_validation:
+            return self.train_model_async(model, train_gen, val_gen)
         print("Starting model training...")
 
         callbacks = [
             EarlyStopping(monitor='val_accuracy', patience=10, restore_best_weights=True, verbose=1),
             ModelCheckpoint(os.path.join(self.model_dir, 'best_model.h5'), monitor='val_accuracy', save_best_only=True, verbose=1),
-            ReduceLROnPlateau(monitor='val_loss', factor=0.2, patience=5, min_lr=1e-7, verbose=1)
+            ReduceLROnPlateau(monitor='val_loss', factor=0.2, patience=5, min_lr=1e-7, verbose=1),
+            RestoreBestWeights(monitor='val_accuracy')
         ]
 
         steps_per_epoch = train_gen.samples // self.batch_size
@@ -485,6 +573,30 @@ class DermAIModelTrainer:
 
         return history
 
+    def train_model_async(self, model, train_gen, val_gen):
+        """train_model with each epoch validated by a separate process while the next one trains"""
+        print("Starting model training (asynchronous validation)...")
+        validator = AsyncValidation(self, os.path.join(self.model_dir, 'async_validation'), val_gen)
+
+        history = model.fit(
+            train_gen,
+            epochs=self.epochs,
+            steps_per_epoch=train_gen.samples // self.batch_size,
+            callbacks=[validator],
+            verbose=1
+        )
+        history.history.update(validator.history_metrics())
+        self.validated_predictions = validator.best_predictions
+        self.async_validation_report = validator.report()
+
+        with open(os.path.join(self.model_dir, 'async_validation_report.json'), 'w') as f:
+            json.dump(self.async_validation_report, f, indent=2)
+        report = self.async_validation_report
+        print(f"Wall time {report['train_wall_s']:.0f}s against a synchronous baseline of "
+              f"{report['sync_wall_estimate_s']:.0f}s: {report['time_saved_s']:.0f}s saved; training waited "
+              f"{report['lag_wait_s'] + report['final_wait_s']:.0f}s for the worker")
+        return history
+
     def plot_training_history(self, history):
         print("Plotting training history...")
         fig, (ax1, ax2) = plt.subplots(1,2, figsize=(12,4))
@@ -509,11 +621,13 @@ class DermAIModelTrainer:
         plt.savefig(os.path.join(self.model_dir, 'training_history.png'))
         plt.show()
 
-    def evaluate_model(self, model, val_gen):
+    def evaluate_model(self, model, val_gen, y_pred=None):
+        """Classification report and confusion matrix; y_pred skips the prediction pass when already known"""
         print("Evaluating model...")
-        val_gen.reset()
-        predictions = model.predict(val_gen, verbose=1)
-        y_pred = np.argmax(predictions, axis=1)
+        if y_pred is None:
+            val_gen.reset()
+            predictions = model.predict(val_gen, verbose=1)
+            y_pred = np.argmax(predictions, axis=1)
         y_true = val_gen.classes
 
         report = classification_report(y_true, y_pred, target_names=self.class_names, output_dict=True)
@@ -531,10 +645,15 @@ class DermAIModelTrainer:
 
         return report
 
-    def save_model_info(self, model, report):
-        print("Saving model information...")
+    def dataset_class_counts(self):
+        """Images per class in the full HAM10000 metadata, or None when the CSV is not available"""
+        if not os.path.exists(self.metadata_file):
+            return None
+        return load_metadata(self.metadata_file).class_counts()
+
+    def build_model_info(self, report, model_name='DermAI_CNN_v1.0', extra_info=None):
         model_info = {
-            'model_name': 'DermAI_CNN_v1.0',
+            'model_name': model_name,
             'input_shape': list(self.img_size) + [3],
             'num_classes': self.num_classes,
             'class_names': self.class_names,
@@ -544,13 +663,47 @@ class DermAIModelTrainer:
             'macro_avg_f1': float(report['macro avg']['f1-score']),
             'class_metrics': {class_name: {'precision': float(report[class_name]['precision']),
                                            'recall': float(report[class_name]['recall']),
-                                           'f1-score': float(report[class_name]['f1-score'])} for class_name in self.class_names}
+                                           'f1-score': float(report[class_name]['f1-score'])} for class_name in self.class_names},
+            'batch_size': self.batch_size,
+            'learning_rate': self.learning_rate,
+            # Response text served with predictions; edit here to change it without a code change
+            'risk_messages': dict(DEFAULT_RISK_MESSAGES),
+            'disease_info': {class_name: DEFAULT_DISEASE_INFO[class_name]
+                             for class_name in self.class_names if class_name in DEFAULT_DISEASE_INFO}
         }
+        class_counts = self.dataset_class_counts()
+        if class_counts is not None:
+            model_info['dataset_class_counts'] = class_counts
+        if self.custom_sampling():
+            model_info['training_sampling'] = {
+                'weighting': self.sampling,
+                'samples_per_epoch': self.samples_per_epoch,
+                'group_by_lesion': self.group_by_lesion
+            }
+        if self.batch_size_search is not None:
+            model_info['batch_size_search'] = self.batch_size_search
+        if self.async_validation_report is not None:
+            model_info['async_validation'] = {key: value for key, value in self.async_validation_report.items()
+                                              if key != 'epochs'}
+        if extra_info:
+            model_info.update(extra_info)
+        return model_info
+
+    def save_model_info(self, model, report, model_dir=None, model_name='DermAI_CNN_v1.0', extra_info=None):
+        print("Saving model information...")
+        model_dir = self.model_dir if model_dir is None else Path(model_dir)
+        os.makedirs(model_dir, exist_ok=True)
 
-        with open(os.path.join(self.model_dir, 'model_info.json'), 'w') as f:
+        model_info = self.build_model_info(report, model_name=model_name, extra_info=extra_info)
+
+        with open(os.path.join(model_dir, 'model_info.json'), 'w') as f:
             json.dump(model_info, f, indent=2)
 
-        model.save(os.path.join(self.model_dir, 'dermai_model.h5'))
+        model.save(os.path.join(model_dir, 'dermai_model.h5'))
+
+        # Inference-only exports that DermAIPredictor prefers over the .h5
+        saved_model_dir, optimized_dir = export_inference_artifacts(model, os.path.join(model_dir, 'dermai_model.h5'))
+        print(f"Exported {saved_model_dir} and {optimized_dir}")
         print("Model saved successfully!")
         print(f"Final Accuracy: {model_info['accuracy']:.4f}")
 
@@ -559,12 +712,15 @@ class DermAIModelTrainer:
         print("DermAI Model Training Pipeline")
         print("="*50)
         try:
+            if self.auto_batch_size:
+                self.tune_batch_size()
             train_gen, val_gen = self.create_data_generators()
             model = self.build_model()
             history = self.train_model(model, train_gen, val_gen)
             self.plot_training_history(history)
-            best_model = tf.keras.models.load_model(os.path.join(self.model_dir, 'best_model.h5'))
-            report = self.evaluate_model(best_model, val_gen)
+            # RestoreBestWeights already put the best epoch back; best_model.h5 stays on disk as a checkpoint
+            best_model = model
+            report = self.evaluate_model(best_model, val_gen, y_pred=self.validated_predictions)
             self.save_model_info(best_model, report)
             print("="*50)
             print("Training completed successfully!")
@@ -0,0 +1,129 @@
+"""
+Perceptual-hash cache of recent predictions (DERMAI_NEAR_DUP_CAPACITY).
+
+Patients often upload the same photo again, re-compressed or resized.
+Byte hashes differ, so without this cache every copy ran the CNN.
+- The fingerprint is a 64-bit pHash of the 224x224 model input that
+  preprocess_image already produced: grayscale, area-resized to 32x32,
+  2-D DCT, and one bit per low-frequency coefficient (the top-left 8x8)
+  set when it is above their median. Re-encoding and resizing barely
+  move these coefficients, unlike the bytes.
+- Lookup is a vectorised XOR + popcount over every cached fingerprint.
+  At a few thousand entries that takes microseconds, so no
+  multi-index structure is needed. The nearest entry within
+  DERMAI_NEAR_DUP_MAX_DISTANCE bits is a hit, and its cached
+  probabilities are used instead of running inference. Post-processing
+  still runs, so the response format and risk level are computed as
+  usual and the response carries a 'near_duplicate' block.
+- Entries are only reused for the same TTA mode. The cache holds at most
+  DERMAI_NEAR_DUP_CAPACITY fingerprints and evicts the least recently
+  used one when it is full.
+
+Tiled requests bypass the cache: their answer depends on the full-resolution
+pixels, not on the 224x224 view. On HAM10000, JPEG q50 re-encodes, halved
+resolution and +10% brightness stay within 8 bits (median 0-2), while
+distinct images are at least 16 bits apart. Crops of 5% or more move the
+global hash as far as a different image does, so they are not matched.
+"""
+
+import os
+import threading
+import time
+from datetime import datetime
+import cv2
+import numpy as np
+
+# 0 = off
+NEAR_DUP_CAPACITY = int(os.environ.get('DERMAI_NEAR_DUP_CAPACITY', 0))
+NEAR_DUP_MAX_DISTANCE = int(os.environ.get('DERMAI_NEAR_DUP_MAX_DISTANCE', 6))
+
+HASH_BITS = 64
+# Bits set in every byte value, for popcount over uint64 fingerprints viewed as bytes
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+_GRAY = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def perceptual_hash(rgb):
+    """64-bit DCT perceptual hash of an (H, W, 3) image (any value range) as np.uint64"""
+    gray = np.asarray(rgb, dtype=np.float32) @ _GRAY
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA)
+    low = cv2.dct(small)[:8, :8].flatten()
+    # The DC term only tracks overall brightness; leave it out of the median
+    bits = low > np.median(low[1:])
+    return np.frombuffer(np.packbits(bits).tobytes(), dtype='>u8')[0].astype(np.uint64)
+
+
+def hamming_distances(fingerprints, fingerprint):
+    """Bit distance from fingerprint to each of a uint64 array of fingerprints"""
+    xor = np.ascontiguousarray(fingerprints ^ np.uint64(fingerprint))
+    return _POPCOUNT[xor.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+class NearDuplicateIndex:
+    def __init__(self, capacity=NEAR_DUP_CAPACITY, max_distance=NEAR_DUP_MAX_DISTANCE):
+        if not 0 <= max_distance < HASH_BITS:
+            raise ValueError(f"Near-duplicate distance must be in [0, {HASH_BITS})")
+        self.capacity = max(1, capacity)
+        self.max_distance = max_distance
+        self.fingerprints = np.zeros(self.capacity, dtype=np.uint64)
+        # Per slot: last use (a counter, for LRU) and the cached answer
+        self.last_used = np.zeros(self.capacity, dtype=np.int64)
+        self.entries = [None] * self.capacity
+        self.size = 0
+        self.clock = 0
+        self.lock = threading.Lock()
+        self.lookup_us_total = 0.0
+        self.counters = {'lookups': 0, 'hits': 0, 'inserts': 0, 'evictions': 0}
+
+    def lookup(self, fingerprint, tta_mode):
+        """(cached probabilities, near_duplicate info) for the nearest match within max_distance, or None"""
+        start = time.perf_counter()
+        with self.lock:
+            self.counters['lookups'] += 1
+            match = None
+            if self.size:
+                distances = hamming_distances(self.fingerprints[:self.size], fingerprint)
+                # Entries cached under another TTA mode don't count
+                for slot in np.argsort(distances, kind='stable'):
+                    if distances[slot] > self.max_distance:
+                        break
+                    if self.entries[slot]['tta_mode'] == tta_mode:
+                        match = int(slot), int(distances[slot])
+                        break
+            if match is not None:
+                slot, distance = match
+                entry = self.entries[slot]
+                self.clock += 1
+                self.last_used[slot] = self.clock
+                entry['hits'] += 1
+                self.counters['hits'] += 1
+            self.lookup_us_total += (time.perf_counter() - start) * 1e6
+        if match is None:
+            return None
+        return entry['probabilities'], {'distance': distance, 'max_distance': self.max_distance,
+                                        'cached_at': entry['cached_at'], 'hits': entry['hits']}
+
+    def add(self, fingerprint, probabilities, tta_mode):
+        with self.lock:
+            if self.size < self.capacity:
+                slot = self.size
+                self.size += 1
+            else:
+                slot = int(np.argmin(self.last_used))
+                self.counters['evictions'] += 1
+            self.clock += 1
+            self.fingerprints[slot] = fingerprint
+            self.last_used[slot] = self.clock
+            self.entries[slot] = {'probabilities': np.array(probabilities, copy=True), 'tta_mode': tta_mode,
+                                  'cached_at': datetime.now().isoformat(), 'hits': 0}
+            self.counters['inserts'] += 1
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats['size'] = self.size
+            stats['lookup_us'] = self.lookup_us_total / stats['lookups'] if stats['lookups'] else None
+        stats['hit_rate'] = stats['hits'] / stats['lookups'] if stats['lookups'] else None
+        stats['capacity'] = self.capacity
+        stats['max_distance'] = self.max_distance
+        return stats
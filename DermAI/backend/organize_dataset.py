@@ -56,9 +56,9 @@
 
 
 import shutil
-import pandas as pd
 from pathlib import Path
 from sklearn.model_selection import train_test_split
+from dataset_metadata import DX_NAMES, load_metadata
 
 # Paths
 PROJECT_DIR = Path(__file__).parent
@@ -69,23 +69,15 @@ TEST_DIR = DATA_DIR / "test"
 METADATA_FILE = PROJECT_DIR / "HAM10000_metadata.csv"
 
 # Map raw dx codes -> pretty folder names
-DX_MAP = {
-    'mel': 'melanoma',
-    'nv': 'nevus',
-    'bcc': 'basal_cell_carcinoma',
-    'akiec': 'actinic_keratosis',
-    'bkl': 'benign_keratosis',
-    'df': 'dermatofibroma',
-    'vasc': 'vascular_lesion'
-}
+DX_MAP = DX_NAMES
 
 # Create train/test subfolders
 for folder in [TRAIN_DIR, TEST_DIR]:
     for pretty_name in DX_MAP.values():
         (folder / pretty_name).mkdir(parents=True, exist_ok=True)
 
-# Load metadata
-df = pd.read_csv(METADATA_FILE)
+# Load metadata (from the columnar cache; the CSV is only parsed when it changes)
+df = load_metadata(METADATA_FILE).to_dataframe()
 
 # Organize images per class
 for dx_code, pretty_name in DX_MAP.items():
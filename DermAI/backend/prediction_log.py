@@ -0,0 +1,293 @@
+"""
+Append-only prediction log in SQLite (DERMAI_PREDICTION_LOG).
+
+Off unless DERMAI_PREDICTION_LOG names a database file (e.g.
+predictions.db); it is created on first start.
+
+Every successful prediction is recorded with its full probability vector
+(float32 BLOB), predicted class, confidence, risk level, model version,
+the SHA-256 of the uploaded bytes, the request ID, the inference options
+used (TTA views, tile mode, cascade stage) and the preprocess, inference
+and postprocess timings. With the log, drift analysis can query past
+answers instead of re-scoring uploads/.
+
+- Writes are off the request path. predict() hands a row to a bounded
+  queue, and a single writer thread inserts up to
+  DERMAI_PREDICTION_LOG_BATCH rows per transaction, at least every
+  DERMAI_PREDICTION_LOG_FLUSH_MS. A full queue drops the row and counts
+  it; the request is never blocked. Rows still queued when the process
+  dies are lost.
+- The database runs in WAL mode, so summary queries read a consistent
+  snapshot while the writer keeps appending. Rows are indexed by time,
+  by (class, time) and by input hash.
+- Probabilities are stored in the class order recorded in the log's meta
+  table on creation. Opening the log with a different class order fails
+  rather than mixing layouts.
+
+Queries (PredictionLog.summary / lookup) back the token-guarded
+GET /admin/predictions and GET /admin/predictions/<input_hash> endpoints.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime
+import numpy as np
+from flask import jsonify, request
+
+from profiling import ADMIN_TOKEN, admin_required
+
+logger = logging.getLogger(__name__)
+
+PREDICTION_LOG = os.environ.get('DERMAI_PREDICTION_LOG', '')
+PREDICTION_LOG_BATCH = int(os.environ.get('DERMAI_PREDICTION_LOG_BATCH', 256))
+PREDICTION_LOG_FLUSH_MS = float(os.environ.get('DERMAI_PREDICTION_LOG_FLUSH_MS', 1000))
+PREDICTION_LOG_QUEUE = int(os.environ.get('DERMAI_PREDICTION_LOG_QUEUE', 10000))
+LOOKUP_LIMIT = 100
+
+COLUMNS = ('ts', 'endpoint', 'request_id', 'input_hash', 'model_version', 'predicted', 'confidence',
+           'risk_level', 'probabilities', 'tta_views', 'tile_mode', 'cascade_stage',
+           'preprocess_ms', 'inference_ms', 'postprocess_ms')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS predictions (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    endpoint TEXT,
+    request_id TEXT,
+    input_hash TEXT,
+    model_version TEXT,
+    predicted TEXT NOT NULL,
+    confidence REAL NOT NULL,
+    risk_level TEXT,
+    probabilities BLOB NOT NULL,
+    tta_views INTEGER,
+    tile_mode TEXT,
+    cascade_stage TEXT,
+    preprocess_ms REAL,
+    inference_ms REAL,
+    postprocess_ms REAL
+);
+CREATE INDEX IF NOT EXISTS idx_predictions_ts ON predictions (ts);
+CREATE INDEX IF NOT EXISTS idx_predictions_class_ts ON predictions (predicted, ts);
+CREATE INDEX IF NOT EXISTS idx_predictions_input_hash ON predictions (input_hash);
+"""
+
+# summary(group_by=...) keys -> SQL expressions
+GROUP_BY = {
+    'class': 'predicted',
+    'risk_level': 'risk_level',
+    'model_version': 'model_version',
+    'endpoint': 'endpoint',
+    'cascade_stage': 'cascade_stage',
+    'hour': "strftime('%Y-%m-%dT%H:00', ts, 'unixepoch')",
+    'day': "strftime('%Y-%m-%d', ts, 'unixepoch')"
+}
+FILTERS = {'class': 'predicted', 'risk_level': 'risk_level', 'model_version': 'model_version', 'endpoint': 'endpoint'}
+
+
+class _MeanVector:
+    """SQLite aggregate: element-wise mean of float32 BLOBs, returned as a JSON list"""
+
+    def __init__(self):
+        self.total = None
+        self.count = 0
+
+    def step(self, blob):
+        vector = np.frombuffer(blob, dtype=np.float32)
+        self.total = vector.astype(np.float64) if self.total is None else self.total + vector
+        self.count += 1
+
+    def finalize(self):
+        return json.dumps((self.total / self.count).tolist()) if self.count else None
+
+
+class PredictionLog:
+    def __init__(self, path, class_names, batch_size=PREDICTION_LOG_BATCH, flush_ms=PREDICTION_LOG_FLUSH_MS,
+                 max_pending=PREDICTION_LOG_QUEUE):
+        self.path = path
+        self.class_names = list(class_names)
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_ms / 1000
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.lock = threading.Lock()
+        self.counters = {'logged': 0, 'dropped_queue_full': 0, 'batches': 0, 'write_errors': 0}
+        self.write_ms_total = 0.0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with contextlib.closing(self._connect()) as conn, conn:
+            conn.executescript(SCHEMA)
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('class_names', ?)",
+                         (json.dumps(self.class_names),))
+            stored = json.loads(conn.execute("SELECT value FROM meta WHERE key = 'class_names'").fetchone()[0])
+        if stored != self.class_names:
+            raise ValueError(f"Prediction log {path} was created for classes {stored}, not {self.class_names}")
+
+        threading.Thread(target=self._writer, name='prediction-log-writer', daemon=True).start()
+
+    def _connect(self, readonly=False):
+        if readonly:
+            conn = sqlite3.connect(f'file:{os.path.abspath(self.path)}?mode=ro', uri=True)
+            conn.create_aggregate('mean_vector', 1, _MeanVector)
+            return conn
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        # WAL + NORMAL: a crash can lose the last transactions but never corrupts the file
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def submit(self, probabilities, predicted, confidence, risk_level, model_version, context=None,
+               timings=None, tta_views=1, tile_mode='off', cascade_stage=None):
+        """Queue one prediction for the writer; never blocks"""
+        context = context or {}
+        timings = timings or {}
+        row = (
+            time.time(), context.get('endpoint'), context.get('request_id'), context.get('input_hash'),
+            model_version, predicted, float(confidence), risk_level,
+            np.asarray(probabilities, dtype=np.float32).tobytes(), tta_views, tile_mode, cascade_stage,
+            timings.get('preprocess'), timings.get('inference'), timings.get('postprocess')
+        )
+        try:
+            self.pending.put_nowait(row)
+        except queue.Full:
+            with self.lock:
+                self.counters['dropped_queue_full'] += 1
+
+    def _writer(self):
+        conn = self._connect()
+        insert = f"INSERT INTO predictions ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})"
+        while True:
+            rows = [self.pending.get()]
+            # Gather whatever arrives until the batch is full or the flush interval is up
+            deadline = time.monotonic() + self.flush_interval
+            while len(rows) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    rows.append(self.pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            start = time.perf_counter()
+            try:
+                with conn:
+                    conn.executemany(insert, rows)
+            except sqlite3.Error as e:
+                logger.error(f"Prediction log write failed: {str(e)}")
+                with self.lock:
+                    self.counters['write_errors'] += 1
+                continue
+            with self.lock:
+                self.counters['logged'] += len(rows)
+                self.counters['batches'] += 1
+                self.write_ms_total += (time.perf_counter() - start) * 1000
+
+    def summary(self, since=None, until=None, group_by=('class',), filters=None, probabilities=False):
+        """Aggregates over [since, until) (unix seconds), grouped by keys of GROUP_BY; raises ValueError"""
+        unknown = [key for key in group_by if key not in GROUP_BY] + [key for key in (filters or {}) if key not in FILTERS]
+        if unknown:
+            raise ValueError(f"Unknown summary keys: {', '.join(unknown)}")
+
+        where, params = [], []
+        if since is not None:
+            where.append('ts >= ?')
+            params.append(since)
+        if until is not None:
+            where.append('ts < ?')
+            params.append(until)
+        for key, value in (filters or {}).items():
+            where.append(f'{FILTERS[key]} = ?')
+            params.append(value)
+
+        keys = [GROUP_BY[key] for key in group_by]
+        select = keys + ['COUNT(*)', 'AVG(confidence)', 'AVG(inference_ms)', 'MIN(ts)', 'MAX(ts)']
+        if probabilities:
+            select.append('mean_vector(probabilities)')
+        sql = f"SELECT {', '.join(select)} FROM predictions"
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        if keys:
+            sql += f" GROUP BY {', '.join(keys)} ORDER BY {', '.join(keys)}"
+
+        with contextlib.closing(self._connect(readonly=True)) as conn:
+            rows = conn.execute(sql, params).fetchall()
+
+        groups = []
+        for row in rows:
+            if not row[len(keys)]:
+                continue  # no matching rows at all
+            group = dict(zip(group_by, row))
+            count, mean_confidence, mean_inference_ms, first, last = row[len(keys):len(keys) + 5]
+            group.update({'count': count, 'mean_confidence': mean_confidence, 'mean_inference_ms': mean_inference_ms,
+                          'first_ts': first, 'last_ts': last})
+            if probabilities:
+                group['mean_probabilities'] = dict(zip(self.class_names, json.loads(row[-1])))
+            groups.append(group)
+        return groups
+
+    def lookup(self, input_hash, limit=LOOKUP_LIMIT):
+        """Every logged prediction for one input hash, newest first"""
+        with contextlib.closing(self._connect(readonly=True)) as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM predictions WHERE input_hash = ? ORDER BY ts DESC LIMIT ?",
+                (input_hash, limit)
+            ).fetchall()
+        records = []
+        for row in rows:
+            record = dict(row)
+            record['probabilities'] = dict(zip(self.class_names,
+                                               np.frombuffer(record['probabilities'], dtype=np.float32).tolist()))
+            records.append(record)
+        return records
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats['mean_batch_write_ms'] = self.write_ms_total / stats['batches'] if stats['batches'] else None
+        stats['pending'] = self.pending.qsize()
+        stats['path'] = os.path.abspath(self.path)
+        return stats
+
+
+def _parse_time(value):
+    """Unix seconds or an ISO-8601 timestamp (naive = local time); raises ValueError"""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def configure_prediction_log(app, log):
+    """The /admin/predictions query endpoints, when the log is enabled and DERMAI_ADMIN_TOKEN is set"""
+    if log is None or not ADMIN_TOKEN:
+        return
+
+    def prediction_summary():
+        args = request.args
+        try:
+            group_by = [key for key in args.get('group_by', 'class').split(',') if key]
+            filters = {key: args[key] for key in FILTERS if key in args}
+            groups = log.summary(since=_parse_time(args.get('since')), until=_parse_time(args.get('until')),
+                                 group_by=group_by, filters=filters,
+                                 probabilities=args.get('probabilities', '0').lower() in ('1', 'true', 'yes'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({'groups': groups, 'group_by': group_by, 'filters': filters})
+
+    def prediction_lookup(input_hash):
+        records = log.lookup(input_hash.lower())
+        return jsonify({'input_hash': input_hash, 'predictions': records, 'count': len(records)})
+
+    app.add_url_rule('/admin/predictions', view_func=admin_required(prediction_summary))
+    app.add_url_rule('/admin/predictions/<input_hash>', view_func=admin_required(prediction_lookup))
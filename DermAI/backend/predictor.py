@@ -0,0 +1,346 @@
+"""
+DermAIPredictor: model loading, preprocessing, inference (TTA, tiling,
+cascade and near-duplicate paths) and post-processing for one model.
+
+app.py builds its replicas from this class and serves them over HTTP.
+Offline tools (bulk_score.py) construct it directly, so importing it
+starts no web app, queue workers or background threads.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+import numpy as np
+from model_artifacts import load_model_artifact, preferred_artifact
+from ingestion import resized_rgb
+from tracing import span
+from tiling import TILE_MODE, TILE_MODES, Tiler, aggregate
+from near_duplicate import perceptual_hash
+from similarity import embedding_function, model_version
+from responses import RESPONSE_FORMAT, RESPONSE_FORMATS, RESPONSE_TOP_K, ResponseTemplates
+
+logger = logging.getLogger(__name__)
+
+# Test-time augmentation: 'off', 'always', or 'auto' (only when the top-1
+# confidence falls inside the uncertainty band)
+TTA_MODES = ('off', 'auto', 'always')
+TTA_MODE = os.environ.get('DERMAI_TTA_MODE', 'off')
+TTA_UNCERTAINTY_BAND = (
+    float(os.environ.get('DERMAI_TTA_BAND_LOW', 0.5)),
+    float(os.environ.get('DERMAI_TTA_BAND_HIGH', 0.85))
+)
+# In 'always' mode, every Nth request scores the original view on its own to
+# keep the single-pass reference (and so the reported TTA overhead) current
+TTA_REFERENCE_INTERVAL = int(os.environ.get('DERMAI_TTA_REFERENCE_INTERVAL', 50))
+
+
+class DermAIPredictor:
+    def __init__(self, model_path='models/dermai_model.h5', model_info_path='models/model_info.json',
+                 tta_mode=TTA_MODE, tta_band=TTA_UNCERTAINTY_BAND,
+                 response_format=RESPONSE_FORMAT, response_top_k=RESPONSE_TOP_K, tile_mode=TILE_MODE):
+        self.model_path = model_path
+        self.model_info_path = model_info_path
+        self.model = None
+        self.model_info = None
+        self.img_size = (224, 224)
+        self.tta_mode = tta_mode
+        self.tta_band = tta_band
+        self.response_format = response_format
+        self.response_top_k = response_top_k
+        self.tile_mode = tile_mode
+        self.tiler = Tiler(tile_size=self.img_size)
+        self.templates = None
+        self.embedder = None
+        self._model_version = None
+        # Optional ShadowScorer that also gets a sample of predictions for a candidate model
+        self.shadow = None
+        # Optional CascadeGate: a cheap first-stage model that answers confident low-risk cases
+        self.cascade = None
+        # Optional NearDuplicateIndex: cached answers for re-uploads of a recent image
+        self.near_duplicates = None
+        # Optional PredictionLog that records every answer with its probabilities and timings
+        self.prediction_log = None
+        # Running average of a plain single-view forward pass, used to report TTA overhead
+        self.single_pass_ms = None
+        self.always_tta_requests = 0
+        self.single_pass_lock = threading.Lock()
+        
+        # Load model and info
+        self.load_model()
+        self.load_model_info()
+        self.templates = ResponseTemplates.from_model_info(self.model_info)
+    
+    def load_model(self):
+        """Load the trained model"""
+        try:
+            # Prefer the optimized export next to the .h5, which then need not be deployed;
+            # .npz comes from model_compression.py
+            artifact_path = preferred_artifact(self.model_path)
+            if os.path.exists(artifact_path):
+                self.model = load_model_artifact(artifact_path)
+                logger.info(f"Model loaded successfully from {artifact_path}")
+            else:
+                logger.error(f"Model file not found: {self.model_path}")
+                raise FileNotFoundError(f"Model file not found: {self.model_path}")
+        except Exception as e:
+            logger.error(f"Error loading model: {str(e)}")
+            raise
+    
+    def load_model_info(self):
+        """Load model information"""
+        try:
+            if os.path.exists(self.model_info_path):
+                with open(self.model_info_path, 'r') as f:
+                    self.model_info = json.load(f)
+                logger.info("Model info loaded successfully")
+            else:
+                logger.warning("Model info file not found, using defaults")
+                self.model_info = {
+                    'class_names': [
+                        'melanoma', 'nevus', 'basal_cell_carcinoma', 
+                        'actinic_keratosis', 'benign_keratosis', 
+                        'dermatofibroma', 'vascular_lesion'
+                    ]
+                }
+        except Exception as e:
+            logger.error(f"Error loading model info: {str(e)}")
+            self.model_info = {
+                'class_names': [
+                    'melanoma', 'nevus', 'basal_cell_carcinoma', 
+                    'actinic_keratosis', 'benign_keratosis', 
+                    'dermatofibroma', 'vascular_lesion'
+                ]
+            }
+    
+    def preprocess_image(self, image):
+        """Preprocess image for prediction"""
+        try:
+            # Convert to RGB, resize, then normalize
+            image_array = resized_rgb(image, self.img_size) / 255.0
+            
+            # Add batch dimension
+            image_array = np.expand_dims(image_array, axis=0)
+            
+            return image_array
+        except Exception as e:
+            logger.error(f"Error preprocessing image: {str(e)}")
+            raise
+    
+    def tta_views(self, processed_image):
+        """The 8 flips/90° rotations of a (1, H, W, C) image, stacked as one (8, H, W, C) batch"""
+        image = processed_image[0]
+        rotations = [np.rot90(image, k, axes=(0, 1)) for k in range(4)]
+        return np.stack(rotations + [np.flip(view, axis=1) for view in rotations])
+
+    def timed_predict(self, batch):
+        start = time.perf_counter()
+        predictions = self.model.predict(batch)
+        return predictions, (time.perf_counter() - start) * 1000
+
+    def record_single_pass(self, elapsed_ms):
+        """Fold one plain forward pass into the single-pass moving average; replica workers share it"""
+        with self.single_pass_lock:
+            if self.single_pass_ms is None:
+                self.single_pass_ms = elapsed_ms
+            else:
+                self.single_pass_ms = 0.9 * self.single_pass_ms + 0.1 * elapsed_ms
+
+    def predict_probabilities(self, processed_image, tta_mode):
+        """Class probabilities for one preprocessed image, plus TTA details (or None when off)"""
+        if tta_mode == 'always':
+            views = self.tta_views(processed_image)
+            with self.single_pass_lock:
+                refresh = self.single_pass_ms is None or self.always_tta_requests % max(1, TTA_REFERENCE_INTERVAL) == 0
+                self.always_tta_requests += 1
+            if refresh:
+                # View 0 (the original image) alone, then the other 7: same answer, plus a reference timing
+                first, single_ms = self.timed_predict(views[:1])
+                self.record_single_pass(single_ms)
+                extra, extra_ms = self.timed_predict(views[1:])
+                predictions, elapsed_ms = np.concatenate([first, extra]), single_ms + extra_ms
+            else:
+                # All views in one forward pass
+                predictions, elapsed_ms = self.timed_predict(views)
+            probabilities = predictions.mean(axis=0)
+            with self.single_pass_lock:
+                overhead_ms = elapsed_ms - self.single_pass_ms
+            return probabilities, {'mode': tta_mode, 'applied': True, 'views': len(predictions),
+                                   'inference_ms': elapsed_ms, 'overhead_ms': overhead_ms}
+
+        predictions, elapsed_ms = self.timed_predict(processed_image)
+        probabilities = predictions[0]
+        self.record_single_pass(elapsed_ms)
+
+        if tta_mode != 'auto':
+            return probabilities, None
+
+        low, high = self.tta_band
+        if not low <= probabilities.max() <= high:
+            return probabilities, {'mode': tta_mode, 'applied': False, 'views': 1,
+                                   'inference_ms': elapsed_ms, 'overhead_ms': 0.0}
+
+        # Borderline: score the 7 remaining views in one batch and average with the original
+        extra, extra_ms = self.timed_predict(self.tta_views(processed_image)[1:])
+        probabilities = (probabilities + extra.sum(axis=0)) / (len(extra) + 1)
+        return probabilities, {'mode': tta_mode, 'applied': True, 'views': len(extra) + 1,
+                               'inference_ms': elapsed_ms + extra_ms, 'overhead_ms': extra_ms}
+
+    def cascaded_probabilities(self, processed_image, tta_mode):
+        """predict_probabilities, answered by the cascade's first stage when it is confident and low-risk"""
+        if self.cascade is None:
+            return (*self.predict_probabilities(processed_image, tta_mode), None)
+
+        start = time.perf_counter()
+        probabilities, escalation = self.cascade.first_stage(processed_image)
+        tta_info = None
+        if escalation is not None:
+            probabilities, tta_info = self.predict_probabilities(processed_image, tta_mode)
+        self.cascade.record(escalation, (time.perf_counter() - start) * 1000)
+        return probabilities, tta_info, {'stage': 'first' if escalation is None else 'full', 'escalation': escalation}
+
+    def deduplicated_probabilities(self, processed_image, tta_mode):
+        """cascaded_probabilities, or the cached answer for a perceptual near-duplicate of a recent upload"""
+        if self.near_duplicates is None:
+            return (*self.cascaded_probabilities(processed_image, tta_mode), None)
+
+        fingerprint = perceptual_hash(processed_image[0])
+        match = self.near_duplicates.lookup(fingerprint, tta_mode)
+        if match is not None:
+            probabilities, duplicate_info = match
+            return probabilities, None, None, duplicate_info
+        probabilities, tta_info, cascade_info = self.cascaded_probabilities(processed_image, tta_mode)
+        self.near_duplicates.add(fingerprint, probabilities, tta_mode)
+        return probabilities, tta_info, cascade_info, None
+
+    @property
+    def model_version(self):
+        """Content hash of the model file; similarity indexes are built per version"""
+        if self._model_version is None:
+            self._model_version = model_version(self.model_path)
+        return self._model_version
+
+    def embed(self, image):
+        """Penultimate Dense(256) activations for one image, as a float32 vector"""
+        if self.embedder is None:
+            self.embedder = embedding_function(self.model, fallback_path=self.model_path)
+        return self.embedder(self.preprocess_image(image))[0]
+
+    def tiled_probabilities(self, image, tile_mode, timings=None):
+        """Class probabilities aggregated over lesion-centred multi-scale tiles, scored as one batch"""
+        with span('preprocess', timings):
+            tiles, tile_info = self.tiler.tiles(image)
+        with span('inference', timings):
+            predictions, elapsed_ms = self.timed_predict(tiles)
+        probabilities, tile = aggregate(predictions, tile_mode, list(self.templates.class_names))
+        tile_info.update({'aggregation': tile_mode, 'inference_ms': elapsed_ms})
+        if tile is not None:
+            tile_info['max_risk_tile'] = tile
+        return probabilities, tile_info
+
+    def predict(self, image, tta_mode=None, response_format=None, tile_mode=None, log_context=None):
+        """Make prediction on image; log_context (endpoint, input_hash, request_id) goes to the prediction log"""
+        try:
+            tta_mode = self.tta_mode if tta_mode is None else tta_mode
+            if tta_mode not in TTA_MODES:
+                raise ValueError(f"Invalid TTA mode: {tta_mode}")
+            response_format = self.response_format if response_format is None else response_format
+            if response_format not in RESPONSE_FORMATS:
+                raise ValueError(f"Invalid response format: {response_format}")
+            tile_mode = self.tile_mode if tile_mode is None else tile_mode
+            if tile_mode not in TILE_MODES:
+                raise ValueError(f"Invalid tile mode: {tile_mode}")
+
+            processed_image = tta_info = cascade_info = tile_info = duplicate_info = None
+            timings = {} if self.prediction_log is not None else None
+            if tile_mode != 'off':
+                # Tiles replace the single squashed view (and with it TTA and the cascade)
+                probabilities, tile_info = self.tiled_probabilities(image, tile_mode, timings)
+            else:
+                # Preprocess image (the upload's pixels are decoded here)
+                with span('preprocess', timings):
+                    processed_image = self.preprocess_image(image)
+                
+                # Make prediction
+                with span('inference', timings):
+                    probabilities, tta_info, cascade_info, duplicate_info = self.deduplicated_probabilities(
+                        processed_image, tta_mode
+                    )
+            if tta_info is not None and tta_info['applied']:
+                logger.info(f"TTA applied over {tta_info['views']} views, overhead {tta_info['overhead_ms']} ms")
+            
+            with span('postprocess', timings):
+                # Order classes by confidence in the requested response format
+                (disease, confidence), results = self.templates.predictions(
+                    probabilities, response_format, self.response_top_k
+                )
+            
+                # Determine risk level based on confidence and disease type
+                risk_level = self.determine_risk_level(disease, confidence)
+            
+                result = {
+                    'success': True,
+                    'prediction': {
+                        'disease': disease,
+                        'confidence': confidence,
+                        'percentage': confidence * 100,
+                        'risk_level': risk_level
+                    },
+                    'all_predictions': results,
+                    'recommendation': self.get_recommendation(disease, risk_level),
+                    'timestamp': datetime.now().isoformat()
+                }
+                if tta_info is not None:
+                    result['tta'] = tta_info
+                if cascade_info is not None:
+                    result['cascade'] = cascade_info
+                if tile_info is not None:
+                    result['tiling'] = tile_info
+                if duplicate_info is not None:
+                    result['near_duplicate'] = duplicate_info
+            if self.shadow is not None and duplicate_info is None and processed_image is not None:
+                self.shadow.submit(processed_image, probabilities, risk_level,
+                                   tta_applied=tta_info is not None and tta_info['applied'],
+                                   cascade_stage=cascade_info['stage'] if cascade_info is not None else None)
+            if self.prediction_log is not None:
+                self.prediction_log.submit(
+                    probabilities, disease, confidence, risk_level, self.model_version,
+                    context=log_context, timings=timings,
+                    tta_views=tta_info['views'] if tta_info is not None and tta_info['applied'] else 1,
+                    tile_mode=tile_mode,
+                    cascade_stage=cascade_info['stage'] if cascade_info is not None else None
+                )
+            return result
+            
+        except Exception as e:
+            logger.error(f"Error during prediction: {str(e)}")
+            return {
+                'success': False,
+                'error': str(e),
+                'timestamp': datetime.now().isoformat()
+            }
+    
+    def determine_risk_level(self, disease, confidence):
+        """Determine risk level based on disease and confidence"""
+        high_risk_diseases = ['melanoma', 'basal_cell_carcinoma']
+        
+        if disease in high_risk_diseases:
+            if confidence > 0.8:
+                return 'HIGH'
+            elif confidence > 0.6:
+                return 'MODERATE'
+            else:
+                return 'LOW'
+        else:
+            if confidence > 0.9:
+                return 'MODERATE'
+            elif confidence > 0.7:
+                return 'LOW'
+            else:
+                return 'VERY_LOW'
+    
+    def get_recommendation(self, disease, risk_level):
+        """Get recommendation based on prediction (precomputed, shared - do not mutate)"""
+        return self.templates.recommendation(disease, risk_level)
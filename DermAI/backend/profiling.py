@@ -0,0 +1,226 @@
+"""
+On-demand profiling for the inference path, switchable at runtime.
+
+- Sampled request traces: a configurable fraction of requests records
+  per-stage timings (ingest, queue, preprocess, inference, postprocess,
+  serialize, ...) under a request ID. The ID is the caller's X-Request-ID
+  or a generated one, and it is echoed back in the X-Request-ID response
+  header. Finished traces are logged and kept in a bounded in-memory
+  buffer. When a request is not sampled, each span costs one contextvar
+  lookup.
+- TensorFlow profiler capture for N seconds into DERMAI_PROFILE_DIR,
+  viewable in TensorBoard's profile tab.
+- Python stack samples of every serving thread.
+
+The admin endpoints under /admin/ exist only when DERMAI_ADMIN_TOKEN is
+set, and every call must carry it in the X-Admin-Token header. The trace
+and span primitives live in tracing.py, which does not import Flask, so
+the inference queue can record spans outside the web layer.
+"""
+
+import hmac
+import logging
+import math
+import os
+import random
+import sys
+import threading
+import time
+import traceback
+import uuid
+from collections import Counter, deque
+from datetime import datetime
+from flask import g, jsonify, request
+
+from tracing import RequestTrace, current_trace
+
+logger = logging.getLogger(__name__)
+
+ADMIN_TOKEN = os.environ.get('DERMAI_ADMIN_TOKEN', '')
+TRACE_SAMPLE_RATE = float(os.environ.get('DERMAI_TRACE_SAMPLE_RATE', 0.0))
+TRACE_BUFFER_SIZE = int(os.environ.get('DERMAI_TRACE_BUFFER', 200))
+PROFILE_DIR = os.environ.get('DERMAI_PROFILE_DIR', 'profiles')
+MAX_PROFILE_SECONDS = 120
+MAX_STACK_SAMPLES = 200
+MAX_STACK_INTERVAL_MS = 1000
+
+class Profiler:
+    def __init__(self, sample_rate=TRACE_SAMPLE_RATE, buffer_size=TRACE_BUFFER_SIZE, profile_dir=PROFILE_DIR):
+        self.sample_rate = sample_rate
+        self.traces = deque(maxlen=buffer_size)
+        self.profile_dir = profile_dir
+        self.tf_profile_lock = threading.Lock()
+        self.tf_profile = None
+
+    # Request hooks
+
+    def before_request(self):
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return
+        request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+        trace = RequestTrace(request_id, request.method, request.path)
+        g.trace_token = current_trace.set(trace)
+        g.trace = trace
+
+    def after_request(self, response):
+        trace = g.pop('trace', None)
+        if trace is None:
+            # Echo a caller-supplied ID even when the request is not traced
+            if 'X-Request-ID' in request.headers:
+                response.headers['X-Request-ID'] = request.headers['X-Request-ID']
+            return response
+
+        current_trace.reset(g.pop('trace_token'))
+        record = trace.finish(response.status_code)
+        self.traces.append(record)
+        stages = ', '.join(f"{s['name']}={s['duration_ms']:.1f}" for s in record['spans'])
+        logger.info(f"trace {record['request_id']} {record['method']} {record['path']} "
+                    f"{record['status']} {record['total_ms']:.1f} ms [{stages}]")
+        response.headers['X-Request-ID'] = trace.request_id
+        return response
+
+    # TensorFlow profiler
+
+    def start_tf_profile(self, seconds):
+        """Capture a TF profiler trace for `seconds` in the background; returns its log directory"""
+        import tensorflow as tf
+
+        with self.tf_profile_lock:
+            if self.tf_profile is not None:
+                raise RuntimeError(f"A TF profile is already being captured to {self.tf_profile['logdir']}")
+            logdir = os.path.join(self.profile_dir, datetime.now().strftime('%Y%m%d_%H%M%S'))
+            os.makedirs(logdir, exist_ok=True)
+            tf.profiler.experimental.start(logdir)
+            self.tf_profile = {'logdir': logdir, 'seconds': seconds, 'started': datetime.now().isoformat()}
+
+        def stop():
+            time.sleep(seconds)
+            with self.tf_profile_lock:
+                try:
+                    tf.profiler.experimental.stop()
+                    logger.info(f"TF profile written to {logdir}")
+                except Exception as e:
+                    logger.error(f"Error stopping TF profiler: {str(e)}")
+                self.tf_profile = None
+
+        threading.Thread(target=stop, name='tf-profile', daemon=True).start()
+        return logdir
+
+    # Python stacks
+
+    @staticmethod
+    def stack_samples(samples=1, interval_ms=10):
+        """Sample the stack of every thread; identical stacks are counted together"""
+        names = {}
+        counts = {}
+        own = threading.get_ident()
+        for i in range(samples):
+            names.update({t.ident: t.name for t in threading.enumerate()})
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = tuple(
+                    f"{entry.filename}:{entry.lineno} {entry.name}" for entry in traceback.extract_stack(frame)
+                )
+                counts.setdefault(ident, Counter())[stack] += 1
+            if i + 1 < samples:
+                time.sleep(interval_ms / 1000)
+
+        return [
+            {
+                'thread': names.get(ident, str(ident)),
+                'ident': ident,
+                'stacks': [{'count': count, 'frames': list(stack)} for stack, count in stacks.most_common()]
+            }
+            for ident, stacks in counts.items()
+        ]
+
+    def state(self):
+        return {
+            'trace_sample_rate': self.sample_rate,
+            'traces_buffered': len(self.traces),
+            'trace_buffer_size': self.traces.maxlen,
+            'tf_profile': self.tf_profile
+        }
+
+
+def _authorized():
+    token = request.headers.get('X-Admin-Token', '')
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token, ADMIN_TOKEN)
+
+
+def admin_required(view):
+    """Answer 403 unless the request carries DERMAI_ADMIN_TOKEN in X-Admin-Token"""
+    def wrapped(**kwargs):
+        if not _authorized():
+            return jsonify({'error': 'Forbidden'}), 403
+        return view(**kwargs)
+    wrapped.__name__ = view.__name__
+    return wrapped
+
+
+def configure_profiling(app, profiler=None):
+    """Install the trace hooks and, when DERMAI_ADMIN_TOKEN is set, the /admin/ endpoints"""
+    profiler = profiler or Profiler()
+    app.before_request(profiler.before_request)
+    app.after_request(profiler.after_request)
+
+    if not ADMIN_TOKEN:
+        return profiler
+
+    def profiling_state():
+        if request.method == 'POST':
+            body = request.get_json(silent=True) or {}
+            if 'trace_sample_rate' in body:
+                try:
+                    rate = float(body['trace_sample_rate'])
+                except (TypeError, ValueError):
+                    return jsonify({'error': 'trace_sample_rate must be a number'}), 400
+                if not 0.0 <= rate <= 1.0:
+                    return jsonify({'error': 'trace_sample_rate must be between 0 and 1'}), 400
+                profiler.sample_rate = rate
+                logger.info(f"Request trace sample rate set to {rate}")
+            if body.get('clear_traces'):
+                profiler.traces.clear()
+        return jsonify(profiler.state())
+
+    def traces():
+        request_id = request.args.get('request_id')
+        records = [t for t in list(profiler.traces) if request_id is None or t['request_id'] == request_id]
+        return jsonify({'traces': records, 'count': len(records)})
+
+    def tf_profile():
+        body = request.get_json(silent=True) or {}
+        try:
+            seconds = float(body.get('seconds', request.args.get('seconds', 10)))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'seconds must be a number'}), 400
+        if not 0 < seconds <= MAX_PROFILE_SECONDS:
+            return jsonify({'error': f"seconds must be between 0 and {MAX_PROFILE_SECONDS}"}), 400
+        try:
+            logdir = profiler.start_tf_profile(seconds)
+        except RuntimeError as e:
+            return jsonify({'error': str(e)}), 409
+        return jsonify({'logdir': os.path.abspath(logdir), 'seconds': seconds}), 202
+
+    def stacks():
+        try:
+            samples = min(max(int(request.args.get('samples', 1)), 1), MAX_STACK_SAMPLES)
+            interval_ms = float(request.args.get('interval_ms', 10))
+        except ValueError:
+            return jsonify({'error': 'samples and interval_ms must be numbers'}), 400
+        if not math.isfinite(interval_ms):
+            return jsonify({'error': 'interval_ms must be a finite number'}), 400
+        interval_ms = min(max(interval_ms, 0.0), MAX_STACK_INTERVAL_MS)
+        return jsonify({
+            'samples': samples,
+            'interval_ms': interval_ms,
+            'threads': profiler.stack_samples(samples, interval_ms),
+            'timestamp': datetime.now().isoformat()
+        })
+
+    app.add_url_rule('/admin/profiling', view_func=admin_required(profiling_state), methods=['GET', 'POST'])
+    app.add_url_rule('/admin/traces', view_func=admin_required(traces))
+    app.add_url_rule('/admin/tf-profile', view_func=admin_required(tf_profile), methods=['POST'])
+    app.add_url_rule('/admin/stacks', view_func=admin_required(stacks))
+    return profiler
@@ -0,0 +1,228 @@
+"""
+Progressive-resizing training for DermAI.
+
+Early epochs train at a low resolution and later ones step up to the
+serving resolution (224px). A schedule such as "112:4,160:4,224:12"
+means 4 epochs at 112px, 4 at 160px and 12 at 224px. Convolution cost
+scales with pixel count, so a 112px epoch costs about a quarter of a
+224px one, and coarse features are what the model learns first anyway.
+
+The CNN is built with a global-average-pooling head and an
+(H, W)-agnostic input (DermAIModelTrainer.build_model(global_pool=True)),
+so the same weights train at every size. Validation always runs at
+224px, so val_accuracy is comparable across stages and runs. The final
+weights are copied into a fixed 224x224 build for the usual
+dermai_model.h5 + inference exports.
+
+--compare also trains the same architecture at a fixed 224px for the
+same number of epochs, then reports the wall-clock time each run took to
+first reach --target val_accuracy (progressive_resizing_report.json).
+"""
+
+import os
+os.environ['CUDA_VISIBLE_DEVICES'] = '-1'
+import argparse
+import json
+import time
+import tensorflow as tf
+from tensorflow.keras.callbacks import EarlyStopping, ModelCheckpoint, ReduceLROnPlateau
+
+from model_trainer import DermAIModelTrainer
+
+
+def parse_schedule(spec):
+    """'112:4,160:4,224:12' -> [(112, 4), (160, 4), (224, 12)]"""
+    stages = []
+    for part in spec.split(','):
+        size, epochs = part.split(':')
+        stages.append((int(size), int(epochs)))
+    if not stages or any(size < 32 or epochs < 1 for size, epochs in stages):
+        raise ValueError(f"Invalid schedule: {spec}")
+    return stages
+
+
+class _AcrossStages:
+    """Keep a callback's state between the stages' fit() calls.
+
+    Keras resets EarlyStopping's and ReduceLROnPlateau's wait counters and
+    best score in on_train_begin, so patience would restart at every stage
+    (and early stopping could never fire in stages shorter than its
+    patience). Only the first fit() of a run initialises them here.
+    """
+
+    def on_train_begin(self, logs=None):
+        if getattr(self, '_started', False):
+            return
+        self._started = True
+        super().on_train_begin(logs)
+
+
+class StagedEarlyStopping(_AcrossStages, EarlyStopping):
+    pass
+
+
+class StagedReduceLROnPlateau(_AcrossStages, ReduceLROnPlateau):
+    pass
+
+
+class TimeToTarget(tf.keras.callbacks.Callback):
+    """Records per-epoch wall time and when the monitored metric first reaches the target.
+
+    One instance is shared by every stage's fit() call, so times are measured from `start`
+    across the whole schedule. It also keeps the best weights, restored once at the end.
+    """
+
+    def __init__(self, target, start, monitor='val_accuracy'):
+        super().__init__()
+        self.target = target
+        self.start = start
+        self.monitor = monitor
+        self.epochs = []
+        self.reached = None
+        self.best = -float('inf')
+        self.best_weights = None
+        self.size = None
+
+    def on_epoch_end(self, epoch, logs=None):
+        logs = logs or {}
+        elapsed = time.perf_counter() - self.start
+        current = logs.get(self.monitor)
+        self.epochs.append({
+            'epoch': epoch + 1,
+            'size': self.size,
+            'elapsed_s': elapsed,
+            self.monitor: float(current) if current is not None else None
+        })
+        if current is None:
+            return
+        if current > self.best:
+            self.best = float(current)
+            self.best_weights = self.model.get_weights()
+        if self.reached is None and current >= self.target:
+            self.reached = {'epoch': epoch + 1, 'elapsed_s': elapsed}
+            print(f"\n{self.monitor} reached {self.target} at epoch {epoch + 1} after {elapsed:.0f}s")
+
+
+class DermAIProgressiveTrainer(DermAIModelTrainer):
+    def __init__(self, data_dir=None, model_dir=None, schedule='112:4,160:4,224:12', target=0.7):
+        super().__init__(data_dir=data_dir, model_dir=model_dir)
+        self.schedule = parse_schedule(schedule) if isinstance(schedule, str) else list(schedule)
+        self.target = target
+        if self.schedule[-1][0] != self.img_size[0]:
+            print(f"Warning: the schedule ends at {self.schedule[-1][0]}px, the model is served at {self.img_size[0]}px")
+
+    def train_schedule(self, schedule, label, run_name):
+        """Train a fresh variable-input model through the (size, epochs) stages.
+
+        The best checkpoint goes to best_model_<run_name>.h5, so the runs of --compare don't overwrite
+        each other.
+        """
+        print("=" * 50)
+        print(f"{label}: " + ', '.join(f"{epochs} epochs at {size}px" for size, epochs in schedule))
+        print("=" * 50)
+        tf.keras.utils.set_random_seed(42)
+        model = self.build_model(input_shape=(None, None, 3), global_pool=True)
+
+        start = time.perf_counter()
+        tracker = TimeToTarget(self.target, start)
+        # Shared by every stage: patience, plateau counters and the checkpoint's best score
+        # carry over between fit() calls
+        callbacks = [
+            StagedEarlyStopping(monitor='val_accuracy', patience=10, verbose=1),
+            ModelCheckpoint(os.path.join(self.model_dir, f'best_model_{run_name}.h5'), monitor='val_accuracy',
+                            save_best_only=True, verbose=1),
+            StagedReduceLROnPlateau(monitor='val_loss', factor=0.2, patience=5, min_lr=1e-7, verbose=1),
+            tracker
+        ]
+        epoch = 0
+        val_gen = None
+        for size, epochs in schedule:
+            train_gen, val_gen = self.create_data_generators(target_size=(size, size))
+            tracker.size = size
+            history = model.fit(
+                train_gen,
+                initial_epoch=epoch,
+                epochs=epoch + epochs,
+                steps_per_epoch=train_gen.samples // self.batch_size,
+                validation_data=val_gen,
+                validation_steps=val_gen.samples // self.batch_size,
+                callbacks=callbacks,
+                verbose=1
+            )
+            epoch += len(history.history.get('loss', []))
+            if model.stop_training:
+                print("Early stopping ended the schedule")
+                break
+
+        if tracker.best_weights is not None:
+            model.set_weights(tracker.best_weights)
+        result = {
+            'schedule': [{'size': size, 'epochs': epochs} for size, epochs in schedule],
+            'total_s': time.perf_counter() - start,
+            'best_val_accuracy': tracker.best,
+            'target_val_accuracy': self.target,
+            'time_to_target_s': tracker.reached['elapsed_s'] if tracker.reached else None,
+            'epochs_to_target': tracker.reached['epoch'] if tracker.reached else None,
+            'epochs': tracker.epochs
+        }
+        return model, val_gen, result
+
+    def fixed_size_model(self, model):
+        """Copy variable-input weights into a 224x224 build (the GAP head makes them size-independent)"""
+        fixed = self.build_model(global_pool=True)
+        fixed.set_weights(model.get_weights())
+        return fixed
+
+    def run_progressive_pipeline(self, compare=False):
+        runs = {}
+        if compare:
+            baseline_epochs = sum(epochs for _, epochs in self.schedule)
+            _, _, runs['fixed'] = self.train_schedule([(self.img_size[0], baseline_epochs)], 'Fixed-size baseline',
+                                                  'fixed')
+        model, val_gen, runs['progressive'] = self.train_schedule(self.schedule, 'Progressive resizing', 'progressive')
+
+        model = self.fixed_size_model(model)
+        report = self.evaluate_model(model, val_gen)
+        self.save_model_info(model, report, extra_info={
+            'training_schedule': runs['progressive']['schedule'],
+            'architecture_head': 'global_average_pooling'
+        })
+
+        comparison = {'target_val_accuracy': self.target, 'runs': runs}
+        if compare and runs['fixed']['time_to_target_s'] and runs['progressive']['time_to_target_s']:
+            comparison['speedup_to_target'] = runs['fixed']['time_to_target_s'] / runs['progressive']['time_to_target_s']
+
+        print(f"\n{'run':<14}{'total_s':>10}{'to_target_s':>13}{'epochs':>8}{'best_val_acc':>14}")
+        for name, run in runs.items():
+            to_target = f"{run['time_to_target_s']:.0f}" if run['time_to_target_s'] else 'not reached'
+            print(f"{name:<14}{run['total_s']:>10.0f}{to_target:>13}{run['epochs_to_target'] or '-':>8}"
+                  f"{run['best_val_accuracy']:>14.4f}")
+        if 'speedup_to_target' in comparison:
+            print(f"Progressive resizing reached {self.target} val_accuracy "
+                  f"{comparison['speedup_to_target']:.2f}x faster")
+
+        with open(os.path.join(self.model_dir, 'progressive_resizing_report.json'), 'w') as f:
+            json.dump(comparison, f, indent=2)
+        return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train the DermAI CNN with progressive resizing')
+    parser.add_argument('--data-dir', default=None, help='Dataset root with train/ (default: ../data)')
+    parser.add_argument('--model-dir', default=None, help='Model directory (default: backend/models)')
+    parser.add_argument('--schedule', default='112:4,160:4,224:12', help='size:epochs stages, e.g. 112:4,160:4,224:12')
+    parser.add_argument('--target', type=float, default=0.7, help='val_accuracy for the time-to-target report')
+    parser.add_argument('--batch-size', type=int, default=None)
+    parser.add_argument('--compare', action='store_true',
+                        help='Also train a fixed 224px baseline for the same epochs and compare time to target')
+    args = parser.parse_args()
+
+    trainer = DermAIProgressiveTrainer(data_dir=args.data_dir, model_dir=args.model_dir,
+                                       schedule=args.schedule, target=args.target)
+    if args.batch_size:
+        trainer.batch_size = args.batch_size
+    trainer.run_progressive_pipeline(compare=args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""
+CPU thread topology and model replicas for the inference service.
+
+- TF intra-op / inter-op pool sizes (DERMAI_INTRA_OP_THREADS,
+  DERMAI_INTER_OP_THREADS). They must be set before TensorFlow runs its
+  first op, so app.py applies them before the model is loaded. 0 keeps
+  TensorFlow's default (one thread per core for each pool), which on a
+  large node oversubscribes the CPU as soon as more than one request runs.
+- DERMAI_MODEL_REPLICAS copies of the model in one process. Each replica
+  has its own weights, its own admission queue and worker thread(s).
+- DERMAI_REPLICA_CPUS pins each replica's worker threads to a core set
+  (Linux sched_setaffinity): 'auto' splits the available cores evenly,
+  or give explicit sets such as "0-7;8-15". TF's op pools are shared by
+  the whole process, so pinning applies to the replica threads that
+  drive the model; size the intra-op pool to about one replica's core
+  set when using it.
+- Requests are routed across replicas round-robin or to the least-loaded
+  replica (queued + running cost), DERMAI_REPLICA_ROUTING.
+
+ReplicaPool has the same check_admission/run/stats surface as
+InferenceQueue, except that run() passes the chosen replica to fn.
+"""
+
+import itertools
+import logging
+import math
+import os
+import threading
+from admission import InferenceQueue
+
+logger = logging.getLogger(__name__)
+
+INTRA_OP_THREADS = int(os.environ.get('DERMAI_INTRA_OP_THREADS', 0))
+INTER_OP_THREADS = int(os.environ.get('DERMAI_INTER_OP_THREADS', 0))
+MODEL_REPLICAS = int(os.environ.get('DERMAI_MODEL_REPLICAS', 1))
+REPLICA_ROUTING = os.environ.get('DERMAI_REPLICA_ROUTING', 'least_loaded')
+REPLICA_CPUS = os.environ.get('DERMAI_REPLICA_CPUS', '')
+
+ROUTING_POLICIES = ('round_robin', 'least_loaded')
+
+
+def configure_tf_threads(intra_op=INTRA_OP_THREADS, inter_op=INTER_OP_THREADS):
+    """Size TensorFlow's thread pools; must run before the first TF op (0 = TF default)"""
+    import tensorflow as tf
+
+    try:
+        if intra_op:
+            tf.config.threading.set_intra_op_parallelism_threads(intra_op)
+        if inter_op:
+            tf.config.threading.set_inter_op_parallelism_threads(inter_op)
+    except RuntimeError as e:
+        logger.warning(f"TF thread pools already initialised, keeping defaults: {str(e)}")
+        return False
+    return True
+
+
+def available_cpus():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def parse_cpu_sets(spec, replicas):
+    """Core sets per replica from 'auto', '' (no pinning) or '0-7;8-15' style lists"""
+    spec = (spec or '').strip()
+    if not spec:
+        return None
+    if spec == 'auto':
+        cpus = available_cpus()
+        if replicas > len(cpus):
+            # More replicas than cores: replicas share cores round-robin
+            return [{cpus[i % len(cpus)]} for i in range(replicas)]
+        per_replica = len(cpus) // replicas
+        return [set(cpus[i * per_replica:(i + 1) * per_replica]) for i in range(replicas)]
+
+    cpu_sets = []
+    for group in spec.split(';'):
+        cpus = set()
+        for part in group.split(','):
+            part = part.strip()
+            if '-' in part:
+                first, last = part.split('-')
+                cpus.update(range(int(first), int(last) + 1))
+            elif part:
+                cpus.add(int(part))
+        cpu_sets.append(cpus)
+    if len(cpu_sets) != replicas:
+        raise ValueError(f"DERMAI_REPLICA_CPUS lists {len(cpu_sets)} core sets for {replicas} replicas")
+    return cpu_sets
+
+
+def pin_current_thread(cpus):
+    """Restrict the calling thread to cpus (Linux only; a no-op elsewhere)"""
+    if not hasattr(os, 'sched_setaffinity'):
+        logger.warning("CPU affinity is not supported on this platform, replica not pinned")
+        return
+    # pid 0 is the calling thread on Linux
+    os.sched_setaffinity(0, cpus)
+
+
+class ReplicaPool:
+    def __init__(self, replicas, routing=REPLICA_ROUTING, cpu_sets=None, max_depth=16, workers_per_replica=1):
+        if routing not in ROUTING_POLICIES:
+            raise ValueError(f"Invalid routing policy: {routing}")
+        self.replicas = list(replicas)
+        self.routing = routing
+        self.cpu_sets = cpu_sets
+        self.round_robin = itertools.count()
+        self.lock = threading.Lock()
+        self.routed = [0] * len(self.replicas)
+
+        # The overall depth limit is shared out across replicas
+        depth = max(1, math.ceil(max_depth / len(self.replicas)))
+        self.queues = []
+        for i in range(len(self.replicas)):
+            initializer = None
+            if cpu_sets:
+                initializer = (lambda cpus: lambda: pin_current_thread(cpus))(cpu_sets[i])
+            self.queues.append(InferenceQueue(
+                max_depth=depth, workers=workers_per_replica, name=f'replica-{i}', initializer=initializer
+            ))
+
+    def _choose(self):
+        if len(self.queues) == 1:
+            return 0
+        if self.routing == 'round_robin':
+            return next(self.round_robin) % len(self.queues)
+        loads = [q.load() for q in self.queues]
+        return loads.index(min(loads))
+
+    def load(self):
+        """Cost queued or running across all replicas"""
+        return sum(q.load() for q in self.queues)
+
+    def check_admission(self, deadline, cost=1):
+        """Reject if no replica could take the job in time (checks the least-loaded one)"""
+        loads = [q.load() for q in self.queues]
+        self.queues[loads.index(min(loads))].check_admission(deadline, cost)
+
+    def run(self, fn, deadline, cost=1):
+        """Run fn(replica) on a replica picked by the routing policy"""
+        index = self._choose()
+        with self.lock:
+            self.routed[index] += 1
+        replica = self.replicas[index]
+        return self.queues[index].run(lambda: fn(replica), deadline, cost)
+
+    def stats(self):
+        per_replica = [q.stats() for q in self.queues]
+        totals = {}
+        for stats in per_replica:
+            for key, value in stats.items():
+                if isinstance(value, (int, float)) and key != 'service_ms_per_image':
+                    totals[key] = totals.get(key, 0) + value
+        service = [s['service_ms_per_image'] for s in per_replica if s['service_ms_per_image'] is not None]
+        totals['service_ms_per_image'] = sum(service) / len(service) if service else None
+        totals['routing'] = self.routing
+        totals['replicas'] = [
+            dict(stats, routed=self.routed[i], cpus=sorted(self.cpu_sets[i]) if self.cpu_sets else None)
+            for i, stats in enumerate(per_replica)
+        ]
+        return totals
+
@@ -0,0 +1,155 @@
+"""
+Response layer shared by app.py and app_simple.py.
+
+- Recommendation and disease-info text is read once (from model_info.json
+  when it carries 'risk_messages' / 'disease_info', otherwise the defaults
+  below) into read-only tables, and the recommendation block for every
+  (disease, risk level) pair is built up front. A request only looks one up.
+- Per-class predictions are ordered with a single numpy argsort and can be
+  returned in three formats:
+    full    - every class as {'disease', 'confidence', 'percentage'} (default)
+    topk    - the same, truncated to the top RESPONSE_TOP_K classes
+    arrays  - parallel 'classes' / 'confidences' lists, most likely first
+- jsonify encodes with orjson when it is installed.
+"""
+
+import os
+from types import MappingProxyType
+import numpy as np
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+RESPONSE_FORMATS = ('full', 'topk', 'arrays')
+RESPONSE_FORMAT = os.environ.get('DERMAI_RESPONSE_FORMAT', 'full')
+RESPONSE_TOP_K = int(os.environ.get('DERMAI_RESPONSE_TOP_K', 3))
+# Indented JSON through Flask's default encoder, independent of debug mode
+JSON_PRETTY = os.environ.get('DERMAI_JSON_PRETTY', '0') == '1'
+
+DEFAULT_RISK_MESSAGES = MappingProxyType({
+    'HIGH': "⚠️ HIGH RISK: Please consult a dermatologist immediately. This condition requires urgent medical attention.",
+    'MODERATE': "⚡ MODERATE RISK: Schedule an appointment with a dermatologist within a week for proper evaluation.",
+    'LOW': "✅ LOW RISK: Monitor the condition and consult a doctor if symptoms worsen or persist.",
+    'VERY_LOW': "✅ VERY LOW RISK: Continue regular skin monitoring. Consult a doctor if you notice any changes."
+})
+
+DEFAULT_DISEASE_INFO = MappingProxyType({
+    'melanoma': "A serious form of skin cancer that can spread to other parts of the body.",
+    'nevus': "A common type of mole that is usually benign.",
+    'basal_cell_carcinoma': "The most common type of skin cancer, usually slow-growing.",
+    'actinic_keratosis': "Rough, scaly patches that may develop into skin cancer if left untreated.",
+    'benign_keratosis': "Non-cancerous skin growths that are usually harmless.",
+    'dermatofibroma': "A benign skin nodule that typically doesn't require treatment.",
+    'vascular_lesion': "Blood vessel abnormalities that are usually benign."
+})
+
+UNKNOWN_DISEASE_INFO = "Please consult a healthcare professional for proper diagnosis."
+GENERAL_ADVICE = "This AI prediction is for informational purposes only and should not replace professional medical advice."
+
+
+class ResponseTemplates:
+    """Read-only response tables for one model's class list"""
+
+    def __init__(self, class_names, risk_messages=DEFAULT_RISK_MESSAGES, disease_info=DEFAULT_DISEASE_INFO):
+        self.class_names = tuple(class_names)
+        self.risk_messages = MappingProxyType(dict(risk_messages))
+        self.disease_info = MappingProxyType(dict(disease_info))
+
+        # One shared dict per (disease, risk level); responses reference it, so it must not be mutated
+        self.recommendations = MappingProxyType({
+            (disease, risk_level): self._build_recommendation(disease, risk_level)
+            for disease in self.class_names for risk_level in self.risk_messages
+        })
+
+    @classmethod
+    def from_model_info(cls, model_info):
+        return cls(
+            model_info['class_names'],
+            risk_messages=model_info.get('risk_messages', DEFAULT_RISK_MESSAGES),
+            disease_info=model_info.get('disease_info', DEFAULT_DISEASE_INFO)
+        )
+
+    def _build_recommendation(self, disease, risk_level):
+        return {
+            'risk_message': self.risk_messages.get(risk_level, self.risk_messages['LOW']),
+            'disease_info': self.disease_info.get(disease, UNKNOWN_DISEASE_INFO),
+            'general_advice': GENERAL_ADVICE
+        }
+
+    def recommendation(self, disease, risk_level):
+        recommendation = self.recommendations.get((disease, risk_level))
+        if recommendation is None:
+            recommendation = self._build_recommendation(disease, risk_level)
+        return recommendation
+
+    def predictions(self, probabilities, response_format='full', top_k=RESPONSE_TOP_K):
+        """Order class probabilities (most likely first) in the requested format.
+
+        Returns (top, predictions): top is the (disease, confidence) pair
+        of the most likely class.
+        """
+        probabilities = np.asarray(probabilities, dtype=np.float64)
+        order = np.argsort(-probabilities, kind='stable')
+        if response_format == 'topk':
+            order = order[:top_k]
+
+        names = [self.class_names[i] for i in order]
+        confidences = probabilities[order].tolist()
+        top = (names[0], confidences[0])
+
+        if response_format == 'arrays':
+            return top, {'classes': names, 'confidences': confidences}
+        return top, [
+            {'disease': name, 'confidence': confidence, 'percentage': confidence * 100}
+            for name, confidence in zip(names, confidences)
+        ]
+
+
+def validate_response_format(value):
+    """Normalise a 'response' form/query value; None means the server default"""
+    if not value:
+        return None
+    value = value.lower()
+    if value == 'compact':
+        return 'topk'
+    if value not in RESPONSE_FORMATS:
+        raise ValueError(f"Invalid response format. Use one of: {', '.join(RESPONSE_FORMATS)}")
+    return value
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """jsonify through orjson when available, otherwise Flask's default encoder.
+
+    Keys stay sorted as before; datetimes, dataclasses and other non-native
+    types still go through the default provider's conversion. Non-ASCII
+    text is written as UTF-8 rather than \\u escapes. Indented output
+    (compact = False, set from DERMAI_JSON_PRETTY) uses the default encoder;
+    debug mode does not change the encoder.
+    """
+
+    options = (
+        orjson.OPT_SORT_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS |
+        orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+    ) if orjson is not None else 0
+
+    def _orjson_dumps(self, obj):
+        return orjson.dumps(obj, default=self.default, option=self.options)
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return self._orjson_dumps(obj).decode('utf-8')
+
+    def response(self, *args, **kwargs):
+        if orjson is None or self.compact is False:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._orjson_dumps(obj) + b'\n', mimetype=self.mimetype)
+
+
+def configure_json(app):
+    app.json = FastJSONProvider(app)
+    app.json.compact = not JSON_PRETTY
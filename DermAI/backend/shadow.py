@@ -0,0 +1,164 @@
+"""
+Shadow inference for a candidate model (DERMAI_SHADOW_MODEL).
+
+A sampled fraction of primary predictions is handed to a separate,
+bounded queue with its own worker thread. That worker scores the same
+preprocessed input with the candidate model and records how the
+candidate would have answered. This happens after the primary result
+exists and off the response path, so requests never wait for the
+candidate.
+
+- Shadow work is best-effort. It is skipped when the queue is full, and
+  it is skipped or abandoned whenever the primary pool's load (queued +
+  running images) is above DERMAI_SHADOW_MAX_PRIMARY_LOAD. The load
+  leaves out the submitting job while it is still running, so a
+  /batch-predict request does not count against itself. The check runs
+  both at submission and again just before the candidate runs, so a
+  traffic burst stops shadow scoring within one job.
+- Agreement stats: top-1 agreement, risk-level flips (as primary ->
+  candidate counts) and a primary x candidate class confusion matrix,
+  plus mean absolute probability difference and candidate latency,
+  served under 'shadow' in GET /stats.
+
+The comparison is like for like: the candidate scores the same views as
+the primary's full model (all 8 TTA views when TTA was applied, else the
+single view). Predictions answered by the cascade's first stage came
+from a different model, so they are not compared (skipped_cascade).
+"""
+
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import numpy as np
+from admission import current_job
+
+logger = logging.getLogger(__name__)
+
+SHADOW_MODEL = os.environ.get('DERMAI_SHADOW_MODEL', '')
+SHADOW_MODEL_INFO = os.environ.get('DERMAI_SHADOW_MODEL_INFO', '')
+SHADOW_SAMPLE_RATE = float(os.environ.get('DERMAI_SHADOW_SAMPLE_RATE', 0.1))
+SHADOW_QUEUE_DEPTH = int(os.environ.get('DERMAI_SHADOW_QUEUE_DEPTH', 8))
+# 0 = the replica count: shadow only while no primary request is waiting
+SHADOW_MAX_PRIMARY_LOAD = int(os.environ.get('DERMAI_SHADOW_MAX_PRIMARY_LOAD', 0))
+
+
+class ShadowScorer:
+    def __init__(self, candidate, class_names, primary_load, sample_rate=SHADOW_SAMPLE_RATE,
+                 max_depth=SHADOW_QUEUE_DEPTH, max_primary_load=1):
+        """candidate: a DermAIPredictor for the candidate model.
+
+        primary_load() returns the primary pool's queued + running cost.
+        """
+        self.candidate = candidate
+        self.class_names = list(class_names)
+        self.primary_load = primary_load
+        self.sample_rate = sample_rate
+        self.max_primary_load = max_primary_load
+        self.jobs = queue.Queue(maxsize=max_depth)
+        self.lock = threading.Lock()
+        n = len(self.class_names)
+        self.confusion = np.zeros((n, n), dtype=np.int64)
+        self.risk_flips = {}
+        self.abs_diff_total = 0.0
+        self.latency_ms_total = 0.0
+        self.counters = {
+            'submitted': 0,
+            'scored': 0,
+            'failed': 0,
+            'dropped_load': 0,
+            'dropped_queue_full': 0,
+            'skipped_cascade': 0,
+            'top1_agree': 0,
+            'risk_level_flips': 0
+        }
+
+        threading.Thread(target=self._worker, name='shadow-worker', daemon=True).start()
+
+    def _count(self, key):
+        with self.lock:
+            self.counters[key] += 1
+
+    def _overloaded(self, job):
+        """Primary load above the limit, not counting job (the submitter) while it still runs"""
+        load = self.primary_load()
+        if job is not None and not job.done.is_set():
+            load -= job.cost
+        return load > self.max_primary_load
+
+    def submit(self, processed_image, probabilities, risk_level, tta_applied=False, cascade_stage=None):
+        """Offer one primary prediction for shadow scoring; never blocks.
+
+        tta_applied: the primary averaged the 8 TTA views. cascade_stage
+        'first' means the cascade's first-stage model answered.
+        """
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return
+        if cascade_stage == 'first':
+            self._count('skipped_cascade')
+            return
+        job = current_job.get()
+        if self._overloaded(job):
+            self._count('dropped_load')
+            return
+        tta_mode = 'always' if tta_applied else 'off'
+        try:
+            self.jobs.put_nowait((processed_image, np.asarray(probabilities), risk_level, tta_mode, job))
+        except queue.Full:
+            self._count('dropped_queue_full')
+            return
+        self._count('submitted')
+
+    def _worker(self):
+        while True:
+            processed_image, primary, primary_risk, tta_mode, job = self.jobs.get()
+            # Primary traffic may have built up while this job waited
+            if self._overloaded(job):
+                self._count('dropped_load')
+                continue
+            try:
+                start = time.perf_counter()
+                candidate, _ = self.candidate.predict_probabilities(processed_image, tta_mode)
+                elapsed_ms = (time.perf_counter() - start) * 1000
+            except Exception as e:
+                logger.error(f"Shadow model failed: {str(e)}")
+                self._count('failed')
+                continue
+            self._record(primary, primary_risk, np.asarray(candidate), elapsed_ms)
+
+    def _record(self, primary, primary_risk, candidate, elapsed_ms):
+        p, c = int(np.argmax(primary)), int(np.argmax(candidate))
+        candidate_risk = self.candidate.determine_risk_level(self.class_names[c], float(candidate[c]))
+        with self.lock:
+            self.counters['scored'] += 1
+            self.confusion[p, c] += 1
+            if p == c:
+                self.counters['top1_agree'] += 1
+            if candidate_risk != primary_risk:
+                self.counters['risk_level_flips'] += 1
+                flip = f'{primary_risk}->{candidate_risk}'
+                self.risk_flips[flip] = self.risk_flips.get(flip, 0) + 1
+            self.abs_diff_total += float(np.abs(primary - candidate).mean())
+            self.latency_ms_total += elapsed_ms
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            scored = stats['scored']
+            stats['sample_rate'] = self.sample_rate
+            stats['queue_depth'] = self.jobs.qsize()
+            stats['model_path'] = self.candidate.model_path
+            stats['model_version'] = self.candidate.model_version
+            stats['top1_agreement'] = stats['top1_agree'] / scored if scored else None
+            stats['risk_level_flip_rate'] = stats['risk_level_flips'] / scored if scored else None
+            stats['risk_flips'] = dict(self.risk_flips)
+            stats['mean_abs_probability_diff'] = self.abs_diff_total / scored if scored else None
+            stats['candidate_ms'] = self.latency_ms_total / scored if scored else None
+            # confusion[primary][candidate], non-zero cells only
+            stats['confusion'] = {
+                primary: {self.class_names[j]: int(n) for j, n in enumerate(row) if n}
+                for primary, row in zip(self.class_names, self.confusion.tolist()) if any(row)
+            }
+        return stats
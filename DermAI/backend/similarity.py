@@ -0,0 +1,375 @@
+"""
+Similar-case retrieval over the HAM10000 images.
+
+Embeddings are the activations of the CNN's penultimate Dense(256) layer,
+L2-normalised so cosine similarity is a dot product. The offline job in
+this module embeds every dataset image into a float16 matrix stored next
+to the image's metadata (lesion_id, dx, dx_type, age, sex, localization):
+
+    models/similarity/
+        CURRENT                    -> name of the version directory being served
+        <model_version>/
+            embeddings.npy         float16, (N, 256), unit rows
+            records.npz            metadata columns aligned with the rows
+            info.json
+            chunks/                per-chunk progress while a build is running
+
+<model_version> is a hash of the model file, so a retrained model gets a
+new directory. Building it is resumable chunk by chunk, and the previous
+version keeps being served until CURRENT is switched at the end. Running
+the job again for the same model only embeds images that are not yet in
+the index.
+
+SimilarityIndex answers top-k queries with one matrix-vector product over
+the in-memory matrix (upcast to float32 once at load, ~10MB for HAM10000,
+since NumPy has no BLAS path for float16).
+
+Usage:
+    python similarity.py [--model models/dermai_model.h5] [--images-dir HAM10000_images]
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+from dataset_metadata import DX_NAMES, METADATA_FILE, load_metadata
+
+logger = logging.getLogger(__name__)
+
+SIMILARITY_DIR = os.environ.get('DERMAI_SIMILARITY_DIR', 'models/similarity')
+SIMILAR_DEFAULT_K = 5
+SIMILAR_MAX_K = 50
+
+CURRENT_FILE = 'CURRENT'
+EMBEDDINGS_FILE = 'embeddings.npy'
+RECORDS_FILE = 'records.npz'
+INFO_FILE = 'info.json'
+CHUNKS_DIR = 'chunks'
+RECORD_COLUMNS = ('image_id', 'lesion_id', 'dx', 'dx_type', 'age', 'sex', 'localization')
+
+
+def model_version(model_path):
+    """Short content hash of a model artifact (file, or every file of a directory artifact)"""
+    path = Path(model_path)
+    files = sorted(p for p in path.rglob('*') if p.is_file()) if path.is_dir() else [path]
+    digest = hashlib.sha256()
+    for file in files:
+        with open(file, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def embedding_function(model, fallback_path=None):
+    """Return fn(batch) -> (n, 256) embeddings for a loaded model artifact.
+
+    Exported artifacts carry an embedding output; Keras models get a
+    sub-model ending at the penultimate Dense layer. Artifacts exported
+    before embeddings were added fall back to the Keras model at
+    fallback_path.
+    """
+    import tensorflow as tf
+    from model_artifacts import embedding_layer, load_model_artifact
+
+    if getattr(model, 'embed_fn', None) is not None:
+        return model.embed
+
+    if not isinstance(model, tf.keras.Model):
+        if fallback_path is None:
+            raise ValueError("Model artifact has no embedding output; re-export it with model_trainer.py")
+        logger.warning(f"Model artifact has no embedding output, loading {fallback_path} for embeddings")
+        model = load_model_artifact(fallback_path)
+
+    layer = embedding_layer(model)
+    if layer is None:
+        raise ValueError("Model has no penultimate Dense layer to take embeddings from")
+    extractor = tf.keras.Model(model.inputs[0], layer.output)
+    return lambda batch: extractor(tf.convert_to_tensor(batch, dtype=tf.float32), training=False).numpy()
+
+
+def normalize(embeddings):
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+
+class SimilarityIndex:
+    """Read side of the index, used by the API; follows CURRENT as new versions are published"""
+
+    def __init__(self, root=SIMILARITY_DIR):
+        self.root = Path(root)
+        self.lock = threading.Lock()
+        self.version = None
+        self.current_mtime = None
+        self.matrix = None
+        self.records = None
+        self.lesion_codes = None
+        self.row_by_image = {}
+
+    @property
+    def loaded(self):
+        return self.matrix is not None
+
+    def maybe_reload(self):
+        """Load the published version if CURRENT changed since the last check (one stat call otherwise)"""
+        current = self.root / CURRENT_FILE
+        try:
+            mtime = current.stat().st_mtime
+        except FileNotFoundError:
+            return False
+        if mtime == self.current_mtime:
+            return False
+
+        with self.lock:
+            if mtime == self.current_mtime:
+                return False
+            version = current.read_text().strip()
+            self._load(version)
+            self.current_mtime = mtime
+        return True
+
+    def _load(self, version):
+        version_dir = self.root / version
+        start = time.perf_counter()
+        matrix = np.load(version_dir / EMBEDDINGS_FILE).astype(np.float32)
+        with np.load(version_dir / RECORDS_FILE) as data:
+            records = {column: data[column] for column in RECORD_COLUMNS}
+
+        _, lesion_codes = np.unique(records['lesion_id'], return_inverse=True)
+        # Swap in all at once so concurrent searches never see a mix of versions
+        self.matrix, self.records, self.lesion_codes = matrix, records, lesion_codes
+        self.row_by_image = {image_id: i for i, image_id in enumerate(records['image_id'].tolist())}
+        self.version = version
+        logger.info(f"Similarity index {version} loaded: {len(matrix)} cases in "
+                    f"{(time.perf_counter() - start) * 1000:.0f} ms")
+
+    def vector(self, image_id):
+        """Stored embedding of a dataset image, or None if it is not indexed"""
+        row = self.row_by_image.get(image_id)
+        return None if row is None else self.matrix[row]
+
+    def search(self, query, k=SIMILAR_DEFAULT_K, dx=None, unique_lesions=True, exclude_image_id=None):
+        """Top-k most similar cases by cosine similarity, best first"""
+        matrix, records, lesion_codes = self.matrix, self.records, self.lesion_codes
+        scores = matrix @ normalize(query)
+
+        if dx is not None:
+            scores = np.where(records['dx'] == dx, scores, -np.inf)
+        excluded_lesion = None
+        if exclude_image_id is not None and exclude_image_id in self.row_by_image:
+            # Other photos of the query's own lesion are not "similar cases"
+            excluded_lesion = lesion_codes[self.row_by_image[exclude_image_id]]
+            scores = np.where(lesion_codes == excluded_lesion, -np.inf, scores)
+
+        # Over-fetch so that collapsing several photos of one lesion still leaves k results
+        fetch = min(len(scores), k * 4 if unique_lesions else k)
+        candidates = np.argpartition(-scores, fetch - 1)[:fetch] if fetch < len(scores) else np.arange(len(scores))
+        candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+        if unique_lesions and len(np.unique(lesion_codes[candidates])) < k:
+            candidates = np.argsort(-scores, kind='stable')
+
+        results = []
+        seen_lesions = set()
+        for row in candidates:
+            if len(results) == k or not np.isfinite(scores[row]):
+                break
+            if unique_lesions:
+                if lesion_codes[row] in seen_lesions:
+                    continue
+                seen_lesions.add(lesion_codes[row])
+            results.append(self._result(row, scores[row]))
+        return results
+
+    def _result(self, row, score):
+        records = self.records
+        age = float(records['age'][row])
+        return {
+            'image_id': str(records['image_id'][row]),
+            'lesion_id': str(records['lesion_id'][row]),
+            'dx': str(records['dx'][row]),
+            'disease': DX_NAMES.get(str(records['dx'][row]), str(records['dx'][row])),
+            'dx_type': str(records['dx_type'][row]),
+            'age': None if np.isnan(age) else age,
+            'sex': str(records['sex'][row]),
+            'localization': str(records['localization'][row]),
+            'similarity': float(score)
+        }
+
+    def stats(self):
+        return {
+            'loaded': self.loaded,
+            'version': self.version,
+            'cases': 0 if self.matrix is None else int(len(self.matrix)),
+            'dim': 0 if self.matrix is None else int(self.matrix.shape[1])
+        }
+
+
+class SimilarityIndexBuilder:
+    """Offline job: embed the dataset for one model version and publish it"""
+
+    def __init__(self, model_path='models/dermai_model.h5', images_dir='HAM10000_images',
+                 metadata_file=METADATA_FILE, root=SIMILARITY_DIR, batch_size=64, chunk_size=1024):
+        self.model_path = Path(model_path)
+        self.images_dir = Path(images_dir)
+        self.metadata_file = Path(metadata_file)
+        self.root = Path(root)
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.img_size = (224, 224)
+        self.embed = None
+
+    def load_records(self):
+        """Metadata rows for every image present on disk, as NumPy columns"""
+        metadata = load_metadata(self.metadata_file)
+        present = np.array([(self.images_dir / f"{image_id}.jpg").exists()
+                            for image_id in metadata.columns['image_id']], dtype=bool)
+        return {column: metadata.decoded(column)[present] for column in RECORD_COLUMNS}
+
+    def load_model(self):
+        from model_artifacts import load_model_artifact, preferred_artifact
+
+        # The same artifact DermAIPredictor serves, so query and index embeddings match
+        model = load_model_artifact(preferred_artifact(self.model_path))
+        self.embed = embedding_function(model, fallback_path=self.model_path)
+
+    def embed_images(self, image_ids):
+        from PIL import Image
+
+        embeddings = []
+        for start in range(0, len(image_ids), self.batch_size):
+            batch = []
+            for image_id in image_ids[start:start + self.batch_size]:
+                with Image.open(self.images_dir / f"{image_id}.jpg") as image:
+                    batch.append(np.asarray(image.convert('RGB').resize(self.img_size), dtype=np.float32) / 255.0)
+            embeddings.append(normalize(self.embed(np.stack(batch))))
+        return np.concatenate(embeddings).astype(np.float16)
+
+    @staticmethod
+    def _subset(records, rows):
+        return {column: values[rows] for column, values in records.items()}
+
+    def _write_version(self, version_dir, embeddings, records, version):
+        # Write beside the final names and rename, so a reader never sees a partial file
+        np.save(version_dir / 'embeddings.tmp.npy', embeddings)
+        np.savez(version_dir / 'records.tmp.npz', **records)
+        os.replace(version_dir / 'embeddings.tmp.npy', version_dir / EMBEDDINGS_FILE)
+        os.replace(version_dir / 'records.tmp.npz', version_dir / RECORDS_FILE)
+        with open(version_dir / INFO_FILE, 'w') as f:
+            json.dump({
+                'model_version': version,
+                'model_path': str(self.model_path),
+                'cases': int(len(embeddings)),
+                'dim': int(embeddings.shape[1]),
+                'dtype': str(embeddings.dtype),
+                'updated': datetime.now().isoformat()
+            }, f, indent=2)
+
+    def _build_chunks(self, version_dir, records):
+        chunks_dir = version_dir / CHUNKS_DIR
+        chunks_dir.mkdir(parents=True, exist_ok=True)
+        total = len(records['image_id'])
+        chunk_embeddings = []
+        for index, start in enumerate(range(0, total, self.chunk_size)):
+            chunk_file = chunks_dir / f"chunk_{index:05d}.npy"
+            image_ids = records['image_id'][start:start + self.chunk_size]
+            if chunk_file.exists():
+                embeddings = np.load(chunk_file)
+                if len(embeddings) == len(image_ids):
+                    chunk_embeddings.append(embeddings)
+                    continue
+
+            print(f"Embedding images {start}-{start + len(image_ids)} of {total}...")
+            embeddings = self.embed_images(image_ids)
+            np.save(chunks_dir / f"chunk_{index:05d}.tmp.npy", embeddings)
+            os.replace(chunks_dir / f"chunk_{index:05d}.tmp.npy", chunk_file)
+            chunk_embeddings.append(embeddings)
+
+        embeddings = np.concatenate(chunk_embeddings)
+        for chunk_file in chunks_dir.glob('*.npy'):
+            chunk_file.unlink()
+        chunks_dir.rmdir()
+        return embeddings
+
+    def build(self, keep_versions=2):
+        if keep_versions < 1:
+            raise ValueError(f"keep_versions must be at least 1 (the published index), got {keep_versions}")
+        version = model_version(self.model_path)
+        version_dir = self.root / version
+        version_dir.mkdir(parents=True, exist_ok=True)
+        records = self.load_records()
+        print(f"Model version {version}: {len(records['image_id'])} images with metadata")
+
+        self.load_model()
+        if (version_dir / EMBEDDINGS_FILE).exists():
+            # Same model: only embed images that are not in the index yet
+            embeddings = np.load(version_dir / EMBEDDINGS_FILE)
+            with np.load(version_dir / RECORDS_FILE) as data:
+                indexed = {column: data[column] for column in RECORD_COLUMNS}
+            known = set(indexed['image_id'].tolist())
+            new_rows = np.array([i for i, image_id in enumerate(records['image_id']) if image_id not in known], dtype=int)
+            if len(new_rows):
+                print(f"Adding {len(new_rows)} new images to the index")
+                new_records = self._subset(records, new_rows)
+                embeddings = np.concatenate([embeddings, self.embed_images(new_records['image_id'])])
+                indexed = {column: np.concatenate([indexed[column], new_records[column]]) for column in RECORD_COLUMNS}
+                self._write_version(version_dir, embeddings, indexed, version)
+            else:
+                print("Index is up to date")
+        else:
+            # New model: embed everything, resumable chunk by chunk
+            embeddings = self._build_chunks(version_dir, records)
+            self._write_version(version_dir, embeddings, records, version)
+
+        self.publish(version)
+        self.remove_old_versions(keep_versions, version)
+        return version_dir
+
+    def publish(self, version):
+        tmp = self.root / (CURRENT_FILE + '.tmp')
+        tmp.write_text(version)
+        os.replace(tmp, self.root / CURRENT_FILE)
+        print(f"Published similarity index {version}")
+
+    def remove_old_versions(self, keep_versions, published):
+        """Keep the published version plus the keep_versions - 1 most recently written others"""
+        import shutil
+
+        # An unchanged index does not rewrite info.json, so after a rollback the published
+        # version can be the oldest on disk; it is never a removal candidate
+        versions = sorted(
+            (p for p in self.root.iterdir() if p.is_dir() and p.name != published and (p / INFO_FILE).exists()),
+            key=lambda p: (p / INFO_FILE).stat().st_mtime, reverse=True
+        )
+        for old in versions[max(0, keep_versions - 1):]:
+            shutil.rmtree(old)
+            print(f"Removed old similarity index {old.name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build or update the similar-case index for the current model')
+    parser.add_argument('--model', default='models/dermai_model.h5')
+    parser.add_argument('--images-dir', default='HAM10000_images')
+    parser.add_argument('--metadata', default=str(METADATA_FILE))
+    parser.add_argument('--index-dir', default=SIMILARITY_DIR)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--chunk-size', type=int, default=1024, help='Images per resumable chunk')
+    parser.add_argument('--keep', type=int, default=2, help='Index versions to keep on disk, including the published one')
+    args = parser.parse_args()
+    if args.keep < 1:
+        parser.error('--keep must be at least 1 (the published index)')
+
+    builder = SimilarityIndexBuilder(
+        model_path=args.model, images_dir=args.images_dir, metadata_file=args.metadata,
+        root=args.index_dir, batch_size=args.batch_size, chunk_size=args.chunk_size
+    )
+    builder.build(keep_versions=args.keep)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+import threading
+import time
+
+import pytest
+
+from admission import AdmissionRejected, DeadlineExceeded, InferenceQueue
+from tracing import RequestTrace, current_trace
+
+
+def deadline_in(seconds):
+    return time.monotonic() + seconds
+
+
+def wait_for(condition, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > end:
+            raise AssertionError('condition not reached')
+        time.sleep(0.005)
+
+
+def block_worker(q):
+    """Occupy q's single worker until the returned event is set"""
+    release = threading.Event()
+    started = threading.Event()
+
+    def blocker():
+        started.set()
+        release.wait(5)
+
+    threading.Thread(target=q.run, args=(blocker, deadline_in(10)), daemon=True).start()
+    started.wait(5)
+    return release
+
+
+def test_run_returns_result_and_records_service_time():
+    q = InferenceQueue(max_depth=4, workers=1)
+    assert q.run(lambda: 42, deadline_in(5)) == 42
+    stats = q.stats()
+    assert stats['admitted'] == stats['completed'] == 1
+    assert stats['service_ms_per_image'] is not None
+    assert q.load() == 0
+
+
+def test_job_errors_are_raised_to_the_caller():
+    q = InferenceQueue(max_depth=4, workers=1)
+
+    def fail():
+        raise RuntimeError('model exploded')
+
+    with pytest.raises(RuntimeError, match='model exploded'):
+        q.run(fail, deadline_in(5))
+    assert q.stats()['failed'] == 1
+
+
+def test_full_queue_is_rejected():
+    q = InferenceQueue(max_depth=1, workers=1)
+    release = block_worker(q)
+    try:
+        # Fills the single queue slot behind the running job
+        threading.Thread(target=q.run, args=(lambda: None, deadline_in(10)), daemon=True).start()
+        wait_for(lambda: q.jobs.full())
+        with pytest.raises(AdmissionRejected) as rejected:
+            q.run(lambda: None, deadline_in(10))
+        assert rejected.value.reason == 'queue_full'
+        assert rejected.value.retry_after >= 1
+        assert q.stats()['rejected_queue_full'] == 1
+    finally:
+        release.set()
+
+
+def test_deadline_that_cannot_be_met_is_rejected_before_queueing():
+    q = InferenceQueue(max_depth=4, workers=1)
+    q.service_ms = 10000.0
+    called = []
+    with pytest.raises(AdmissionRejected) as rejected:
+        q.run(lambda: called.append(1), deadline_in(0.5))
+    assert rejected.value.reason == 'deadline'
+    assert rejected.value.retry_after == 10
+    assert called == []
+    assert q.stats()['admitted'] == 0
+
+
+def test_estimated_wait_counts_queued_and_running_cost_per_worker():
+    q = InferenceQueue(max_depth=4, workers=2)
+    assert q.estimated_wait_ms(3) == 0.0
+    q.service_ms = 100.0
+    q.queued_cost = 4
+    assert q.estimated_wait_ms(1) == pytest.approx((4 / 2 + 1) * 100.0)
+    q.active_cost = 16
+    assert q.estimated_wait_ms(1) == pytest.approx(((4 + 16) / 2 + 1) * 100.0)
+
+
+def test_running_batch_rejects_request_it_would_make_late():
+    q = InferenceQueue(max_depth=4, workers=1)
+    q.service_ms = 100.0
+    release = threading.Event()
+    started = threading.Event()
+
+    def batch():
+        started.set()
+        release.wait(5)
+
+    threading.Thread(target=q.run, args=(batch, deadline_in(10)), kwargs={'cost': 16}, daemon=True).start()
+    started.wait(5)
+    try:
+        # 16 images ahead at 100 ms each cannot finish within 1 s
+        with pytest.raises(AdmissionRejected) as rejected:
+            q.run(lambda: None, deadline_in(1.0))
+        assert rejected.value.reason == 'deadline'
+    finally:
+        release.set()
+
+
+@pytest.mark.parametrize('deadline', [float('inf'), float('nan')])
+def test_non_finite_deadline_is_refused_before_queueing(deadline):
+    q = InferenceQueue(max_depth=4, workers=1)
+    with pytest.raises(ValueError):
+        q.run(lambda: None, deadline)
+    assert q.stats()['admitted'] == 0
+    assert q.jobs.qsize() == 0
+
+
+def test_abandoned_job_is_dropped_unscored():
+    q = InferenceQueue(max_depth=4, workers=1)
+    release = block_worker(q)
+    called = []
+    with pytest.raises(DeadlineExceeded):
+        q.run(lambda: called.append(1), deadline_in(0.05))
+    release.set()
+
+    wait_for(lambda: q.stats()['dropped_abandoned'] == 1)
+    assert called == []
+    stats = q.stats()
+    assert stats['timed_out'] == 1
+    assert stats['shed_total'] == 1
+
+
+def test_queue_wait_is_recorded_on_the_callers_trace():
+    q = InferenceQueue(max_depth=4, workers=1)
+    trace = RequestTrace('req-1', 'POST', '/predict')
+    token = current_trace.set(trace)
+    try:
+        q.run(lambda: None, deadline_in(5))
+    finally:
+        current_trace.reset(token)
+    assert [span['name'] for span in trace.spans] == ['queue_wait']
+    assert trace.spans[0]['thread'].startswith('inference-worker-')
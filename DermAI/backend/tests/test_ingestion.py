@@ -0,0 +1,63 @@
+import io
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image
+
+from ingestion import BatchBudget, ImageIngestor, ImageRejected
+
+
+def upload(size, format):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, (200, 120, 90)).save(buffer, format)
+    buffer.seek(0)
+    return SimpleNamespace(stream=buffer)
+
+
+@pytest.fixture
+def ingestor():
+    # Scaled-down limits: reduced JPEG decode above 20k pixels, no full decode above 50k
+    return ImageIngestor(max_image_pixels=2_000_000, max_decode_pixels=20_000,
+                         max_full_decode_pixels=50_000, model_size=(32, 32))
+
+
+def test_large_jpeg_is_decoded_at_reduced_resolution(ingestor):
+    image = ingestor.open(upload((800, 600), 'JPEG'))
+    assert image.size == (100, 75)
+    assert ingestor.stats()['reduced_decodes'] == 1
+
+
+@pytest.mark.parametrize('format', ['PNG', 'BMP', 'GIF'])
+def test_large_image_without_reduced_decode_is_rejected(ingestor, format):
+    with pytest.raises(ImageRejected) as rejected:
+        ingestor.open(upload((800, 600), format))
+    assert rejected.value.status == 413
+    assert format in rejected.value.message
+    assert ingestor.stats()['rejected_pixels'] == 1
+
+
+def test_image_without_reduced_decode_below_ceiling_is_accepted(ingestor):
+    image = ingestor.open(upload((200, 200), 'PNG'))
+    assert image.size == (200, 200)
+    assert ingestor.stats()['accepted'] == 1
+
+
+def test_header_dimensions_above_limit_are_rejected(ingestor):
+    with pytest.raises(ImageRejected) as rejected:
+        ingestor.open(upload((2000, 1001), 'JPEG'))
+    assert rejected.value.status == 413
+
+
+def test_batch_budget_counts_decoded_pixels(ingestor):
+    budget = BatchBudget(max_pixels=10_000)
+    ingestor.open(upload((800, 600), 'JPEG'), budget)
+    assert budget.remaining_pixels == 10_000 - 100 * 75
+    with pytest.raises(ImageRejected):
+        ingestor.open(upload((800, 600), 'JPEG'), budget)
+    assert ingestor.stats()['rejected_batch_budget'] == 1
+
+
+def test_invalid_image(ingestor):
+    with pytest.raises(ImageRejected) as rejected:
+        ingestor.open(SimpleNamespace(stream=io.BytesIO(b'not an image')))
+    assert rejected.value.status == 400
@@ -0,0 +1,45 @@
+import os
+import time
+
+from model_artifacts import GRAPH_FILE, OPTIMIZED_SUFFIX, SAVEDMODEL_SUFFIX, preferred_artifact
+
+
+def touch(path, mtime=None):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb'):
+        pass
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+def test_non_h5_paths_are_used_as_given(tmp_path):
+    assert preferred_artifact(str(tmp_path / 'model.npz')) == str(tmp_path / 'model.npz')
+
+
+def test_fresh_optimized_export_is_preferred(tmp_path):
+    h5 = str(tmp_path / 'dermai_model.h5')
+    touch(h5, time.time() - 60)
+    touch(os.path.join(str(tmp_path / 'dermai_model') + OPTIMIZED_SUFFIX, GRAPH_FILE))
+    assert preferred_artifact(h5) == str(tmp_path / 'dermai_model') + OPTIMIZED_SUFFIX
+
+
+def test_stale_optimized_export_is_ignored(tmp_path):
+    h5 = str(tmp_path / 'dermai_model.h5')
+    touch(os.path.join(str(tmp_path / 'dermai_model') + OPTIMIZED_SUFFIX, GRAPH_FILE), time.time() - 60)
+    touch(h5)
+    assert preferred_artifact(h5) == h5
+
+
+def test_exports_alone_are_enough_without_the_h5(tmp_path):
+    h5 = str(tmp_path / 'dermai_model.h5')
+    saved_model = str(tmp_path / 'dermai_model') + SAVEDMODEL_SUFFIX
+    os.makedirs(saved_model)
+    assert preferred_artifact(h5) == saved_model
+
+    touch(os.path.join(str(tmp_path / 'dermai_model') + OPTIMIZED_SUFFIX, GRAPH_FILE))
+    assert preferred_artifact(h5) == str(tmp_path / 'dermai_model') + OPTIMIZED_SUFFIX
+
+
+def test_nothing_deployed_returns_the_h5(tmp_path):
+    h5 = str(tmp_path / 'dermai_model.h5')
+    assert preferred_artifact(h5) == h5
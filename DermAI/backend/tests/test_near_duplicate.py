@@ -0,0 +1,114 @@
+import cv2
+import numpy as np
+import pytest
+
+from near_duplicate import NearDuplicateIndex, hamming_distances, perceptual_hash
+
+
+def textured_image(seed, size=224):
+    """Smooth random blobs, like skin texture at model-input resolution"""
+    rng = np.random.default_rng(seed)
+    noise = rng.random((size // 16, size // 16, 3)).astype(np.float32)
+    return cv2.resize(noise, (size, size), interpolation=cv2.INTER_CUBIC).clip(0, 1)
+
+
+def bits(n):
+    return np.uint64(n)
+
+
+def test_hamming_distances():
+    fingerprints = np.array([0, 1, 0b1011, 2 ** 64 - 1], dtype=np.uint64)
+    assert hamming_distances(fingerprints, bits(0)).tolist() == [0, 1, 3, 64]
+    assert hamming_distances(fingerprints, bits(2 ** 64 - 1)).tolist() == [64, 63, 61, 0]
+
+
+def test_perceptual_hash_is_stable_under_reencoding_and_resizing():
+    image = textured_image(0)
+    fingerprint = perceptual_hash(image)
+    assert isinstance(fingerprint, np.uint64)
+
+    encoded = cv2.imencode('.jpg', (image * 255).astype(np.uint8), [cv2.IMWRITE_JPEG_QUALITY, 50])[1]
+    reencoded = cv2.imdecode(encoded, cv2.IMREAD_UNCHANGED).astype(np.float32) / 255
+    halved = cv2.resize(cv2.resize(image, (112, 112), interpolation=cv2.INTER_AREA), (224, 224))
+    brighter = (image * 1.1).clip(0, 1)
+
+    for variant in (reencoded, halved, brighter):
+        assert hamming_distances(np.array([fingerprint]), perceptual_hash(variant))[0] <= 6
+    # Value range does not matter (0-1 model input or 0-255 pixels)
+    assert perceptual_hash(image * 255) == fingerprint
+
+
+def test_distinct_images_are_far_apart():
+    fingerprints = np.array([perceptual_hash(textured_image(seed)) for seed in range(8)])
+    for i, fingerprint in enumerate(fingerprints):
+        distances = np.delete(hamming_distances(fingerprints, fingerprint), i)
+        assert distances.min() > 6
+
+
+def test_lookup_returns_nearest_match_within_distance():
+    index = NearDuplicateIndex(capacity=8, max_distance=4)
+    index.add(bits(0b1111), np.array([0.2, 0.8]), 'off')
+    index.add(bits(0b0111), np.array([0.6, 0.4]), 'off')
+
+    probabilities, info = index.lookup(bits(0b0011), 'off')
+    np.testing.assert_allclose(probabilities, [0.6, 0.4])
+    assert info['distance'] == 1
+    assert info['max_distance'] == 4
+    assert info['hits'] == 1
+    assert index.lookup(bits(0b1111_0000_0000), 'off') is None
+
+
+def test_lookup_requires_same_tta_mode():
+    index = NearDuplicateIndex(capacity=8, max_distance=4)
+    index.add(bits(0), np.array([0.5, 0.5]), 'always')
+    index.add(bits(0b111), np.array([0.9, 0.1]), 'off')
+
+    # The exact match was cached under another TTA mode; the farther 'off' entry is used
+    probabilities, info = index.lookup(bits(0), 'off')
+    np.testing.assert_allclose(probabilities, [0.9, 0.1])
+    assert info['distance'] == 3
+    assert index.lookup(bits(0), 'auto') is None
+
+
+def test_cached_probabilities_are_copied():
+    index = NearDuplicateIndex(capacity=2, max_distance=0)
+    probabilities = np.array([0.3, 0.7])
+    index.add(bits(5), probabilities, 'off')
+    probabilities[0] = 1.0
+    np.testing.assert_allclose(index.lookup(bits(5), 'off')[0], [0.3, 0.7])
+
+
+def test_full_index_evicts_least_recently_used():
+    index = NearDuplicateIndex(capacity=2, max_distance=0)
+    index.add(bits(1), np.array([1.0]), 'off')
+    index.add(bits(2), np.array([2.0]), 'off')
+    # Using entry 1 makes entry 2 the least recently used
+    assert index.lookup(bits(1), 'off') is not None
+    index.add(bits(3), np.array([3.0]), 'off')
+
+    assert index.lookup(bits(2), 'off') is None
+    assert index.lookup(bits(1), 'off') is not None
+    assert index.lookup(bits(3), 'off') is not None
+    stats = index.stats()
+    assert stats['size'] == 2
+    assert stats['evictions'] == 1
+    assert stats['inserts'] == 3
+
+
+def test_stats_hit_rate():
+    index = NearDuplicateIndex(capacity=4, max_distance=2)
+    assert index.stats()['hit_rate'] is None
+    index.add(bits(0), np.array([1.0]), 'off')
+    index.lookup(bits(1), 'off')
+    index.lookup(bits(0b11111), 'off')
+    stats = index.stats()
+    assert stats['lookups'] == 2
+    assert stats['hits'] == 1
+    assert stats['hit_rate'] == 0.5
+    assert stats['lookup_us'] > 0
+
+
+@pytest.mark.parametrize('max_distance', [-1, 64])
+def test_invalid_distance(max_distance):
+    with pytest.raises(ValueError):
+        NearDuplicateIndex(capacity=4, max_distance=max_distance)
@@ -0,0 +1,119 @@
+import time
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from prediction_log import PredictionLog, _parse_time
+
+CLASSES = ['melanoma', 'nevus', 'basal_cell_carcinoma']
+
+
+def wait_logged(log, count, timeout=5.0):
+    end = time.monotonic() + timeout
+    while log.stats()['logged'] < count:
+        if time.monotonic() > end:
+            raise AssertionError(f"only {log.stats()['logged']} of {count} rows written")
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def log(tmp_path):
+    return PredictionLog(str(tmp_path / 'predictions.db'), CLASSES, batch_size=8, flush_ms=20)
+
+
+def submit(log, predicted, probabilities, risk_level='LOW', model_version='v1', input_hash=None, inference_ms=None):
+    log.submit(probabilities, predicted, max(probabilities), risk_level, model_version,
+               context={'endpoint': 'predict', 'input_hash': input_hash, 'request_id': 'req'},
+               timings={'inference': inference_ms} if inference_ms is not None else None)
+
+
+def test_summary_groups_by_class(log):
+    submit(log, 'nevus', [0.1, 0.8, 0.1], inference_ms=10.0)
+    submit(log, 'nevus', [0.2, 0.6, 0.2], inference_ms=30.0)
+    submit(log, 'melanoma', [0.7, 0.2, 0.1], risk_level='MODERATE')
+    wait_logged(log, 3)
+
+    groups = {g['class']: g for g in log.summary(probabilities=True)}
+
+    assert set(groups) == {'nevus', 'melanoma'}
+    assert groups['nevus']['count'] == 2
+    assert groups['nevus']['mean_confidence'] == pytest.approx(0.7)
+    assert groups['nevus']['mean_inference_ms'] == pytest.approx(20.0)
+    assert groups['nevus']['mean_probabilities'] == pytest.approx(
+        {'melanoma': 0.15, 'nevus': 0.7, 'basal_cell_carcinoma': 0.15})
+    assert groups['melanoma']['count'] == 1
+    assert groups['melanoma']['mean_inference_ms'] is None
+
+
+def test_summary_filters_time_window_and_multiple_keys(log):
+    submit(log, 'nevus', [0.1, 0.8, 0.1], model_version='v1')
+    wait_logged(log, 1)
+    split = time.time()
+    time.sleep(0.01)
+    submit(log, 'nevus', [0.1, 0.8, 0.1], model_version='v2', risk_level='VERY_LOW')
+    submit(log, 'melanoma', [0.9, 0.05, 0.05], model_version='v2', risk_level='HIGH')
+    wait_logged(log, 3)
+
+    assert [g['count'] for g in log.summary(until=split, group_by=())] == [1]
+    recent = log.summary(since=split, group_by=('model_version', 'risk_level'))
+    assert [(g['model_version'], g['risk_level'], g['count']) for g in recent] == [
+        ('v2', 'HIGH', 1), ('v2', 'VERY_LOW', 1)]
+    assert [g['class'] for g in log.summary(filters={'model_version': 'v2', 'class': 'melanoma'})] == ['melanoma']
+
+
+def test_summary_of_empty_window(log):
+    assert log.summary(group_by=()) == []
+    assert log.summary() == []
+
+
+def test_summary_rejects_unknown_keys(log):
+    with pytest.raises(ValueError, match='patient'):
+        log.summary(group_by=('patient',))
+    with pytest.raises(ValueError, match='confidence'):
+        log.summary(filters={'confidence': '0.5'})
+
+
+def test_lookup_returns_newest_first_with_probabilities(log):
+    submit(log, 'nevus', [0.1, 0.8, 0.1], input_hash='abc', model_version='v1')
+    wait_logged(log, 1)
+    submit(log, 'melanoma', [0.6, 0.3, 0.1], input_hash='abc', model_version='v2')
+    submit(log, 'nevus', [0.1, 0.8, 0.1], input_hash='other')
+    wait_logged(log, 3)
+
+    records = log.lookup('abc')
+    assert [r['model_version'] for r in records] == ['v2', 'v1']
+    assert records[0]['probabilities'] == pytest.approx({'melanoma': 0.6, 'nevus': 0.3, 'basal_cell_carcinoma': 0.1})
+    assert records[0]['request_id'] == 'req'
+    assert log.lookup('missing') == []
+
+
+def test_probabilities_are_stored_as_float32(log):
+    submit(log, 'nevus', np.array([0.1, 0.8, 0.1], dtype=np.float64), input_hash='h')
+    wait_logged(log, 1)
+    stored = log.lookup('h')[0]['probabilities']['nevus']
+    assert stored == pytest.approx(float(np.float32(0.8)))
+
+
+def test_reopening_with_other_classes_fails(log):
+    with pytest.raises(ValueError, match='created for classes'):
+        PredictionLog(log.path, ['a', 'b'])
+
+
+def test_full_queue_drops_without_blocking(tmp_path):
+    log = PredictionLog(str(tmp_path / 'p.db'), CLASSES, max_pending=1, flush_ms=20)
+    for _ in range(2000):
+        submit(log, 'nevus', [0.1, 0.8, 0.1])
+    dropped = log.stats()['dropped_queue_full']
+    assert dropped > 0
+    # Every row is either written or counted as dropped
+    wait_logged(log, 2000 - dropped)
+    assert log.stats()['logged'] == 2000 - dropped
+
+
+def test_parse_time():
+    assert _parse_time(None) is None
+    assert _parse_time('1700000000.5') == 1700000000.5
+    assert _parse_time('2024-01-02T03:04:05') == datetime(2024, 1, 2, 3, 4, 5).timestamp()
+    with pytest.raises(ValueError):
+        _parse_time('yesterday')
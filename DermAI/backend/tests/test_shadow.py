@@ -0,0 +1,87 @@
+import time
+
+import numpy as np
+
+from admission import InferenceQueue
+from shadow import ShadowScorer
+
+CLASSES = ['melanoma', 'nevus']
+
+
+class Candidate:
+    """Candidate predictor that records the TTA mode it was asked to score with"""
+
+    model_path = 'candidate.h5'
+    model_version = 'c1'
+
+    def __init__(self, probabilities):
+        self.probabilities = np.array(probabilities)
+        self.tta_modes = []
+
+    def predict_probabilities(self, processed_image, tta_mode):
+        self.tta_modes.append(tta_mode)
+        return self.probabilities, None
+
+    def determine_risk_level(self, disease, confidence):
+        return 'HIGH' if disease == 'melanoma' else 'LOW'
+
+
+def wait_scored(shadow, count, timeout=5.0):
+    end = time.monotonic() + timeout
+    while shadow.stats()['scored'] < count:
+        if time.monotonic() > end:
+            raise AssertionError(f"only {shadow.stats()['scored']} of {count} scored")
+        time.sleep(0.005)
+
+
+def scorer(candidate, load=0, max_primary_load=1):
+    return ShadowScorer(candidate, CLASSES, primary_load=lambda: load, sample_rate=1.0,
+                        max_primary_load=max_primary_load)
+
+
+def test_candidate_scores_the_same_views_as_the_primary():
+    candidate = Candidate([0.2, 0.8])
+    shadow = scorer(candidate)
+    shadow.submit(np.zeros((1, 4, 4, 3)), [0.3, 0.7], 'LOW')
+    shadow.submit(np.zeros((1, 4, 4, 3)), [0.3, 0.7], 'LOW', tta_applied=True, cascade_stage='full')
+    wait_scored(shadow, 2)
+    assert candidate.tta_modes == ['off', 'always']
+    assert shadow.stats()['top1_agreement'] == 1.0
+
+
+def test_cascade_first_stage_answers_are_not_compared():
+    shadow = scorer(Candidate([0.2, 0.8]))
+    shadow.submit(np.zeros((1, 4, 4, 3)), [0.3, 0.7], 'LOW', cascade_stage='first')
+    stats = shadow.stats()
+    assert stats['skipped_cascade'] == 1
+    assert stats['submitted'] == 0
+
+
+def test_risk_flips_and_confusion():
+    shadow = scorer(Candidate([0.9, 0.1]))
+    shadow.submit(np.zeros((1, 4, 4, 3)), [0.3, 0.7], 'LOW')
+    wait_scored(shadow, 1)
+    stats = shadow.stats()
+    assert stats['risk_flips'] == {'LOW->HIGH': 1}
+    assert stats['confusion'] == {'nevus': {'melanoma': 1}}
+
+
+def test_other_primary_load_drops_shadow_work():
+    shadow = scorer(Candidate([0.2, 0.8]), load=3, max_primary_load=1)
+    shadow.submit(np.zeros((1, 4, 4, 3)), [0.3, 0.7], 'LOW')
+    assert shadow.stats()['dropped_load'] == 1
+
+
+def test_batch_job_does_not_count_against_itself():
+    q = InferenceQueue(max_depth=4, workers=1)
+    candidate = Candidate([0.2, 0.8])
+    shadow = ShadowScorer(candidate, CLASSES, primary_load=q.load, sample_rate=1.0, max_primary_load=1)
+
+    def score_batch():
+        for _ in range(16):
+            shadow.submit(np.zeros((1, 4, 4, 3)), [0.3, 0.7], 'LOW')
+
+    q.run(score_batch, time.monotonic() + 5, cost=16)
+    stats = shadow.stats()
+    assert stats['dropped_load'] == 0
+    assert stats['submitted'] + stats['dropped_queue_full'] == 16
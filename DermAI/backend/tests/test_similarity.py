@@ -0,0 +1,53 @@
+import os
+import time
+
+import pytest
+
+from similarity import INFO_FILE, SimilarityIndexBuilder
+
+
+def put_version(root, name, age_s):
+    version_dir = root / name
+    version_dir.mkdir(parents=True)
+    info = version_dir / INFO_FILE
+    info.write_text('{}')
+    mtime = time.time() - age_s
+    os.utime(info, (mtime, mtime))
+
+
+@pytest.fixture
+def builder(tmp_path):
+    root = tmp_path / 'similarity'
+    # Three versions written oldest to newest; 'rolled_back' is published again after a rollback
+    put_version(root, 'rolled_back', 300)
+    put_version(root, 'middle', 200)
+    put_version(root, 'newest', 100)
+    # An index still being built has no info.json yet
+    (root / 'building' / 'chunks').mkdir(parents=True)
+    return SimilarityIndexBuilder(root=str(root))
+
+
+def versions(builder):
+    return sorted(p.name for p in builder.root.iterdir())
+
+
+def test_published_version_survives_even_when_oldest(builder):
+    builder.remove_old_versions(2, 'rolled_back')
+    assert versions(builder) == ['building', 'newest', 'rolled_back']
+
+
+def test_keep_one_leaves_only_the_published_version(builder):
+    builder.remove_old_versions(1, 'rolled_back')
+    assert versions(builder) == ['building', 'rolled_back']
+
+
+def test_keep_beyond_versions_removes_nothing(builder):
+    builder.remove_old_versions(5, 'newest')
+    assert versions(builder) == ['building', 'middle', 'newest', 'rolled_back']
+
+
+@pytest.mark.parametrize('keep', [0, -1])
+def test_build_rejects_keeping_no_versions(builder, keep):
+    with pytest.raises(ValueError, match='at least 1'):
+        builder.build(keep_versions=keep)
+    assert versions(builder) == ['building', 'middle', 'newest', 'rolled_back']
@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from tiling import Tiler, _positions, aggregate, lesion_box
+
+CLASSES = ['melanoma', 'nevus', 'basal_cell_carcinoma', 'actinic_keratosis',
+           'benign_keratosis', 'dermatofibroma', 'vascular_lesion']
+
+
+def skin_with_lesion(width=1200, height=900, box=(500, 350, 700, 550)):
+    """Light skin-coloured frame with a dark rectangular 'lesion'"""
+    rgb = np.full((height, width, 3), (225, 180, 160), dtype=np.uint8)
+    x0, y0, x1, y1 = box
+    rgb[y0:y1, x0:x1] = (70, 40, 30)
+    return rgb
+
+
+@pytest.mark.parametrize('length, tile, stride, expected', [
+    (224, 224, 168, [0]),
+    (100, 224, 168, [0]),
+    (448, 224, 224, [0, 224]),
+    # The last tile is shifted back to end exactly at the edge
+    (500, 224, 168, [0, 168, 276]),
+    (392, 224, 168, [0, 168]),
+])
+def test_positions_cover_the_edge(length, tile, stride, expected):
+    positions = _positions(length, tile, stride)
+    assert positions == expected
+    assert positions[-1] + tile >= length
+    assert all(0 <= p <= max(0, length - tile) for p in positions)
+
+
+def test_lesion_box_finds_dark_region_with_margin():
+    box = lesion_box(skin_with_lesion(), margin=0.2)
+    assert box is not None
+    x0, y0, x1, y1 = box
+    # Contains the 200x200 lesion plus roughly 20% padding, within the frame
+    assert x0 <= 500 and y0 <= 350 and x1 >= 700 and y1 >= 550
+    assert 440 <= x0 and 290 <= y0 and x1 <= 760 and y1 <= 610
+
+
+def test_lesion_box_rejects_uniform_image():
+    assert lesion_box(np.full((300, 400, 3), 200, dtype=np.uint8)) is None
+
+
+def test_scale_one_is_a_single_global_view():
+    tiler = Tiler(scales=(1,), lesion_crop=False)
+    batch, info = tiler.tiles(Image.fromarray(skin_with_lesion()))
+    assert batch.shape == (1, 224, 224, 3)
+    assert info == {'tiles': 1, 'scales': [{'scale': 1, 'tiles': 1, 'grid': 1}], 'crop': None}
+    assert 0.0 <= batch.min() and batch.max() <= 1.0
+
+
+def test_budget_keeps_coarse_scales_and_centre_tiles():
+    tiler = Tiler(scales=(2, 1), overlap=0.25, budget=4, lesion_crop=False)
+    batch, info = tiler.tiles(Image.fromarray(skin_with_lesion()))
+    assert batch.shape == (4, 224, 224, 3)
+    # Scales run coarse to fine whatever order they were given in
+    assert [s['scale'] for s in info['scales']] == [1, 2]
+    assert info['scales'][0]['tiles'] == 1
+    assert info['scales'][1]['tiles'] == 3
+    assert info['scales'][1]['grid'] > 3
+
+
+def test_budget_picks_tiles_nearest_the_centre():
+    # 448x448 at scale 1 stays one view; at scale 2 it is a 3x3 grid with 50% overlap
+    rgb = np.zeros((448, 448, 3), dtype=np.uint8)
+    rgb[112:336, 112:336] = 255
+    tiler = Tiler(scales=(2,), overlap=0.5, budget=1, lesion_crop=False)
+    batch, info = tiler.tiles(Image.fromarray(rgb))
+    assert info['scales'] == [{'scale': 2, 'tiles': 1, 'grid': 9}]
+    # The centre tile of the 448px resize is the all-white square
+    assert batch[0].min() == pytest.approx(1.0)
+
+
+def test_lesion_crop_is_reported():
+    tiler = Tiler(scales=(1,), lesion_crop=True)
+    _, info = tiler.tiles(Image.fromarray(skin_with_lesion()))
+    assert info['crop'] is not None
+    x0, y0, x1, y1 = info['crop']
+    assert x0 <= 500 and x1 >= 700
+
+
+def test_invalid_overlap():
+    with pytest.raises(ValueError):
+        Tiler(overlap=1.0)
+
+
+def test_aggregate_modes():
+    tiles = np.array([
+        [0.10, 0.80, 0.02, 0.02, 0.02, 0.02, 0.02],
+        [0.40, 0.20, 0.30, 0.02, 0.04, 0.02, 0.02],
+        [0.05, 0.90, 0.01, 0.01, 0.01, 0.01, 0.01],
+    ])
+    mean, tile = aggregate(tiles, 'mean', CLASSES)
+    assert tile is None
+    np.testing.assert_allclose(mean, tiles.mean(axis=0))
+
+    risky, tile = aggregate(tiles, 'max_risk', CLASSES)
+    assert tile == 1
+    np.testing.assert_allclose(risky, tiles[1])
+
+    with pytest.raises(ValueError):
+        aggregate(tiles, 'median', CLASSES)
@@ -0,0 +1,221 @@
+import hashlib
+import io
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from upload_store import STALE_TEMP_SECONDS, UploadStore, shard_path
+
+DAY = 86400
+
+
+def put_image(root, content, age_days, extension='jpg'):
+    """Store content at its shard path with an mtime age_days in the past; returns the absolute path"""
+    path = os.path.join(root, shard_path(hashlib.sha256(content).hexdigest(), extension))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+    set_age(path, age_days)
+    return path
+
+
+def put_flat(root, name, content, age_days):
+    path = os.path.join(root, name)
+    with open(path, 'wb') as f:
+        f.write(content)
+    set_age(path, age_days)
+    return path
+
+
+def set_age(path, age_days):
+    mtime = time.time() - age_days * DAY
+    os.utime(path, (mtime, mtime))
+
+
+def snapshot(root):
+    """Every file and directory under root with its size and mtime"""
+    entries = {}
+    for directory, dirs, files in os.walk(root):
+        for name in dirs:
+            entries[os.path.relpath(os.path.join(directory, name), root)] = 'dir'
+        for name in files:
+            stat = os.stat(os.path.join(directory, name))
+            entries[os.path.relpath(os.path.join(directory, name), root)] = (stat.st_size, stat.st_mtime_ns)
+    return entries
+
+
+def upload(content):
+    return SimpleNamespace(stream=io.BytesIO(content))
+
+
+@pytest.fixture
+def store(tmp_path):
+    return UploadStore(root=str(tmp_path / 'uploads'), max_age_days=0, max_bytes=0)
+
+
+def test_save_is_content_addressed_and_deduplicated(store):
+    first = store.save(upload(b'lesion'), 'JPEG')
+    digest = hashlib.sha256(b'lesion').hexdigest()
+    assert first == os.path.join(digest[:2], digest[2:4], f'{digest}.jpg')
+
+    path = os.path.join(store.root, first)
+    set_age(path, 10)
+    before = os.stat(path).st_mtime
+    assert store.save(upload(b'lesion'), 'jpg') == first
+    assert os.stat(path).st_mtime > before
+    assert store.counters['stored'] == 1
+    assert store.counters['deduplicated'] == 1
+    # No temporary files are left in the root
+    assert sorted(os.listdir(store.root)) == [digest[:2]]
+
+
+def test_save_with_known_digest_skips_rewrite(store):
+    digest = hashlib.sha256(b'lesion').hexdigest()
+    relative = store.save(upload(b'lesion'), 'png', digest=digest)
+    assert relative == shard_path(digest, 'png')
+    assert store.save(upload(b'lesion'), 'png', digest=digest) == relative
+    assert store.counters['stored'] == 1
+    assert store.counters['deduplicated'] == 1
+
+
+def test_compact_expires_before_evicting(store):
+    os.makedirs(store.root)
+    expired = [put_image(store.root, bytes([i]) * 100, age_days=40 + i) for i in range(3)]
+    kept_order = [put_image(store.root, bytes([10 + i]) * 100, age_days=5 - i) for i in range(5)]
+
+    # 8 images of 100 bytes: 3 are past 30 days, and the budget then leaves room for 3 of the other 5
+    summary = store.compact(max_age_days=30, max_bytes=300)
+
+    assert summary['expired'] == 3
+    assert summary['evicted'] == 2
+    assert summary['images'] == 3
+    assert summary['bytes'] == 300
+    assert summary['freed_bytes'] == 500
+    assert not any(os.path.exists(path) for path in expired)
+    # Eviction removes the least recently seen first
+    assert [os.path.exists(path) for path in kept_order] == [False, False, True, True, True]
+
+
+def test_compact_honours_byte_budget_with_uneven_sizes(store):
+    os.makedirs(store.root)
+    sizes = [400, 50, 300, 200, 100]  # oldest first
+    paths = [put_image(store.root, bytes([i]) * size, age_days=10 - i) for i, size in enumerate(sizes)]
+
+    summary = store.compact(max_bytes=450)
+
+    remaining = [os.path.getsize(path) for path in paths if os.path.exists(path)]
+    assert sum(remaining) <= 450
+    assert summary['bytes'] == sum(remaining)
+    # Eviction stops as soon as the store fits, so only the oldest three go
+    assert [os.path.exists(path) for path in paths] == [False, False, False, True, True]
+
+
+def test_compact_without_budgets_keeps_images(store):
+    os.makedirs(store.root)
+    paths = [put_image(store.root, bytes([i]) * 10, age_days=1000) for i in range(3)]
+    summary = store.compact()
+    assert summary['expired'] == summary['evicted'] == 0
+    assert all(os.path.exists(path) for path in paths)
+
+
+def test_compact_removes_empty_shards_and_stale_temp_files(store):
+    os.makedirs(os.path.join(store.root, 'ab', 'cd'))
+    stale = put_flat(store.root, '.incoming-stale', b'partial', age_days=0)
+    old = time.time() - STALE_TEMP_SECONDS - 60
+    os.utime(stale, (old, old))
+    fresh = put_flat(store.root, '.incoming-fresh', b'partial', age_days=0)
+    kept = put_image(store.root, b'kept', age_days=0)
+
+    summary = store.compact()
+
+    assert not os.path.exists(os.path.join(store.root, 'ab'))
+    assert summary['empty_shards_removed'] == 2
+    assert summary['stale_temp_files'] == 1
+    assert not os.path.exists(stale)
+    # A temporary file that may still be mid-write is left alone
+    assert os.path.exists(fresh)
+    assert os.path.exists(kept)
+
+
+def test_compact_dry_run_leaves_tree_untouched(store):
+    os.makedirs(os.path.join(store.root, 'ef', '01'))
+    for i in range(4):
+        put_image(store.root, bytes([i]) * 100, age_days=50 - 10 * i)
+    stale = put_flat(store.root, '.incoming-stale', b'partial', age_days=0)
+    old = time.time() - STALE_TEMP_SECONDS - 60
+    os.utime(stale, (old, old))
+    before = snapshot(store.root)
+
+    summary = store.compact(max_age_days=35, max_bytes=100, dry_run=True)
+
+    assert snapshot(store.root) == before
+    assert summary['dry_run'] is True
+    assert summary['expired'] == 2
+    assert summary['evicted'] == 1
+    assert summary['empty_shards_removed'] == 0
+    assert store.counters['compactions'] == 0
+    assert store.last_compaction is None
+
+
+def test_migrate_moves_flat_uploads_into_shards(store):
+    os.makedirs(store.root)
+    flat = put_flat(store.root, 'prediction_20240101_120000.JPEG', b'first', age_days=20)
+    mtime = os.stat(flat).st_mtime
+
+    summary = store.migrate()
+
+    target = os.path.join(store.root, shard_path(hashlib.sha256(b'first').hexdigest(), 'jpeg'))
+    assert summary == {'moved': 1, 'duplicates_removed': 0, 'skipped': 0, 'dry_run': False}
+    assert not os.path.exists(flat)
+    with open(target, 'rb') as f:
+        assert f.read() == b'first'
+    # The original upload time is what retention sees
+    assert os.stat(target).st_mtime == pytest.approx(mtime)
+
+
+def test_migrate_drops_duplicates_and_keeps_latest_mtime(store):
+    os.makedirs(store.root)
+    older = put_flat(store.root, 'prediction_old.jpg', b'same', age_days=30)
+    newer = put_flat(store.root, 'prediction_new.jpg', b'same', age_days=2)
+    newest_mtime = os.stat(newer).st_mtime
+    other = put_flat(store.root, 'prediction_other.png', b'other', age_days=1)
+    notes = put_flat(store.root, 'notes.txt', b'not an image', age_days=1)
+
+    summary = store.migrate()
+
+    assert summary == {'moved': 2, 'duplicates_removed': 1, 'skipped': 1, 'dry_run': False}
+    assert not os.path.exists(older) and not os.path.exists(newer) and not os.path.exists(other)
+    assert os.path.exists(notes)
+    target = os.path.join(store.root, shard_path(hashlib.sha256(b'same').hexdigest(), 'jpg'))
+    assert os.stat(target).st_mtime == pytest.approx(newest_mtime)
+    assert os.path.exists(os.path.join(store.root, shard_path(hashlib.sha256(b'other').hexdigest(), 'png')))
+
+
+def test_migrate_duplicate_of_already_sharded_image(store):
+    os.makedirs(store.root)
+    sharded = put_image(store.root, b'same', age_days=1)
+    sharded_mtime = os.stat(sharded).st_mtime
+    flat = put_flat(store.root, 'prediction_old.jpg', b'same', age_days=60)
+
+    summary = store.migrate()
+
+    assert summary['duplicates_removed'] == 1
+    assert not os.path.exists(flat)
+    # An older flat copy does not make the sharded image look older
+    assert os.stat(sharded).st_mtime == pytest.approx(sharded_mtime)
+
+
+def test_migrate_dry_run_leaves_tree_untouched(store):
+    os.makedirs(store.root)
+    put_flat(store.root, 'a.jpg', b'same', age_days=3)
+    put_flat(store.root, 'b.jpg', b'same', age_days=1)
+    put_flat(store.root, 'c.gif', b'gif', age_days=1)
+    put_flat(store.root, 'readme.md', b'text', age_days=1)
+    before = snapshot(store.root)
+
+    summary = store.migrate(dry_run=True)
+
+    assert snapshot(store.root) == before
+    assert summary == {'moved': 2, 'duplicates_removed': 1, 'skipped': 1, 'dry_run': True}
@@ -0,0 +1,99 @@
+"""
+Request traces and spans, without any web-framework dependency.
+
+A RequestTrace collects the timed stages of one request. profiling.py
+decides which requests are traced and makes the trace current for the
+request's context; code anywhere on the inference path (the admission
+queue, the predictor) then records stages with span() or record_span(),
+which cost one contextvar lookup when nothing is being traced.
+"""
+
+import contextvars
+import threading
+import time
+from datetime import datetime
+
+current_trace = contextvars.ContextVar('dermai_trace', default=None)
+
+
+class RequestTrace:
+    def __init__(self, request_id, method, path):
+        self.request_id = request_id
+        self.method = method
+        self.path = path
+        self.started = datetime.now().isoformat()
+        self.start = time.perf_counter()
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def add(self, name, start, end):
+        with self.lock:
+            self.spans.append({
+                'name': name,
+                'start_ms': (start - self.start) * 1000,
+                'duration_ms': (end - start) * 1000,
+                'thread': threading.current_thread().name
+            })
+
+    def finish(self, status):
+        return {
+            'request_id': self.request_id,
+            'method': self.method,
+            'path': self.path,
+            'status': status,
+            'started': self.started,
+            'total_ms': (time.perf_counter() - self.start) * 1000,
+            'spans': sorted(self.spans, key=lambda s: s['start_ms'])
+        }
+
+
+class _Span:
+    __slots__ = ('trace', 'name', 'timings', 'start')
+
+    def __init__(self, trace, name, timings=None):
+        self.trace = trace
+        self.name = name
+        self.timings = timings
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        if self.trace is not None:
+            self.trace.add(self.name, self.start, end)
+        if self.timings is not None:
+            self.timings[self.name] = (end - self.start) * 1000
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name, timings=None):
+    """Time a block as a stage of the current request's trace; a no-op when it is not traced.
+
+    With a timings dict the block is always timed and its milliseconds stored under name.
+    """
+    trace = current_trace.get()
+    if trace is None and timings is None:
+        return _NO_SPAN
+    return _Span(trace, name, timings)
+
+
+def record_span(name, start, end):
+    """Add an already-measured stage (perf_counter times) to the current trace, if any"""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add(name, start, end)
@@ -0,0 +1,284 @@
+"""
+Content-addressed upload storage with retention (DERMAI_UPLOAD_DIR).
+
+Accepted uploads used to be written as uploads/prediction_<timestamp>.<ext>
+into one flat directory that only ever grew. Now:
+- each upload is stored once under the SHA-256 of its bytes, sharded by
+  hash prefix: uploads/ab/cd/abcd...ef.jpg. A shard holds ~1/65536 of
+  the files, so listings and existence checks stay cheap at any size;
+- an identical upload is not written again. Its file's mtime is bumped,
+  so retention counts from the last time the image was seen;
+- writes go to a temporary file in the store root and are renamed into place,
+  so a reader never sees a partial image and concurrent workers storing
+  the same image cannot corrupt it;
+- a background job every DERMAI_UPLOAD_COMPACT_INTERVAL_S deletes images
+  older than DERMAI_UPLOAD_MAX_AGE_DAYS, then the oldest images until the
+  store is within DERMAI_UPLOAD_MAX_BYTES. It also compacts the tree by
+  removing empty shard directories and temporary files left by crashed
+  writes. It runs only when an age or size budget is set (0 = unlimited).
+
+The command line runs the same operations offline:
+    python upload_store.py migrate [--dry-run]   # move a flat uploads/ tree into the sharded layout
+    python upload_store.py compact --max-age-days 90 --max-gb 50
+"""
+
+import argparse
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_DIR = os.environ.get('DERMAI_UPLOAD_DIR', 'uploads')
+UPLOAD_MAX_AGE_DAYS = float(os.environ.get('DERMAI_UPLOAD_MAX_AGE_DAYS', 0))
+UPLOAD_MAX_BYTES = int(os.environ.get('DERMAI_UPLOAD_MAX_BYTES', 0))
+UPLOAD_COMPACT_INTERVAL_S = float(os.environ.get('DERMAI_UPLOAD_COMPACT_INTERVAL_S', 3600))
+
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp'}
+# Temporary files younger than this may still be in the middle of a write
+STALE_TEMP_SECONDS = 3600
+_TEMP_PREFIX = '.incoming-'
+
+
+def shard_path(digest, extension):
+    """Relative path of an image in the store: ab/cd/<digest>.<ext>"""
+    extension = 'jpg' if extension.lower() == 'jpeg' else extension.lower()
+    return os.path.join(digest[:2], digest[2:4], f'{digest}.{extension}')
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class UploadStore:
+    def __init__(self, root=UPLOAD_DIR, max_age_days=UPLOAD_MAX_AGE_DAYS, max_bytes=UPLOAD_MAX_BYTES,
+                 compact_interval=UPLOAD_COMPACT_INTERVAL_S):
+        self.root = root
+        self.max_age_days = max_age_days
+        self.max_bytes = max_bytes
+        self.compact_interval = compact_interval
+        self.lock = threading.Lock()
+        self.counters = {'stored': 0, 'deduplicated': 0, 'bytes_written': 0, 'compactions': 0,
+                         'expired': 0, 'evicted': 0}
+        self.last_compaction = None
+
+    def start(self):
+        """Run compact() every compact_interval seconds on a daemon thread, if a budget is set"""
+        if not (self.max_age_days or self.max_bytes):
+            return False
+        threading.Thread(target=self._compactor, name='upload-compactor', daemon=True).start()
+        return True
+
+    def _compactor(self):
+        while True:
+            try:
+                self.compact()
+            except Exception as e:
+                logger.error(f"Upload compaction failed: {str(e)}")
+            time.sleep(self.compact_interval)
+
+    def save(self, file, extension, digest=None):
+        """Store an upload (werkzeug FileStorage) under its content hash; returns the relative path.
+
+        digest is the upload's SHA-256 when the caller already has it (the prediction log's
+        input hash); otherwise it is computed while the file is written.
+        """
+        if digest is not None:
+            relative = shard_path(digest, extension)
+            if self._refresh(relative):
+                return relative
+
+        os.makedirs(self.root, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(prefix=_TEMP_PREFIX, dir=self.root)
+        try:
+            hasher = hashlib.sha256()
+            size = 0
+            file.stream.seek(0)
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in iter(lambda: file.stream.read(1 << 20), b''):
+                    hasher.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+            relative = shard_path(hasher.hexdigest(), extension)
+            if digest is None and self._refresh(relative):
+                os.unlink(temp_path)
+                return relative
+            target = os.path.join(self.root, relative)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            # mkstemp creates 0600; stored images get the usual file permissions
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, target)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+        with self.lock:
+            self.counters['stored'] += 1
+            self.counters['bytes_written'] += size
+        return relative
+
+    def _refresh(self, relative):
+        """True (and the mtime bumped) when the image is already stored"""
+        try:
+            os.utime(os.path.join(self.root, relative))
+        except FileNotFoundError:
+            return False
+        with self.lock:
+            self.counters['deduplicated'] += 1
+        return True
+
+    def _walk(self):
+        """(mtime, size, path) of every stored image, plus stale temporary files and shard directories"""
+        images, stale_temps, shards = [], [], []
+        now = time.time()
+        for level1 in os.scandir(self.root):
+            if level1.is_file() and level1.name.startswith(_TEMP_PREFIX):
+                if now - level1.stat().st_mtime > STALE_TEMP_SECONDS:
+                    stale_temps.append(level1.path)
+                continue
+            if not (level1.is_dir() and len(level1.name) == 2):
+                continue
+            for level2 in os.scandir(level1.path):
+                if not (level2.is_dir() and len(level2.name) == 2):
+                    continue
+                shards.append(level2.path)
+                for entry in os.scandir(level2.path):
+                    if entry.is_file():
+                        stat = entry.stat()
+                        images.append((stat.st_mtime, stat.st_size, entry.path))
+            shards.append(level1.path)
+        return images, stale_temps, shards
+
+    def compact(self, max_age_days=None, max_bytes=None, dry_run=False):
+        """Apply the age and size budgets and drop empty shards; returns a summary"""
+        max_age_days = self.max_age_days if max_age_days is None else max_age_days
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        start = time.perf_counter()
+        if not os.path.isdir(self.root):
+            return None
+        images, stale_temps, shards = self._walk()
+        images.sort()
+        total_bytes = sum(size for _, size, _ in images)
+
+        # images is oldest (least recently seen) first: expire a prefix, then evict the next oldest
+        first_kept = 0
+        if max_age_days:
+            cutoff = time.time() - max_age_days * 86400
+            while first_kept < len(images) and images[first_kept][0] < cutoff:
+                first_kept += 1
+        expired = images[:first_kept]
+        total_bytes -= sum(size for _, size, _ in expired)
+        if max_bytes:
+            while first_kept < len(images) and total_bytes > max_bytes:
+                total_bytes -= images[first_kept][1]
+                first_kept += 1
+        evicted = images[len(expired):first_kept]
+        images = images[first_kept:]
+
+        removed_dirs = 0
+        if not dry_run:
+            for _, _, path in expired + evicted:
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass  # removed by another worker's compaction
+            for path in stale_temps:
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            # Second-level shards come before their parents, so a parent emptied here is removed too
+            for path in shards:
+                try:
+                    os.rmdir(path)
+                    removed_dirs += 1
+                except OSError:
+                    pass
+
+        summary = {
+            'images': len(images),
+            'bytes': total_bytes,
+            'expired': len(expired),
+            'evicted': len(evicted),
+            'freed_bytes': sum(size for _, size, _ in expired + evicted),
+            'stale_temp_files': len(stale_temps),
+            'empty_shards_removed': removed_dirs,
+            'duration_ms': (time.perf_counter() - start) * 1000,
+            'dry_run': dry_run,
+            'finished': time.time()
+        }
+        if not dry_run:
+            with self.lock:
+                self.counters['compactions'] += 1
+                self.counters['expired'] += len(expired)
+                self.counters['evicted'] += len(evicted)
+                self.last_compaction = summary
+        return summary
+
+    def migrate(self, dry_run=False):
+        """Move images stored flat in the root into the sharded layout, dropping duplicates"""
+        moved = duplicates = skipped = 0
+        # Targets this run has moved (or, in a dry run, would have moved) an image to
+        claimed = set()
+        for entry in os.scandir(self.root):
+            if not entry.is_file() or entry.name.startswith(_TEMP_PREFIX):
+                continue
+            extension = entry.name.rsplit('.', 1)[-1].lower() if '.' in entry.name else ''
+            if extension not in IMAGE_EXTENSIONS:
+                skipped += 1
+                continue
+            relative = shard_path(file_sha256(entry.path), extension)
+            target = os.path.join(self.root, relative)
+            if target in claimed or os.path.exists(target):
+                duplicates += 1
+                if not dry_run:
+                    # Keep the most recent sighting as the retention age
+                    mtime = max(os.stat(target).st_mtime, entry.stat().st_mtime)
+                    os.utime(target, (mtime, mtime))
+                    os.unlink(entry.path)
+                continue
+            moved += 1
+            claimed.add(target)
+            if not dry_run:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                # A rename keeps the mtime, so retention sees the original upload time
+                os.replace(entry.path, target)
+        return {'moved': moved, 'duplicates_removed': duplicates, 'skipped': skipped, 'dry_run': dry_run}
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats['last_compaction'] = self.last_compaction
+        stats['root'] = os.path.abspath(self.root)
+        stats['max_age_days'] = self.max_age_days
+        stats['max_bytes'] = self.max_bytes
+        return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Maintain the sharded upload store')
+    parser.add_argument('command', choices=['migrate', 'compact'])
+    parser.add_argument('--root', default=UPLOAD_DIR)
+    parser.add_argument('--max-age-days', type=float, default=UPLOAD_MAX_AGE_DAYS, help='0 = no age limit')
+    parser.add_argument('--max-gb', type=float, default=UPLOAD_MAX_BYTES / 2 ** 30, help='0 = no size limit')
+    parser.add_argument('--dry-run', action='store_true', help='Report what would change without changing it')
+    args = parser.parse_args()
+
+    store = UploadStore(args.root, max_age_days=args.max_age_days, max_bytes=int(args.max_gb * 2 ** 30))
+    if not os.path.isdir(store.root):
+        parser.error(f"{store.root} does not exist")
+    if args.command == 'migrate':
+        print(store.migrate(dry_run=args.dry_run))
+    print(store.compact(dry_run=args.dry_run))
+
+
+if __name__ == '__main__':
+    main()